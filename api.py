@@ -1,61 +1,409 @@
-
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 import asyncio
+import json
+import os
+import socket
 import uuid
-import pandas as pd
-from pipeline import run_full_pipeline
+from core import bundle, jobstore, store, tracing, uploads
+from core.tasks import HEAVY_MODULES
+from core.executor import JobExecutor, JobCancelledError
+from pipeline import run_pipeline_job, PIPELINE_VERSION
+
+UPLOAD_DIR = uploads.UPLOAD_DIR
+
+# Set NARRATOR_WARMUP=1 to import the pipeline's heavy libraries at startup rather than in each job.
+WARMUP = os.environ.get("NARRATOR_WARMUP", "0") == "1"
+
+# Most jobs waiting in the shared job queue, across all API processes; /analyze responds 429 beyond it.
+MAX_QUEUE = int(os.environ.get("NARRATOR_MAX_QUEUE", 16))
+# Seconds between checks of the shared job queue for work and cancellations.
+DISPATCH_INTERVAL = float(os.environ.get("NARRATOR_DISPATCH_INTERVAL", 0.5))
+# Seconds between garbage collections of finished jobs.
+GC_INTERVAL = 60
+# Seconds between reads of a job's progress while streaming its events, and between keep-alive comments.
+EVENT_INTERVAL = float(os.environ.get("NARRATOR_EVENT_INTERVAL", 0.25))
+KEEPALIVE_INTERVAL = 15
+# Bytes of a multipart /analyze request besides the file itself: boundaries, part headers and the other fields.
+FORM_OVERHEAD = 64 * 1024
+
+executor = JobExecutor()
+jobs = jobstore.get_store()
+# Identifies this API process as the owner of the jobs it runs; several processes (uvicorn --workers N)
+# share the job store and each runs at most executor.max_workers jobs.
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_wake = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _wake
+    if WARMUP:
+        print("Warming up job workers...")
+        await run_in_threadpool(executor.warm_up, ["pipeline"] + HEAVY_MODULES)
+    _wake = asyncio.Event()
+    dispatcher = asyncio.create_task(_dispatch())
+    yield
+    dispatcher.cancel()
+    executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def limit_form_size(request: Request, call_next):
+    """
+    Rejects a multipart /analyze request whose Content-Length already exceeds the upload limit, before the form
+    parser spools its body to disk. Larger files go through the resumable upload endpoints.
+    """
+    if request.method == "POST" and request.url.path == "/analyze":
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > uploads.MAX_UPLOAD_BYTES + FORM_OVERHEAD:
+            return JSONResponse(status_code=413, content={
+                "message": f"Uploads are limited to {uploads.MAX_UPLOAD_BYTES} bytes. Use POST /uploads for large files."})
+    return await call_next(request)
+
+async def _dispatch():
+    """
+    Runs jobs from the shared queue: claims pending jobs while this process has a free job slot,
+    and cancels its running jobs that were asked to cancel through any process.
+    """
+    last_gc = 0.0
+    while True:
+        try:
+            loop = asyncio.get_running_loop()
+            if loop.time() - last_gc > GC_INTERVAL:
+                last_gc = loop.time()
+                # Executor jobs time out after job_timeout, so a job running longer has lost its worker.
+                await run_in_threadpool(jobs.remove_expired, executor.job_timeout + GC_INTERVAL)
+            for job_id in await run_in_threadpool(jobs.cancel_requests, WORKER_ID):
+                executor.cancel(job_id)
+            while executor.active < executor.max_workers:
+                job = await run_in_threadpool(jobs.claim, WORKER_ID)
+                if job is None:
+                    break
+                _start_job(job)
+        except Exception as e:
+            print(f"Warning: Could not dispatch jobs. Error: {e}")
+        try:
+            await asyncio.wait_for(_wake.wait(), DISPATCH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+def _start_job(job):
+    params = job["params"]
+    task = executor.submit(job["id"], run_pipeline_job, params["upload_path"], params["file_name"],
+                           params["target_cols"], store.report_dir(job["key"]), job["id"], params.get("profile"))
+    task.add_done_callback(lambda task: _finish_task(job["id"], task, params["upload_path"]))
+
+@app.post("/uploads")
+async def create_upload(file_name: str = Form(...), size: int | None = Form(None)):
+    """
+    This endpoint starts a resumable upload for very large files. Send the data with PATCH /uploads/{upload_id},
+    finish it with POST /uploads/{upload_id}/complete and pass the upload_id to /analyze.
+    """
+    try:
+        upload_id = await run_in_threadpool(uploads.create_upload, file_name, size)
+    except uploads.UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"message": str(e)})
+    return {"upload_id": upload_id, "offset": 0}
 
-app = FastAPI()
+@app.patch("/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """
+    This endpoint appends the raw request body to an upload. The Upload-Offset header must equal the bytes received so
+    far (see GET /uploads/{upload_id}); after a dropped connection, the client resumes from there.
+    """
+    try:
+        spool = await run_in_threadpool(uploads.open_chunk, upload_id, upload_offset)
+    except uploads.UploadNotFoundError:
+        return JSONResponse(status_code=404, content={"message": "Upload not found"})
+    except uploads.OffsetMismatchError as e:
+        return JSONResponse(status_code=409, content={"message": str(e), "offset": e.expected})
+    except uploads.UploadBusyError:
+        return JSONResponse(status_code=409, content={"message": "Another chunk of this upload is being written."})
+    too_large = None
+    try:
+        # The body is written as it arrives, so memory use does not depend on the chunk size.
+        async for chunk in request.stream():
+            await run_in_threadpool(spool.write, chunk)
+    except uploads.UploadTooLargeError as e:
+        too_large = e
+    finally:
+        offset = await run_in_threadpool(uploads.finish_chunk, spool, upload_id)
+    if too_large:
+        return JSONResponse(status_code=413, content={"message": str(too_large), "offset": offset})
+    return {"upload_id": upload_id, "offset": offset}
 
-tasks = {}
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """
+    This endpoint returns how many bytes of an upload have been received and whether it is complete.
+    """
+    try:
+        return uploads.upload_status(upload_id)
+    except uploads.UploadNotFoundError:
+        return JSONResponse(status_code=404, content={"message": "Upload not found"})
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, sha256: str | None = Form(None)):
+    """
+    This endpoint finishes an upload, checking its size and, when given, its SHA-256 checksum.
+    """
+    try:
+        digest = await run_in_threadpool(uploads.complete_upload, upload_id, sha256)
+    except uploads.UploadNotFoundError:
+        return JSONResponse(status_code=404, content={"message": "Upload not found"})
+    except uploads.OffsetMismatchError as e:
+        return JSONResponse(status_code=409, content={"message": "Upload is incomplete.", "offset": e.expected})
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"message": str(e)})
+    return {"upload_id": upload_id, "sha256": digest}
 
 @app.post("/analyze")
-async def analyze(file: UploadFile = File(...), target_col: str = Form(...)):
+async def analyze(target_col: list[str] = Form(...), file: UploadFile | None = File(None),
+                  upload_id: str | None = Form(None), profile: bool = Form(False)):
     """
-    This endpoint accepts a file upload and a target column, adds the analysis tasks to a task queue and returns a task_id.
+    This endpoint accepts a file upload, or the upload_id of a completed resumable upload, and one or more target
+    columns (repeat the target_col field), adds the analysis tasks to a task queue and returns a task_id. All targets
+    are analyzed in one job and reported together.
+    If the same file was already analyzed for the same targets, the stored report is returned right away.
+    Responds with 429 when the job queue is full and 413 when the file exceeds the upload limit.
+    With profile=true the job runs under cProfile; see GET /reports/{task_id}/profile.
     """
+    if (file is None) == (upload_id is None):
+        return JSONResponse(status_code=400, content={"message": "Send either a file or an upload_id."})
+    if await run_in_threadpool(jobs.count, ("pending",)) >= MAX_QUEUE:
+        return JSONResponse(status_code=429, content={"message": "Too many analyses in progress. Please retry later."})
+
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {"status": "pending", "result": None}
-    
-    # In a real implementation, this would be a background task
-    # For now, we'll run it asynchronously here
-    asyncio.create_task(run_analysis(task_id, file, target_col))
-    
-    return {"task_id": task_id}
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload_path = os.path.join(UPLOAD_DIR, task_id)
+    if file is not None:
+        file_name = file.filename
+        try:
+            digest = await run_in_threadpool(_save_upload, file, upload_path)
+        except uploads.UploadTooLargeError as e:
+            return JSONResponse(status_code=413, content={"message": str(e)})
+    else:
+        try:
+            file_name, digest = await run_in_threadpool(uploads.claim_upload, upload_id, upload_path)
+        except uploads.UploadNotFoundError:
+            return JSONResponse(status_code=404, content={"message": "Upload not found"})
+        except uploads.OffsetMismatchError:
+            return JSONResponse(status_code=409, content={"message": "Upload is not complete."})
+
+    key = store.report_key(digest, target_col, PIPELINE_VERSION)
+    report_path = store.lookup(key)
+    if report_path:
+        os.remove(upload_path)
+        await run_in_threadpool(jobs.create, task_id, key, status="completed", result=report_path)
+        return {"task_id": task_id, "cached": True}
+
+    params = {"upload_path": upload_path, "file_name": file_name, "target_cols": target_col, "profile": profile or None}
+    await run_in_threadpool(jobs.create, task_id, key, params)
+    _wake.set()
+
+    return {"task_id": task_id, "cached": False}
 
 @app.get("/status/{task_id}")
 async def get_status(task_id: str):
     """
     This endpoint returns the status of a given task.
     """
-    task = tasks.get(task_id)
+    task = await run_in_threadpool(jobs.get, task_id)
     if not task:
         return JSONResponse(status_code=404, content={"message": "Task not found"})
-    return {"status": task["status"]}
+    return {"status": task["status"], "timings": task["timings"]}
 
 @app.get("/results/{task_id}")
 async def get_results(task_id: str):
     """
     This endpoint returns the results of a completed analysis in JSON format.
     """
-    task = tasks.get(task_id)
+    task = await run_in_threadpool(jobs.get, task_id)
     if not task:
         return JSONResponse(status_code=404, content={"message": "Task not found"})
     if task["status"] != "completed":
         return {"status": task["status"], "message": "Analysis is not yet complete."}
-    return {"status": task["status"], "result": task["result"]}
+    return {"status": task["status"], "result": task["result"], "report_url": f"/reports/{task_id}"}
 
-async def run_analysis(task_id: str, file: UploadFile, target_col: str):
+@app.get("/events/{task_id}")
+async def stream_events(task_id: str, request: Request):
     """
-    This function simulates running the analysis in the background.
+    This endpoint streams a task's progress as server-sent events: a 'progress' event per finished pipeline stage
+    (ingestion, cleaning, analysis, modeling, narration k/N, report) and a final 'done' event with the task's status
+    and, when it completed, the URL of its report.
     """
-    tasks[task_id]["status"] = "in_progress"
+    task = await run_in_threadpool(jobs.get, task_id)
+    if not task:
+        return JSONResponse(status_code=404, content={"message": "Task not found"})
+    return StreamingResponse(_events(task_id, request), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+async def _events(task_id: str, request: Request):
+    # Jobs run in other processes, possibly under another API worker, and publish progress through the job store.
+    # Reading it here every EVENT_INTERVAL keeps the push delay short without any client polling.
+    loop = asyncio.get_running_loop()
+    sent, last_write = None, loop.time()
+    while not await request.is_disconnected():
+        task = await run_in_threadpool(jobs.get, task_id)
+        if task is None:
+            yield _event("done", {"status": "expired"})
+            return
+        state = (task["status"], (task["progress"] or {}).get("seq"))
+        if state != sent:
+            sent, last_write = state, loop.time()
+            yield _event("progress", {"status": task["status"], **(task["progress"] or {})})
+        if task["status"] in jobstore.FINISHED:
+            done = {"status": task["status"]}
+            if task["status"] == "completed":
+                done["report_url"] = f"/reports/{task_id}"
+            elif task["status"] == "failed":
+                done["message"] = task["result"]
+            yield _event("done", done)
+            return
+        if loop.time() - last_write > KEEPALIVE_INTERVAL:
+            last_write = loop.time()
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(EVENT_INTERVAL)
+
+async def _report_dir(task_id: str):
+    task = await run_in_threadpool(jobs.get, task_id)
+    if not task or task["status"] != "completed":
+        return None
+    return store.report_dir(task["key"])
+
+async def _report_path(task_id: str):
+    directory = await _report_dir(task_id)
+    path = directory and os.path.join(directory, store.REPORT_FILENAME)
+    return path if path and os.path.isfile(path) else None
+
+@app.get("/reports/{task_id}")
+async def get_report(task_id: str):
+    """
+    This endpoint returns the report of a completed analysis without its figures, which are only read from the
+    report bundle. Each insight's 'figure' is the [offset, length] byte range of its compressed plotly JSON in
+    the file at bundle_url, or null; fetch it with a Range request and zlib-decompress it.
+    """
+    report_path = await _report_path(task_id)
+    if not report_path:
+        return JSONResponse(status_code=404, content={"message": "Report not found"})
+    report = await run_in_threadpool(bundle.read_report, report_path)
+    report["bundle_url"] = f"/reports/{task_id}/bundle"
+    return report
+
+@app.get("/reports/{task_id}/bundle")
+async def get_bundle(task_id: str):
+    """
+    This endpoint serves the report bundle of a completed analysis (see core.bundle). It honours Range requests,
+    so that a client can read one figure's byte range on demand.
+    """
+    report_path = await _report_path(task_id)
+    if not report_path:
+        return JSONResponse(status_code=404, content={"message": "Report not found"})
+    return FileResponse(report_path, media_type="application/octet-stream")
+
+@app.get("/reports/{task_id}/profile")
+async def get_profile(task_id: str):
+    """
+    This endpoint returns the cProfile summary of a completed analysis that ran with profiling enabled.
+    """
+    directory = await _report_dir(task_id)
+    path = directory and os.path.join(directory, "profile.txt")
+    if not path or not os.path.isfile(path):
+        return JSONResponse(status_code=404, content={"message": "Profile not found"})
+    return FileResponse(path, media_type="text/plain")
+
+@app.get("/metrics")
+async def metrics():
+    """
+    This endpoint exposes job and per-stage metrics in the Prometheus text format. Histograms cover the jobs finished
+    by this API process; the job counts cover the shared job store.
+    """
+    gauges = {
+        "narrator_jobs_pending": await run_in_threadpool(jobs.count, ("pending",)),
+        "narrator_jobs_running": await run_in_threadpool(jobs.count, ("in_progress",)),
+        "narrator_worker_active_jobs": executor.active,
+    }
+    return PlainTextResponse(tracing.render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
+@app.post("/cancel/{task_id}")
+async def cancel_task(task_id: str):
+    """
+    This endpoint cancels a queued or running analysis. A running analysis is stopped by the API process running
+    it, within NARRATOR_DISPATCH_INTERVAL seconds.
+    """
+    task = await run_in_threadpool(jobs.get, task_id)
+    if not task:
+        return JSONResponse(status_code=404, content={"message": "Task not found"})
+    status = await run_in_threadpool(jobs.request_cancel, task_id)
+    if status == "cancelled" and task["status"] == "pending":
+        upload_path = task["params"]["upload_path"]
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        return {"status": "cancelled"}
+    if status != "in_progress":
+        return JSONResponse(status_code=409, content={"message": f"Task is already {status}."})
+    if task["owner"] == WORKER_ID:
+        executor.cancel(task_id)
+    return {"status": "cancelling"}
+
+def _save_upload(file: UploadFile, upload_path: str) -> str:
+    """
+    Copies the uploaded file to disk in chunks so the job process can read it after the request has ended.
+    Returns the SHA-256 digest of the file contents.
+    """
+    spool = uploads.Spool(upload_path)
     try:
-        data = pd.read_csv(file.file)
-        report_path = run_full_pipeline(file.filename, data, target_col)
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["result"] = report_path
+        for chunk in iter(lambda: file.file.read(uploads.CHUNK_SIZE), b''):
+            spool.write(chunk)
+    except BaseException:
+        spool.abort()
+        raise
+    spool.close()
+    return spool.digest.hexdigest()
+
+def _observe(task_id: str, status: str, report_path):
+    """Adds a finished job, and the stage trace of its report, to the metrics."""
+    task = jobs.get(task_id)
+    seconds = ((task or {}).get("timings") or {}).get("seconds")
+    stages = []
+    if status == "completed" and report_path:
+        try:
+            stages = bundle.read_index(report_path).get("trace", [])
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read the trace of task {task_id}. Error: {e}")
+    tracing.observe_job(status, seconds, stages)
+
+def _finish_task(task_id: str, job, upload_path: str):
+    """
+    Records the outcome of a finished job and removes its uploaded file.
+    """
+    try:
+        status, result = "completed", job.result()
+    except (JobCancelledError, asyncio.CancelledError):
+        status, result = "cancelled", None
     except Exception as e:
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["result"] = str(e)
+        status, result = "failed", str(e)
+    loop = asyncio.get_running_loop()
+
+    def record():
+        jobs.finish(task_id, status, result)
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        _observe(task_id, status, result)
+        store.evict(protect=jobs.active_keys())
+
+    def report(future):
+        # Nothing awaits the recording, so its errors are logged here rather than lost.
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Warning: Could not record the outcome of task {task_id}. Error: {future.exception()}")
+
+    loop.run_in_executor(None, record).add_done_callback(report)
+    # A job slot is free: look for the next job right away.
+    _wake.set()
@@ -1,11 +1,11 @@
 import streamlit as st
-import streamlit.components.v1 as components
-import os
 import json
 import pandas as pd
+import hashlib
+import plotly.io as pio
 import requests
-import time
-from core.cleaning import load_data
+from core.bundle import decode
+from core.ingestion import read_columns
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -16,6 +16,86 @@ st.set_page_config(
 
 # --- API Configuration ---
 API_URL = "http://127.0.0.1:8000"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 3
+# Insights whose figures are fetched with the report; the others are fetched when opened.
+EAGER_FIGURES = 3
+
+
+def upload_in_chunks(uploaded_file):
+    """
+    Sends a file to the API's resumable upload endpoint one chunk at a time, resuming from the
+    server's offset after a failed chunk. Returns the upload id to pass to /analyze.
+    """
+    size = uploaded_file.size
+    response = requests.post(f"{API_URL}/uploads", data={'file_name': uploaded_file.name, 'size': size})
+    response.raise_for_status()
+    upload_id = response.json()['upload_id']
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    offset, retries = 0, 0
+    while offset < size:
+        uploaded_file.seek(offset)
+        chunk = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+        try:
+            response = requests.patch(f"{API_URL}/uploads/{upload_id}", data=chunk,
+                                      headers={'Upload-Offset': str(offset)})
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            retries += 1
+            if retries > UPLOAD_RETRIES:
+                raise
+            # Resume from whatever the server actually received.
+            offset = requests.get(f"{API_URL}/uploads/{upload_id}").json()['offset']
+            continue
+        offset = response.json()['offset']
+    uploaded_file.seek(0)
+    response = requests.post(f"{API_URL}/uploads/{upload_id}/complete", data={'sha256': digest.hexdigest()})
+    response.raise_for_status()
+    return upload_id
+
+# The stages of run_full_pipeline in order, and the share of the progress bar reached when each one finishes.
+STAGE_PROGRESS = {'ingestion': 0.1, 'cleaning': 0.2, 'analysis': 0.35, 'modeling': 0.5, 'narration': 0.95, 'report': 1.0}
+
+
+def stream_events(task_id):
+    """
+    Subscribes to the API's server-sent events for a task and yields (event, data) pairs until the
+    connection closes.
+    """
+    with requests.get(f"{API_URL}/events/{task_id}", stream=True, timeout=(10, None)) as response:
+        response.raise_for_status()
+        event = 'message'
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                yield event, json.loads(line[len('data:'):])
+                event = 'message'
+
+
+def progress_fraction(data):
+    """Maps a progress event to the fraction of the progress bar to fill."""
+    stage = data.get('stage')
+    if stage == 'narration' and data.get('total'):
+        return STAGE_PROGRESS['modeling'] + (STAGE_PROGRESS['narration'] - STAGE_PROGRESS['modeling']) * data['done'] / data['total']
+    return STAGE_PROGRESS.get(stage, 0.0)
+
+
+@st.cache_data(show_spinner=False)
+def fetch_figure(bundle_url, offset, length):
+    """
+    Fetches one figure's byte range of a report bundle from the API and returns its plotly JSON,
+    or None.
+    """
+    response = requests.get(f"{API_URL}{bundle_url}", headers={'Range': f"bytes={offset}-{offset + length - 1}"})
+    if response.status_code == 206:
+        return decode(response.content)
+    if response.status_code == 200:  # The whole bundle, from a server that ignored the range.
+        return decode(response.content[offset:offset + length])
+    return None
 
 # --- Sidebar ---
 st.sidebar.title("NarratorAI 🤖")
@@ -23,8 +103,8 @@ st.sidebar.markdown("From Raw Data to Compelling Narrative. Automatically.")
 st.sidebar.markdown("---")
 st.sidebar.markdown("""
 **How it works:**
-1.  **Upload** your CSV data.
-2.  **Select** the column you want to understand or predict (your "target").
+1.  **Upload** your data (CSV, Parquet, Feather/Arrow or NDJSON, optionally compressed).
+2.  **Select** the column(s) you want to understand or predict (your "targets").
 3.  **Our AI pipeline** analyzes the data to find the key drivers for your target.
 4.  **Receive** a full data story with text, charts, and key insights.
 """)
@@ -34,7 +114,8 @@ st.title("📊 Automated Data Storytelling Bot")
 st.markdown("Upload your dataset, select a target column, and let our AI do the rest.")
 
 # File Uploader
-uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+uploaded_file = st.file_uploader("Choose a data file",
+                                 type=["csv", "parquet", "feather", "arrow", "ndjson", "jsonl", "json", "gz", "zst"])
 
 # Initialize session state
 if 'task_id' not in st.session_state:
@@ -46,27 +127,26 @@ if 'report' not in st.session_state:
 
 if uploaded_file is not None:
     try:
-        df_cols = load_data(uploaded_file, uploaded_file.name)
-        column_options = df_cols.columns.tolist()
-        uploaded_file.seek(0)
+        # Only the header and first rows are needed to list the columns.
+        df_head = read_columns(uploaded_file, uploaded_file.name)
+        column_options = df_head.columns.tolist()
 
-        st.info("Step 2: Select the column you want to analyze or predict.")
-        target_col = st.selectbox(
-            "Which column is your primary target?",
+        st.info("Step 2: Select the column(s) you want to analyze or predict.")
+        target_cols = st.multiselect(
+            "Which columns are your targets?",
             options=column_options,
-            index=len(column_options) - 1
+            default=column_options[-1:]
         )
         
-        if st.button(f"Analyze '{target_col}'", type="primary"):
+        if st.button(f"Analyze {', '.join(repr(col) for col in target_cols)}", type="primary", disabled=not target_cols):
             st.session_state.analysis_done = False
             st.session_state.report = None
             st.session_state.task_id = None
 
             with st.spinner("Sending your request to the analysis engine..."):
-                files = {'file': (uploaded_file.name, uploaded_file.getvalue(), 'text/csv')}
-                data = {'target_col': target_col}
                 try:
-                    response = requests.post(f"{API_URL}/analyze", files=files, data=data)
+                    upload_id = upload_in_chunks(uploaded_file)
+                    response = requests.post(f"{API_URL}/analyze", data={'target_col': target_cols, 'upload_id': upload_id})
                     if response.status_code == 200:
                         st.session_state.task_id = response.json().get('task_id')
                         st.success("Analysis started! You can see the progress below.")
@@ -79,38 +159,27 @@ if uploaded_file is not None:
         st.error(f"Could not read the uploaded file. Please check the format. Error: {e}")
 
 if st.session_state.task_id and not st.session_state.analysis_done:
-    with st.spinner("Polling for analysis status..."):
-        while True:
-            try:
-                status_response = requests.get(f"{API_URL}/status/{st.session_state.task_id}")
-                if status_response.status_code == 200:
-                    status = status_response.json().get('status')
-                    if status == 'completed':
-                        results_response = requests.get(f"{API_URL}/results/{st.session_state.task_id}")
-                        if results_response.status_code == 200:
-                            report_path = results_response.json().get('result')
-                            if report_path and os.path.exists(report_path):
-                                with open(report_path, 'r') as f:
-                                    st.session_state.report = json.load(f)
-                                st.session_state.analysis_done = True
-                                st.rerun()
-                            else:
-                                st.error("Analysis complete, but the report file was not found.")
-                                break
-                        else:
-                            st.error(f"Failed to get results: {results_response.text}")
-                            break
-                    elif status == 'failed':
-                        st.error("Analysis failed. Please check the logs.")
-                        break
+    progress_bar = st.progress(0.0, text="Waiting for the analysis to start...")
+    try:
+        for event, data in stream_events(st.session_state.task_id):
+            if event == 'progress':
+                progress_bar.progress(progress_fraction(data), text=data.get('message') or data['status'])
+            elif event == 'done':
+                if data['status'] == 'completed':
+                    report_response = requests.get(f"{API_URL}{data['report_url']}")
+                    if report_response.status_code == 200:
+                        st.session_state.report = report_response.json()
+                        st.session_state.analysis_done = True
+                        st.rerun()
                     else:
-                        time.sleep(5) # Poll every 5 seconds
+                        st.error(f"Analysis complete, but the report could not be fetched: {report_response.text}")
+                elif data['status'] == 'failed':
+                    st.error(f"Analysis failed: {data.get('message')}")
                 else:
-                    st.error(f"Failed to get status: {status_response.text}")
-                    break
-            except requests.exceptions.ConnectionError as e:
-                st.error(f"Could not connect to the analysis engine. Please make sure the API is running. Error: {e}")
+                    st.warning(f"Analysis {data['status']}.")
                 break
+    except requests.exceptions.ConnectionError as e:
+        st.error(f"Could not connect to the analysis engine. Please make sure the API is running. Error: {e}")
 
 # Display the report if analysis is done
 if st.session_state.analysis_done and st.session_state.report:
@@ -130,10 +199,12 @@ if st.session_state.analysis_done and st.session_state.report:
         
         with col2:
             st.markdown("**📊 Supporting Visualization:**")
-            if insight['plot_path'] and os.path.exists(insight['plot_path']):
-                with open(insight['plot_path'], 'r', encoding='utf-8') as plot_file:
-                    plot_html = plot_file.read()
-                components.html(plot_html, height=450, scrolling=True)
-            else:
+            if not insight.get('figure'):
                 st.warning("No visualization was generated for this insight.")
+            elif i < EAGER_FIGURES or st.toggle("Show visualization", key=f"figure_{i}"):
+                figure = fetch_figure(report['bundle_url'], *insight['figure'])
+                if figure:
+                    st.plotly_chart(pio.from_json(figure), key=f"chart_{i}")
+                else:
+                    st.warning("The visualization could not be loaded.")
         st.markdown("---")
@@ -0,0 +1,91 @@
+"""
+Load benchmark for the analysis API.
+
+Submits N concurrent analyses to a running API (`uvicorn api:app`) and, while they run,
+keeps polling `/status` to measure how responsive the HTTP layer stays. Reports the
+p50/p99 latency of `/status` and how many submissions were rejected with 429.
+
+    python benchmarks/bench_api_status.py --jobs 8 --rows 200000
+"""
+import argparse
+import io
+import statistics
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+
+
+def make_csv(rows, seed=0):
+    """Builds a synthetic CSV with a few correlated numeric columns, a category and a target."""
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=rows)
+    df = pd.DataFrame({
+        "feature_a": x,
+        "feature_b": 2 * x + rng.normal(scale=0.5, size=rows),
+        "feature_c": rng.uniform(size=rows),
+        "region": rng.choice(["north", "south", "east", "west"], size=rows),
+        "score": 3 * x + rng.normal(size=rows),
+    })
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue().encode()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /status latency under concurrent analyses.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--jobs", type=int, default=8, help="Number of concurrent analyses to submit.")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in the synthetic dataset.")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    payload = make_csv(args.rows)
+    task_ids, rejected = [], 0
+    lock = threading.Lock()
+
+    def submit():
+        nonlocal rejected
+        files = {'file': ('bench.csv', payload, 'text/csv')}
+        response = requests.post(f"{args.url}/analyze", files=files, data={'target_col': 'score'})
+        with lock:
+            if response.status_code == 429:
+                rejected += 1
+            else:
+                response.raise_for_status()
+                task_ids.append(response.json()['task_id'])
+
+    started = time.perf_counter()
+    submitters = [threading.Thread(target=submit) for _ in range(args.jobs)]
+    for t in submitters:
+        t.start()
+    for t in submitters:
+        t.join()
+
+    latencies, pending = [], set(task_ids)
+    while pending:
+        for task_id in list(pending):
+            t0 = time.perf_counter()
+            status = requests.get(f"{args.url}/status/{task_id}").json()['status']
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if status in ('completed', 'failed', 'cancelled'):
+                pending.discard(task_id)
+        time.sleep(args.poll_interval)
+    elapsed = time.perf_counter() - started
+
+    print(f"jobs submitted: {len(task_ids)}, rejected (429): {rejected}, wall time: {elapsed:.1f}s")
+    if latencies:
+        print(f"/status requests: {len(latencies)}")
+        print(f"/status latency p50: {percentile(latencies, 50):.1f} ms, "
+              f"p99: {percentile(latencies, 99):.1f} ms, mean: {statistics.mean(latencies):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
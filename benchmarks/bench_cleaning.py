@@ -0,0 +1,80 @@
+"""
+Memory/time benchmark for the cleaning stage.
+
+Builds a synthetic wide, dirty frame (default 1M rows x 200 columns: floats, integers, numbers
+stored as strings and low-cardinality strings, all with missing values) and runs
+`clean_and_preprocess_data` on it. Reports wall time, the frame's memory before and after
+cleaning, and the process's peak RSS.
+
+    python benchmarks/bench_cleaning.py --rows 1000000 --cols 200
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.cleaning import clean_and_preprocess_data
+
+
+def make_frame(rows, cols, null_ratio=0.05, seed=0):
+    """
+    Mixes 70% float, 10% integer, 10% numeric-string and 10% categorical columns.
+    """
+    rng = np.random.default_rng(seed)
+    n_int = n_str_num = n_cat = max(1, cols // 10)
+    n_float = cols - n_int - n_str_num - n_cat
+    data = {}
+    for i in range(n_float):
+        values = rng.standard_normal(rows) * (i + 1)
+        values[rng.random(rows) < null_ratio] = np.nan
+        data[f"float_{i}"] = values
+    for i in range(n_int):
+        data[f"int_{i}"] = rng.integers(0, 1000, rows)
+    for i in range(n_str_num):
+        values = np.round(rng.standard_normal(rows), 3).astype(str).astype(object)
+        values[rng.random(rows) < null_ratio] = None
+        data[f"numstr_{i}"] = values
+    levels = np.array([f"level_{k}" for k in range(20)], dtype=object)
+    for i in range(n_cat):
+        values = levels[rng.integers(0, len(levels), rows)]
+        values[rng.random(rows) < null_ratio] = None
+        data[f"cat_{i}"] = values
+    return pd.DataFrame(data)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning stage on a synthetic frame.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cols", type=int, default=200)
+    parser.add_argument("--null-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"Building a {args.rows} x {args.cols} frame...")
+    df = make_frame(args.rows, args.cols, args.null_ratio)
+    before_mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+    rss_before = peak_rss_mb()
+
+    started = time.perf_counter()
+    df_clean, metadata = clean_and_preprocess_data(df)
+    elapsed = time.perf_counter() - started
+
+    after_mb = df_clean.memory_usage(deep=True).sum() / 1024 ** 2
+    mask_mb = sum(len(m) for m in metadata["outlier_masks"].values()) / 1024 ** 2
+    print(f"cleaning time: {elapsed:.2f}s")
+    print(f"frame memory: {before_mb:.0f} MB -> {after_mb:.0f} MB")
+    print(f"outlier columns: {len(metadata['outliers'])}, outlier bitmaps: {mask_mb:.1f} MB")
+    print(f"peak RSS: {rss_before:.0f} MB before cleaning, {peak_rss_mb():.0f} MB after")
+
+
+if __name__ == "__main__":
+    main()
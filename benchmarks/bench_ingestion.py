@@ -0,0 +1,80 @@
+"""
+Parse throughput of the ingestion layer per input format.
+
+Writes one synthetic mixed-type table (floats, integers, low-cardinality strings, with missing
+values) as CSV, gzip/zstd CSV, Parquet, Feather and NDJSON, then times core.ingestion.read_table
+on each file and pandas' default CSV parser as the baseline. Throughput is reported in MB/s of
+the uncompressed CSV, so that the formats are comparable.
+
+    python benchmarks/bench_ingestion.py --rows 1000000 --repeat 3
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import ingestion
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {f"float_{i}": rng.standard_normal(rows) for i in range(8)}
+    data.update({f"int_{i}": rng.integers(0, 10_000, rows) for i in range(4)})
+    data.update({f"cat_{i}": rng.choice(["north", "south", "east", "west", None], rows) for i in range(4)})
+    df = pd.DataFrame(data)
+    df.loc[rng.random(rows) < 0.05, "float_0"] = np.nan
+    return df
+
+
+def write_files(df, directory):
+    """Writes `df` in every format and returns {label: path}."""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    paths = {name: os.path.join(directory, name) for name in
+             ["data.csv", "data.csv.gz", "data.csv.zst", "data.parquet", "data.feather", "data.ndjson"]}
+    df.to_csv(paths["data.csv"], index=False)
+    for name, codec in [("data.csv.gz", "gzip"), ("data.csv.zst", "zstd")]:
+        with open(paths["data.csv"], 'rb') as source, pa.CompressedOutputStream(paths[name], codec) as sink:
+            shutil.copyfileobj(source, sink)
+    df.to_parquet(paths["data.parquet"])
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), paths["data.feather"])
+    df.to_json(paths["data.ndjson"], orient="records", lines=True)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse throughput per input format.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = write_files(make_frame(args.rows), directory)
+        csv_mb = os.path.getsize(paths["data.csv"]) / 1024 ** 2
+        readers = {"pandas read_csv (baseline)": lambda: pd.read_csv(paths["data.csv"])}
+        readers.update({name: (lambda path=path: ingestion.read_table(path)) for name, path in paths.items()})
+
+        print(f"{args.rows:,} rows, {csv_mb:.0f} MB as CSV")
+        for name, read in readers.items():
+            times = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                read()
+                times.append(time.perf_counter() - started)
+            seconds = statistics.median(times)
+            path = paths.get(name, paths["data.csv"])
+            print(f"{name:28s} {os.path.getsize(path) / 1024 ** 2:7.0f} MB on disk  "
+                  f"{seconds:6.2f}s  {csv_mb / seconds:8.0f} MB/s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+End-to-end narration latency against a stub OpenAI-compatible server.
+
+Starts a local HTTP server that implements `/v1/models` and `/v1/chat/completions` with a
+fixed artificial latency, then narrates 20 insights through storytelling.generate_narratives:
+
+- sequentially (concurrency 1) and concurrently (the configured limit),
+- with the server stopped, to check that a missing server costs one probe, not one per insight.
+
+    python benchmarks/bench_llm_narration.py --latency 0.3 --insights 20
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import llm, narrator, storytelling
+
+
+def make_handler(latency):
+    class StubHandler(BaseHTTPRequestHandler):
+        def _send(self, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._send({"object": "list", "data": [{"id": "local-model", "object": "model", "created": 0, "owned_by": "stub"}]})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            prompt = request["messages"][-1]["content"]
+            self._send({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": request["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f"Stub narrative for: {prompt[:40]}"}}],
+            })
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def make_insights(n):
+    return [{
+        "type": "correlation",
+        "title": f"Strong Correlation between a{i} and b{i}",
+        "details": {"feature1": f"a{i}", "feature2": f"b{i}", "correlation": 0.5 + i / (2 * n)},
+    } for i in range(n)]
+
+
+class _NoModel:
+    """Stands in for the fallback model so the benchmark measures only the LLM path."""
+
+    def generate(self, prompts):
+        return [None] * len(prompts)
+
+
+def timed_run(insights, **backend_options):
+    llm._backend = llm.LLMBackend(**backend_options)
+    started = time.perf_counter()
+    narratives = storytelling.generate_narratives(insights)
+    return time.perf_counter() - started, narratives
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark narration latency against a stub LLM server.")
+    parser.add_argument("--insights", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds the stub waits per completion.")
+    parser.add_argument("--concurrency", type=int, default=llm.MAX_CONCURRENCY)
+    parser.add_argument("--port", type=int, default=18234)
+    args = parser.parse_args()
+
+    narrator._narrator = _NoModel()
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    insights = make_insights(args.insights)
+
+    serial, narratives = timed_run(insights, base_url=base_url, max_concurrency=1)
+    stubbed = sum(n.startswith("Stub narrative") for n in narratives)
+    concurrent, _ = timed_run(insights, base_url=base_url, max_concurrency=args.concurrency)
+    server.shutdown()
+    server.server_close()
+    missing, _ = timed_run(insights, base_url=base_url, max_concurrency=args.concurrency)
+
+    print(f"{args.insights} insights, {args.latency:g}s per completion ({stubbed} answered by the stub)")
+    print(f"sequential:               {serial:.2f}s")
+    print(f"concurrent (limit {args.concurrency}):     {concurrent:.2f}s")
+    print(f"server unavailable:       {missing:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Memory/time benchmark for the modeling stage's feature encodings.
+
+Builds a wide mixed-type frame (numeric columns, low-cardinality categories, zip-code-like
+high-cardinality columns and an ID column) and fits the model once per encoding, each in a
+fresh interpreter so that peak RSS is measured per encoding:
+
+- dummies: the former dense `pd.get_dummies(drop_first=True)` design matrix
+- native:  XGBoost's native categorical splits (core.encoding, 'native')
+- sparse:  a scipy CSR one-hot matrix (core.encoding, 'sparse')
+
+    python benchmarks/bench_modeling.py --rows 200000 --cols 100
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENCODINGS = ["dummies", "native", "sparse"]
+
+
+def make_frame(rows, cols, seed=0):
+    """
+    Mixes 70% numeric, 20% low-cardinality (8 levels) and 10% high-cardinality (5,000 levels)
+    categorical columns, plus an ID column and a regression target.
+    """
+    rng = np.random.default_rng(seed)
+    n_high = max(1, cols // 10)
+    n_low = max(1, cols // 5)
+    n_num = cols - n_high - n_low
+    data = {f"num_{i}": rng.standard_normal(rows).astype(np.float32) for i in range(n_num)}
+    for i in range(n_low):
+        data[f"cat_{i}"] = pd.Categorical(rng.choice([f"level{j}" for j in range(8)], rows))
+    for i in range(n_high):
+        data[f"zip_{i}"] = pd.Categorical(rng.integers(0, 5000, rows).astype(str))
+    data["id"] = [f"row{i}" for i in range(rows)]
+    df = pd.DataFrame(data)
+    df["target"] = df["num_0"] * 3 + (df["cat_0"] == "level0") * 2 + rng.standard_normal(rows)
+    return df
+
+
+def run_one(encoding_name, rows, cols):
+    """Fits the model once with one encoding and prints the fit time."""
+    df = make_frame(rows, cols)
+    started = time.perf_counter()
+    if encoding_name == "dummies":
+        from xgboost import XGBRegressor
+        X = pd.get_dummies(df.drop(columns=["target"]), drop_first=True)
+        XGBRegressor(objective='reg:squarederror', random_state=42).fit(X, df["target"])
+    else:
+        from core import encoding, modeling
+        encoding.ENCODING = encoding_name
+        modeling.run_predictive_model(df, {}, "target")
+    print(time.perf_counter() - started)
+
+
+def measure(encoding_name, rows, cols):
+    """Returns (fit seconds, peak RSS in MB, exit code) of one child process."""
+    command = [sys.executable, __file__, "--child", encoding_name, "--rows", str(rows), "--cols", str(cols)]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    lines = output.strip().splitlines()
+    fit_s = float(lines[-1]) if lines else float('nan')
+    return fit_s, usage.ru_maxrss / scale, os.waitstatus_to_exitcode(status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peak RSS and fit time of the feature encodings.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--cols", type=int, default=100)
+    parser.add_argument("--child", choices=ENCODINGS, help=argparse.SUPPRESS)
+    parser.add_argument("encodings", nargs="*", help=f"Any of {', '.join(ENCODINGS)} (default: all).")
+    args = parser.parse_args()
+    unknown = sorted(set(args.encodings) - set(ENCODINGS))
+    if unknown:
+        parser.error(f"unknown encodings: {', '.join(unknown)}")
+
+    if args.child:
+        run_one(args.child, args.rows, args.cols)
+        return
+
+    print(f"{args.rows:,} rows x {args.cols} columns")
+    for name in args.encodings or ENCODINGS:
+        fit_s, rss, code = measure(name, args.rows, args.cols)
+        status = f"  (exit code {code})" if code else ""
+        print(f"{name:8s} fit {fit_s:7.2f}s  peak RSS {rss:7.0f} MB{status}")
+
+
+if __name__ == "__main__":
+    main()
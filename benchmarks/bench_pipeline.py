@@ -0,0 +1,182 @@
+"""
+End-to-end pipeline benchmark with a saved baseline.
+
+Generates a synthetic dataset (see benchmarks/synthetic.py), writes it as CSV and runs the full
+pipeline on it, as an API job would, in a fresh interpreter per repetition. Narration is stubbed
+with the template narratives, and the stage, narrative and plot caches are off, so that only the
+pipeline's own code is measured. Each stage's wall time, CPU time and peak-RSS growth come from
+the report's trace (core.tracing); the run's wall time and peak RSS are measured from outside.
+The medians over the repetitions are written to a JSON file.
+
+With --baseline, the results are compared with a previous results file and the script exits
+with status 1 if any metric is more than --threshold (relative) worse. --save-baseline writes
+the results as the new baseline instead.
+
+    python benchmarks/bench_pipeline.py --rows 200000 --numeric 20 --categorical 5 --output results.json
+    python benchmarks/bench_pipeline.py --rows 200000 --numeric 20 --categorical 5 --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Differences below these are noise, whatever their ratio.
+MIN_SECONDS = 0.05
+MIN_MB = 8
+CACHES_OFF = {"NARRATOR_STAGE_CACHE": "off", "NARRATOR_NARRATIVE_CACHE": "off", "NARRATOR_PLOT_CACHE": "off"}
+
+
+def run_child(config):
+    """Runs the pipeline once in this process and prints its wall time and trace as JSON."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from synthetic import make_dataset
+    import pipeline
+    from core import bundle, storytelling
+
+    storytelling.generate_narrative_from_insight = lambda insight, *args: storytelling.fallback_narrative(insight)
+    path = os.path.join(os.getcwd(), "data.csv")
+    make_dataset(config["rows"], config["numeric"], config["categorical"], config["cardinality"],
+                 config["null_ratio"], config["seed"]).to_csv(path, index=False)
+    started = time.perf_counter()
+    report_path = pipeline.run_pipeline_job(path, "data.csv", "target", os.path.join("output", "report"))
+    wall_s = time.perf_counter() - started
+    trace = []
+    if report_path:
+        trace = bundle.read_index(report_path)["trace"]
+    print(json.dumps({"wall_s": wall_s, "trace": trace}))
+
+
+def measure(config):
+    """Runs one repetition in a child process and returns (its output, peak RSS in MB)."""
+    directory = tempfile.mkdtemp()
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)]
+        env = dict(os.environ, **CACHES_OFF, PYTHONPATH=ROOT)
+        process = subprocess.Popen(command, cwd=directory, env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, text=True)
+        output = process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        if os.waitstatus_to_exitcode(status):
+            raise RuntimeError(f"Benchmark run failed with exit code {os.waitstatus_to_exitcode(status)}.")
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+        return json.loads(output.strip().splitlines()[-1]), usage.ru_maxrss / scale
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def summarize(runs):
+    """Medians of the repetitions: {"total": {...}, "stages": {stage: {...}}}."""
+    total = {"wall_s": statistics.median(run["wall_s"] for run, _ in runs),
+             "peak_rss_mb": statistics.median(rss for _, rss in runs)}
+    stages = {}
+    for name in dict.fromkeys(record["stage"] for run, _ in runs for record in run["trace"]):
+        records = [record for run, _ in runs for record in run["trace"] if record["stage"] == name]
+        stages[name] = {
+            "wall_s": statistics.median(record["wall_s"] for record in records),
+            "cpu_s": statistics.median(record["cpu_s"] for record in records),
+            "peak_rss_delta_mb": statistics.median((record["peak_rss_delta_bytes"] or 0) / 1024 ** 2
+                                                   for record in records),
+        }
+    return {"total": total, "stages": stages}
+
+
+def metrics(results):
+    """Flattens results into {'total.wall_s': value, 'cleaning.cpu_s': value, ...}."""
+    flat = {f"total.{name}": value for name, value in results["total"].items()}
+    for stage, values in results["stages"].items():
+        flat.update({f"{stage}.{name}": value for name, value in values.items()})
+    return flat
+
+
+def compare(current, baseline, threshold):
+    """Prints current against baseline values and returns the names of the regressed metrics."""
+    regressions = []
+    baseline_metrics = metrics(baseline["results"])
+    print(f"\n{'metric':36s} {'baseline':>10s} {'current':>10s} {'change':>8s}")
+    for name, value in metrics(current["results"]).items():
+        if name not in baseline_metrics:
+            continue
+        before = baseline_metrics[name]
+        change = (value - before) / before if before else 0.0
+        noise = MIN_MB if name.endswith("_mb") else MIN_SECONDS
+        regressed = change > threshold and value - before > noise
+        if regressed:
+            regressions.append(name)
+        print(f"{name:36s} {before:10.3f} {value:10.3f} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the full pipeline and compare against a baseline.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--numeric", type=int, default=10, help="Numeric feature columns.")
+    parser.add_argument("--categorical", type=int, default=4, help="Categorical feature columns.")
+    parser.add_argument("--cardinality", type=int, default=8, help="Levels per categorical column.")
+    parser.add_argument("--null-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_pipeline.json", help="Results file to write.")
+    parser.add_argument("--baseline", help="Results file to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to --baseline.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown that counts as a regression.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline")
+
+    from pipeline import PIPELINE_VERSION
+    config = {"rows": args.rows, "numeric": args.numeric, "categorical": args.categorical,
+              "cardinality": args.cardinality, "null_ratio": args.null_ratio, "seed": args.seed}
+    runs = []
+    for i in range(args.repeat):
+        run, rss = measure(config)
+        print(f"run {i + 1}/{args.repeat}: {run['wall_s']:.2f}s, peak RSS {rss:.0f} MB")
+        runs.append((run, rss))
+    current = {
+        "config": dict(config, repeat=args.repeat),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "pipeline_version": PIPELINE_VERSION},
+        "results": summarize(runs),
+    }
+
+    print(f"\n{'stage':14s} {'wall s':>8s} {'cpu s':>8s} {'peak RSS +MB':>13s}")
+    for stage, values in current["results"]["stages"].items():
+        print(f"{stage:14s} {values['wall_s']:8.2f} {values['cpu_s']:8.2f} {values['peak_rss_delta_mb']:13.0f}")
+    total = current["results"]["total"]
+    print(f"{'total':14s} {total['wall_s']:8.2f} {'':8s} {total['peak_rss_mb']:10.0f} MB peak")
+
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if {k: v for k, v in baseline["config"].items() if k != "repeat"} != config:
+            print("Warning: the baseline was measured on a different dataset configuration.")
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regressions above {args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
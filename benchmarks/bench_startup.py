@@ -0,0 +1,71 @@
+"""
+Startup benchmark for the three entry points.
+
+Runs each entry point's import in a fresh interpreter several times and records the median
+wall time and the peak RSS of the child process:
+
+- cli:       `python main.py --help`
+- api:       `import api` (what every uvicorn worker does on start)
+- streamlit: `import app` in Streamlit's bare mode
+
+    python benchmarks/bench_startup.py --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    "cli": [sys.executable, "main.py", "--help"],
+    "api": [sys.executable, "-c", "import api"],
+    "streamlit": [sys.executable, "-c", "import app"],
+}
+
+
+def measure(command):
+    """Returns (wall seconds, peak RSS in MB, exit code) of one run of `command`."""
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return elapsed, usage.ru_maxrss / scale, os.waitstatus_to_exitcode(status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and RSS of the entry points.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("entry_points", nargs="*", help=f"Any of {', '.join(ENTRY_POINTS)} (default: all).")
+    args = parser.parse_args()
+    unknown = sorted(set(args.entry_points) - set(ENTRY_POINTS))
+    if unknown:
+        parser.error(f"unknown entry points: {', '.join(unknown)}")
+
+    results = {}
+    for name in args.entry_points or ENTRY_POINTS:
+        runs = [measure(ENTRY_POINTS[name]) for _ in range(args.repeat)]
+        failed = [code for _, _, code in runs if code != 0]
+        results[name] = {
+            "median_s": statistics.median(t for t, _, _ in runs),
+            "max_s": max(t for t, _, _ in runs),
+            "peak_rss_mb": max(rss for _, rss, _ in runs),
+            "failures": len(failed),
+        }
+        r = results[name]
+        print(f"{name:10s} median {r['median_s']:.2f}s  max {r['max_s']:.2f}s  "
+              f"peak RSS {r['peak_rss_mb']:.0f} MB" + (f"  ({len(failed)} failed runs)" if failed else ""))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
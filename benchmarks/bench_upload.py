@@ -0,0 +1,61 @@
+"""
+Upload memory benchmark for the analysis API.
+
+Streams files of growing size to a running API (`uvicorn api:app`) through the resumable upload
+endpoints and reads the server process's resident memory from /proc after each upload. Server
+RSS should stay flat as the upload size grows. Linux only, as it reads /proc/<pid>/status.
+
+    python benchmarks/bench_upload.py --pid $(pgrep -f "uvicorn api:app") --sizes 64 256 1024
+"""
+import argparse
+import os
+import time
+import requests
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def rss_mb(pid):
+    """Returns (current RSS, peak RSS) of a process in MB."""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                values[key] = int(value.split()[0]) / 1024
+    return values['VmRSS'], values['VmHWM']
+
+
+def upload(url, size):
+    """Sends `size` bytes of generated data in chunks and returns the upload id."""
+    upload_id = requests.post(f"{url}/uploads", data={'file_name': 'bench.csv', 'size': size}).json()['upload_id']
+    chunk = os.urandom(CHUNK_SIZE)
+    offset = 0
+    while offset < size:
+        body = chunk[:min(CHUNK_SIZE, size - offset)]
+        response = requests.patch(f"{url}/uploads/{upload_id}", data=body, headers={'Upload-Offset': str(offset)})
+        response.raise_for_status()
+        offset = response.json()['offset']
+    requests.post(f"{url}/uploads/{upload_id}/complete").raise_for_status()
+    return upload_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server RSS against upload size.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--pid", type=int, required=True, help="Process id of the API server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 1024], help="Upload sizes in MB.")
+    args = parser.parse_args()
+
+    rss, _ = rss_mb(args.pid)
+    print(f"server RSS before uploads: {rss:.0f} MB")
+    for size_mb in args.sizes:
+        started = time.perf_counter()
+        upload(args.url, size_mb * 1024 ** 2)
+        elapsed = time.perf_counter() - started
+        rss, peak = rss_mb(args.pid)
+        print(f"{size_mb:6d} MB upload  {size_mb / elapsed:7.0f} MB/s  server RSS {rss:.0f} MB (peak {peak:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Scaling benchmark for the visualization stage.
+
+Renders a scatter, a box and a bar figure for synthetic frames of growing row counts and
+reports the render time and the size of each figure's JSON, which should stay flat once the
+row count exceeds the point budget. Figures are built through tasks.run_storytelling_task, the
+pipeline's own render path, with narration replaced by the fallback text. A second pass with a
+data fingerprint measures the rendered-figure cache. Each figure is also rendered several times
+at once on the stage's render threads, and the script exits with status 1 if any insight did
+not get its figure.
+
+    python benchmarks/bench_visualization.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import storytelling, tasks, visualization
+
+INSIGHTS = [
+    {"type": "correlation", "title": "Strong Correlation between x and y",
+     "details": {"feature1": "x", "feature2": "y", "correlation": 0.9}},
+    {"type": "significant_difference", "title": "Significant Difference in 'y' across 'group' categories",
+     "details": {"categorical_feature": "group", "numeric_feature": "y"}},
+    {"type": "feature_importance", "title": "Top 5 Predictors for y",
+     "details": {"target": "y", "features": [{"feature": "x", "importance": 0.8},
+                                              {"feature": "group", "importance": 0.2}]}},
+]
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal(rows)
+    group = rng.choice(list("ABCDEFGH"), rows)
+    return pd.DataFrame({"x": x, "y": 2 * x + rng.standard_normal(rows),
+                         "group": pd.Categorical(group)})
+
+
+def render(insights, df, fingerprint=None):
+    """The figures the storytelling stage builds for `insights`, in order."""
+    return [entry["figure"] for entry in tasks.run_storytelling_task(insights, df, fingerprint)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark figure rendering time and size against row count.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    storytelling.generate_narrative_from_insight = lambda insight, *args: storytelling.fallback_narrative(insight)
+
+    for rows in args.rows:
+        df = make_frame(rows)
+        concurrent = INSIGHTS * visualization.RENDER_WORKERS
+        missing = [insight['title'] for insight, figure in zip(concurrent, render(concurrent, df))
+                   if figure is None]
+        if missing:
+            print(f"{rows:>10,} rows  no figure for: {', '.join(dict.fromkeys(missing))}")
+            sys.exit(1)
+        started = time.perf_counter()
+        figures = render(INSIGHTS, df)
+        render_s = time.perf_counter() - started
+        sizes = ", ".join(f"{len(figure) / 1024:.0f} KB" for figure in figures if figure)
+        fingerprint = f"bench-{rows}"
+        render(INSIGHTS, df, fingerprint)
+        started = time.perf_counter()
+        render(INSIGHTS, df, fingerprint)
+        cached_s = time.perf_counter() - started
+        print(f"{rows:>10,} rows  render {render_s:.2f}s  cached {cached_s * 1000:.1f} ms  sizes: {sizes}")
+
+
+if __name__ == "__main__":
+    main()
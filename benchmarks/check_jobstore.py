@@ -0,0 +1,138 @@
+"""
+Consistency check of the job store backends.
+
+Runs the same scenario against a SQLiteJobStore on a temporary file and a RedisJobStore on an
+in-process FakeRedis from fake_redis.py (or a real server with --redis): jobs are created, claimed in order,
+cancelled while pending and while running, and finished, and the counts and cancel requests
+are checked after each step. A second part races a claiming and a cancelling worker, each with
+its own store, over the same jobs: no job may be both cancelled while pending and claimed, and
+none may be claimed twice. Exits with status 1 on any failure.
+
+    python benchmarks/check_jobstore.py
+    python benchmarks/check_jobstore.py --redis redis://localhost:6379/15
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import jobstore
+from fake_redis import FakeRedis, WatchError
+
+RACE_JOBS = 300
+
+
+def check_lifecycle(store, expect):
+    ids = [uuid.uuid4().hex for _ in range(3)]
+    for i, job_id in enumerate(ids):
+        store.create(job_id, f"key-{i}", {"n": i})
+        time.sleep(0.001)  # distinct creation times, which order the SQLite queue
+    expect(store.count() == 3, "three jobs are active after create")
+    expect(store.active_keys() == {"key-0", "key-1", "key-2"}, "active_keys lists the pending jobs")
+
+    first = store.claim("w1")
+    expect(first is not None and first["id"] == ids[0], "claim returns the oldest pending job")
+    expect(store.get(ids[0])["status"] == "in_progress" and store.get(ids[0])["owner"] == "w1",
+           "a claimed job is in progress for its owner")
+    expect("started_at" in store.get(ids[0])["timings"], "claim records the start time")
+
+    expect(store.request_cancel(ids[1]) == "cancelled", "a pending job is cancelled at once")
+    second = store.claim("w2")
+    expect(second is not None and second["id"] == ids[2], "claim skips a cancelled job")
+    expect(store.claim("w2") is None, "claim returns None on an empty queue")
+
+    expect(store.request_cancel(ids[0]) == "in_progress", "a running job stays in progress when cancelled")
+    expect(store.cancel_requests("w1") == [ids[0]], "the owner sees the cancel request")
+    expect(store.cancel_requests("w2") == [], "other workers do not")
+    expect(store.request_cancel("unknown") is None, "cancelling an unknown job returns None")
+
+    store.finish(ids[0], "cancelled")
+    store.finish(ids[2], "completed", "report.bundle")
+    finished = store.get(ids[2])
+    expect(finished["status"] == "completed" and finished["result"] == "report.bundle", "finish records the outcome")
+    expect("seconds" in finished["timings"], "finish records the run time")
+    expect(store.count() == 0, "no job is active after finishing")
+    expect(store.active_keys() == set(), "active_keys is empty after finishing")
+
+    done_id = uuid.uuid4().hex
+    store.create(done_id, "cached", status="completed", result="report.bundle")
+    expect(store.get(done_id)["status"] == "completed" and store.count() == 0,
+           "a job created finished is stored but not active")
+
+    stale_id = uuid.uuid4().hex
+    store.create(stale_id, "stale")
+    store.claim("gone")
+    time.sleep(0.01)
+    store.remove_expired(stale=0.005)
+    expect(store.get(stale_id)["status"] == "failed", "remove_expired fails jobs of a dead worker")
+
+
+def check_race(make_store, expect):
+    claimer, canceller = make_store(), make_store()
+    ids = [uuid.uuid4().hex for _ in range(RACE_JOBS)]
+    for job_id in ids:
+        claimer.create(job_id, "race")
+    claimed, cancelled = [], set()
+    cancelling = threading.Thread(target=lambda: cancelled.update(
+        job_id for job_id in ids if canceller.request_cancel(job_id) == "cancelled"))
+    cancelling.start()
+    while True:
+        job = claimer.claim("race")
+        if job is not None:
+            claimed.append(job["id"])
+        elif not cancelling.is_alive():
+            break
+    cancelling.join()
+    expect(len(claimed) == len(set(claimed)), "no job is claimed twice")
+    expect(not cancelled & set(claimed), "no job cancelled while pending is claimed")
+    expect(set(claimed) | cancelled == set(ids), "every job is either claimed or cancelled")
+    expect(all(claimer.get(job_id)["status"] == "cancelled" for job_id in cancelled),
+           "cancelled jobs stay cancelled")
+
+
+def run(name, make_store):
+    failures = []
+
+    def expect(condition, message):
+        if not condition:
+            failures.append(message)
+
+    started = time.perf_counter()
+    check_lifecycle(make_store(), expect)
+    check_race(make_store, expect)
+    status = "ok" if not failures else f"{len(failures)} failure(s)"
+    print(f"{name:8s} {status} ({time.perf_counter() - started:.2f}s)")
+    for message in failures:
+        print(f"  FAILED: {message}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the job store backends against the same scenario.")
+    parser.add_argument("--redis", help="Redis URL to check against instead of the in-process FakeRedis.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "jobs.sqlite")
+        ok = run("sqlite", lambda: jobstore.SQLiteJobStore(path))
+        if args.redis:
+            import redis
+            client = redis.Redis.from_url(args.redis)
+            prefix, watch_error = f"check-{uuid.uuid4().hex}", None
+        else:
+            client, prefix, watch_error = FakeRedis(), "check", WatchError
+        ok = run("redis", lambda: jobstore.RedisJobStore(client, prefix, watch_error=watch_error)) and ok
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
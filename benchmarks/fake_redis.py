@@ -0,0 +1,166 @@
+"""
+An in-process stand-in for a Redis server, shared by the checks.
+
+FakeRedis implements the commands core.jobstore.RedisJobStore uses, including pipelines and
+WATCH/MULTI transactions, so that the Redis backend can be checked without a server or the
+redis package. Pass WatchError to RedisJobStore as its `watch_error`.
+"""
+import threading
+import time
+
+
+class WatchError(Exception):
+    """A watched key changed before the transaction ran."""
+
+
+class FakeRedis:
+    """
+    An in-process stand-in for redis.Redis with the commands RedisJobStore uses. Like Redis, it
+    returns values as bytes.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        # Incremented on every write of a key, for WATCH.
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _bytes(value):
+        return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    def _get(self, name, default=None):
+        if name in self._expiry and self._expiry[name] <= time.time():
+            self._delete(name)
+        return self._data.get(name, default)
+
+    def _delete(self, name):
+        self._data.pop(name, None)
+        self._expiry.pop(name, None)
+        self._touch(name)
+
+    def _touch(self, name):
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _version(self, name):
+        with self._lock:
+            self._get(name)
+            return self._versions.get(name, 0)
+
+    def hset(self, name, mapping):
+        with self._lock:
+            self._get(name)
+            fields = self._data.setdefault(name, {})
+            fields.update({self._bytes(key): self._bytes(value) for key, value in mapping.items()})
+            self._touch(name)
+            return len(mapping)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._get(name, {}))
+
+    def exists(self, name):
+        with self._lock:
+            return int(self._get(name) is not None)
+
+    def expire(self, name, seconds):
+        with self._lock:
+            if self._get(name) is None:
+                return False
+            self._expiry[name] = time.time() + seconds
+            self._touch(name)
+            return True
+
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._data.setdefault(name, set())
+            added = {self._bytes(value) for value in values} - members
+            members |= added
+            self._touch(name)
+            return len(added)
+
+    def srem(self, name, *values):
+        with self._lock:
+            members = self._get(name, set())
+            removed = {self._bytes(value) for value in values} & members
+            members -= removed
+            self._touch(name)
+            return len(removed)
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._get(name, set()))
+
+    def rpush(self, name, *values):
+        with self._lock:
+            items = self._data.setdefault(name, [])
+            items.extend(self._bytes(value) for value in values)
+            self._touch(name)
+            return len(items)
+
+    def lpop(self, name):
+        with self._lock:
+            items = self._get(name, [])
+            if not items:
+                return None
+            self._touch(name)
+            return items.pop(0)
+
+    def lindex(self, name, index):
+        with self._lock:
+            items = self._get(name, [])
+            return items[index] if -len(items) <= index < len(items) else None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """
+    A FakeRedis pipeline. Commands are queued and run together by execute(), except between
+    watch() and multi(), where they run at once as in redis-py. execute() raises WatchError
+    if a watched key was written since it was watched.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+    def reset(self):
+        self._watched = {}
+        self._commands = []
+        self._immediate = False
+
+    def watch(self, *names):
+        self._watched.update({name: self.client._version(name) for name in names})
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def execute(self):
+        with self.client._lock:
+            try:
+                if any(self.client._version(name) != version for name, version in self._watched.items()):
+                    raise WatchError("Watched variable changed.")
+                return [command(*args, **kwargs) for command, args, kwargs in self._commands]
+            finally:
+                self.reset()
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            if self._immediate:
+                return command(*args, **kwargs)
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return call
@@ -0,0 +1,47 @@
+"""
+Synthetic dataset generators shared by the benchmarks.
+
+make_dataset() builds a reproducible mixed-type frame from a seed: numeric columns with a few
+built-in correlations, categorical columns of a given cardinality, missing values in every
+feature column, and a numeric 'target' that depends on both kinds of column, so that every
+pipeline stage (correlations, ANOVA, modeling) has something to find.
+"""
+import numpy as np
+import pandas as pd
+
+
+def make_dataset(rows, numeric=10, categorical=4, cardinality=8, null_ratio=0.05, seed=0):
+    """
+    Returns a frame of `rows` rows with `numeric` float columns, `categorical` string columns of
+    `cardinality` levels each, `null_ratio` missing values per feature column, and a 'target'.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    base = rng.standard_normal(rows)
+    for i in range(numeric):
+        values = rng.standard_normal(rows)
+        # Every third column is correlated with the first, so correlations are found.
+        if i % 3 == 1:
+            values = 0.8 * base + 0.6 * values
+        data[f"num_{i}"] = base if i == 0 else values
+    levels = np.array([f"level_{k}" for k in range(cardinality)], dtype=object)
+    codes = [rng.integers(0, cardinality, rows) for _ in range(categorical)]
+    for i, column_codes in enumerate(codes):
+        data[f"cat_{i}"] = levels[column_codes]
+
+    target = rng.standard_normal(rows)
+    if numeric:
+        target += 2 * data["num_0"]
+    if categorical:
+        # Level effects of the first categorical column, so ANOVA and the model see it.
+        target += np.linspace(-1, 1, cardinality)[codes[0]]
+    for name, values in data.items():
+        mask = rng.random(rows) < null_ratio
+        if values.dtype == object:
+            values = values.copy()
+            values[mask] = None
+        else:
+            values = np.where(mask, np.nan, values)
+        data[name] = values
+    data["target"] = target
+    return pd.DataFrame(data)
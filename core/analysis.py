@@ -1,76 +1,75 @@
-from scipy.stats import f_oneway
+import os
 import pandas as pd
+from core import anova, correlation, profiling
+
+# 'pearson', 'spearman' or 'kendall'
+CORRELATION_METHOD = os.environ.get("NARRATOR_CORRELATION_METHOD", "pearson")
+# 'anova' or 'kruskal'
+ANOVA_TEST = os.environ.get("NARRATOR_ANOVA_TEST", "anova")
+MAX_ANOVA_INSIGHTS = 5
 
 def get_statistical_insights(df: pd.DataFrame, metadata: dict):
     """
-    Runs statistical tests to find interesting patterns. This version uses a robust,
-    step-by-step method for correlation analysis to be compatible with type checkers.
+    Runs statistical tests to find interesting patterns: the strongest pairwise correlations
+    between numeric columns and ANOVA tests for differences across categories.
+    Distinct counts come from the metadata's profile (see core.profiling). When the sampling
+    plan samples this stage, the tests run on rows stratified on the categorical column with the
+    most levels, and each insight records the sample, correlations with a 95% confidence interval.
     """
     insights = []
-    numeric_cols = [col for col in metadata['numeric_cols'] if df[col].nunique() > 1]
+    numeric_cols = [col for col in metadata['numeric_cols'] if profiling.distinct_count(df, metadata, col) > 1]
+    categorical_cols_for_anova = [col for col in metadata['categorical_cols']
+                                  if 2 < profiling.distinct_count(df, metadata, col) < 15]
+    strata_col = max(categorical_cols_for_anova, key=lambda col: profiling.distinct_count(df, metadata, col),
+                     default=None)
+    sample = profiling.stage_sample(df, metadata, "analysis", strata_col)
 
-    # --- NEW: Robust Correlation Analysis ---
+    # --- Correlation Analysis ---
+    # The top pairs come straight from the upper triangle of a float32 correlation matrix,
+    # computed blockwise for very wide tables (see core.correlation).
     if len(numeric_cols) > 1:
-        # 1. Calculate the correlation matrix
-        corr_matrix = df[numeric_cols].corr()
-
-        # 2. Unstack the matrix to get a Series of all pairs
-        s = corr_matrix.unstack()
-
-        # 3. Convert the Series to a DataFrame and rename columns
-        corr_df = s.reset_index()
-        corr_df.columns = ['feature1', 'feature2', 'correlation']
-
-        # 4. Remove self-correlations (e.g., HappinessScore vs. HappinessScore)
-        corr_df = corr_df[corr_df['feature1'] != corr_df['feature2']]
-
-        # 5. Create a sorted tuple of the feature pair to identify and remove duplicates
-        #    (e.g., treat (A,B) and (B,A) as the same)
-        corr_df['sorted_pair'] = corr_df.apply(lambda row: tuple(sorted((row['feature1'], row['feature2']))), axis=1)
-        corr_df = corr_df.drop_duplicates(subset='sorted_pair')
-        corr_df = corr_df.drop(columns=['sorted_pair']) # We don't need this column anymore
-
-        # 6. Sort by the absolute value of the correlation to find the strongest relationships
-        corr_df['abs_correlation'] = corr_df['correlation'].abs()
-        corr_df = corr_df.sort_values(by='abs_correlation', ascending=False)
+        top_pairs = correlation.top_correlations(sample[numeric_cols], k=5, method=CORRELATION_METHOD)
+        insights += correlation_insights(top_pairs, CORRELATION_METHOD)
+    # --- END of correlation analysis ---
 
-        # 7. Take the top 5 strongest correlations and create insights
-        top_correlations = corr_df.head(5)
-        for index, row in top_correlations.iterrows():
-            insights.append({
-                "type": "correlation",
-                "title": f"Strong Correlation between {row['feature1']} and {row['feature2']}",
-                "details": {
-                    "feature1": row['feature1'],
-                    "feature2": row['feature2'],
-                    "correlation": row['correlation']
-                }
-            })
-    # --- END of new correlation logic ---
 
-
-    # --- ANOVA Test for Significant Differences ---
-    categorical_cols_for_anova = [col for col in metadata['categorical_cols'] if 2 < df[col].nunique() < 15]
-    
+    # --- ANOVA Tests for Significant Differences ---
+    # Every eligible categorical x numeric pair is tested, with Benjamini-Hochberg correction
+    # across all of them; the pairs with the largest effect sizes become insights.
     if categorical_cols_for_anova and numeric_cols:
-        cat_col = categorical_cols_for_anova[0]
-        num_col = next((c for c in numeric_cols if 'score' in c.lower()), numeric_cols[0])
-
         try:
-            groups = [df[num_col][df[cat_col] == category] for category in df[cat_col].unique()]
-            f_stat, p_value = f_oneway(*groups)
-            
-            if p_value < 0.05: # Statistically significant
-                insights.append({
-                    "type": "significant_difference",
-                    "title": f"Significant Difference in '{num_col}' across '{cat_col}'",
-                    "details": {
-                        "numeric_feature": num_col,
-                        "categorical_feature": cat_col,
-                        "p_value": p_value
-                    }
-                })
+            results = anova.scan(sample, categorical_cols_for_anova, numeric_cols, test=ANOVA_TEST)
+            insights += anova_insights(results)
         except Exception as e:
             print(f"Could not perform ANOVA test. Reason: {e}")
-            
-    return insights
\ No newline at end of file
+
+    sampling = profiling.sampling_details(sample, df)
+    if sampling:
+        for insight in insights:
+            details = insight["details"]
+            details["sampling"] = sampling
+            if insight["type"] == "correlation":
+                details["ci95"] = profiling.correlation_interval(details["correlation"], len(sample), details["method"])
+    return insights
+
+def correlation_insights(top_pairs, method):
+    """Turns (feature1, feature2, correlation) pairs into correlation insights."""
+    return [{
+        "type": "correlation",
+        "title": f"Strong Correlation between {feature1} and {feature2}",
+        "details": {
+            "feature1": feature1,
+            "feature2": feature2,
+            "correlation": corr,
+            "method": method
+        }
+    } for feature1, feature2, corr in top_pairs]
+
+def anova_insights(results):
+    """Turns ranked ANOVA/Kruskal-Wallis results into insights for the significant pairs."""
+    significant = [r for r in results if r["q_value"] < 0.05]  # Statistically significant
+    return [{
+        "type": "significant_difference",
+        "title": f"Significant Difference in '{result['numeric_feature']}' across '{result['categorical_feature']}'",
+        "details": result
+    } for result in significant[:MAX_ANOVA_INSIGHTS]]
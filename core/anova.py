@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+def benjamini_hochberg(p_values):
+    """
+    Returns Benjamini-Hochberg adjusted p-values (q-values), which control the false discovery
+    rate across many simultaneous tests.
+    """
+    p = np.asarray(p_values, dtype=np.float64)
+    m = len(p)
+    if not m:
+        return p
+    order = np.argsort(p)
+    ranked = p[order] * m / np.arange(1, m + 1)
+    # Enforce monotonicity from the largest p-value down.
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q = np.empty(m)
+    q[order] = np.minimum(ranked, 1.0)
+    return q
+
+
+def anova_from_group_stats(counts, sums, sumsq):
+    """
+    One-way ANOVA for several numeric columns at once from per-group sufficient statistics.
+
+    counts has shape (G,), sums and sumsq shape (G, m): the row count, sum and sum of squares
+    of each of m numeric columns within each of G groups. Returns (F, p_value, eta_squared),
+    each of shape (m,). Empty groups are ignored.
+    """
+    from scipy.stats import f as f_dist
+    counts = np.asarray(counts, dtype=np.float64)
+    present = counts > 0
+    counts, sums, sumsq = counts[present], np.asarray(sums)[present], np.asarray(sumsq)[present]
+    n_total, n_groups = counts.sum(), len(counts)
+    m = sums.shape[1] if sums.ndim == 2 else 0
+    if n_groups < 2 or n_total <= n_groups:
+        nan = np.full(m, np.nan)
+        return nan, nan, nan
+
+    means = sums / counts[:, None]
+    grand_mean = sums.sum(axis=0) / n_total
+    ss_between = (counts[:, None] * (means - grand_mean) ** 2).sum(axis=0)
+    ss_within = np.maximum((sumsq - counts[:, None] * means ** 2).sum(axis=0), 0.0)
+    df_between, df_within = n_groups - 1, n_total - n_groups
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_stat = (ss_between / df_between) / (ss_within / df_within)
+        eta_squared = ss_between / (ss_between + ss_within)
+    return f_stat, f_dist.sf(f_stat, df_between, df_within), eta_squared
+
+
+def _tie_correction(ranks: pd.DataFrame) -> np.ndarray:
+    """Kruskal-Wallis tie correction factor for each column of average ranks."""
+    n = len(ranks)
+    factors = []
+    for col in ranks.columns:
+        _, ties = np.unique(ranks[col].to_numpy(), return_counts=True)
+        factors.append(1.0 - (ties ** 3 - ties).sum() / (n ** 3 - n) if n > 1 else 1.0)
+    return np.array(factors)
+
+
+def _kruskal_from_rank_sums(counts, rank_sums, n_total, tie_correction):
+    """Kruskal-Wallis H for several columns from per-group rank sums. Returns (H, p_value, epsilon_squared)."""
+    from scipy.stats import chi2
+    present = counts > 0
+    counts, rank_sums = counts[present].astype(np.float64), rank_sums[present]
+    n_groups = len(counts)
+    h = 12.0 / (n_total * (n_total + 1)) * (rank_sums ** 2 / counts[:, None]).sum(axis=0) - 3 * (n_total + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = h / tie_correction
+        effect = (h - n_groups + 1) / (n_total - n_groups)
+    return h, chi2.sf(h, n_groups - 1), effect
+
+
+def scan(df: pd.DataFrame, categorical_cols, numeric_cols, test='anova'):
+    """
+    Tests every categorical x numeric pair for a difference in the numeric column across the
+    categories, with a one-way ANOVA ('anova') or a Kruskal-Wallis test ('kruskal').
+
+    Each categorical column costs a single groupby over its category codes, which yields counts,
+    sums and sums of squares (or rank sums) for all numeric columns at once. p-values are adjusted
+    across all pairs with Benjamini-Hochberg. Returns one dict per pair, ranked by effect size
+    (eta squared for ANOVA, epsilon squared for Kruskal-Wallis).
+    """
+    if test not in ('anova', 'kruskal'):
+        raise ValueError(f"Unsupported test: {test}")
+    numeric_cols = list(numeric_cols)
+    if not numeric_cols:
+        return []
+
+    values = df[numeric_cols].to_numpy(dtype=np.float64)
+    # Centering keeps the sums of squares numerically stable for columns with a large mean.
+    values = values - np.nanmean(values, axis=0)
+    if test == 'anova':
+        columns = np.hstack([values, values ** 2])
+    else:
+        ranks = df[numeric_cols].rank()
+        tie_correction = _tie_correction(ranks)
+        columns = ranks.to_numpy(dtype=np.float64)
+
+    results = []
+    for cat_col in categorical_cols:
+        codes = df[cat_col].astype('category').cat.codes.to_numpy()
+        valid = codes >= 0
+        counts = np.bincount(codes[valid])
+        counts = counts[counts > 0]
+        if test == 'kruskal' and not valid.all():
+            # Rows without a category are left out, so the remaining rows are ranked again.
+            subset_ranks = df.loc[valid, numeric_cols].rank()
+            rank_sums = subset_ranks.groupby(codes[valid]).sum().to_numpy()
+            stat, p_values, effect = _kruskal_from_rank_sums(counts, rank_sums, valid.sum(),
+                                                             _tie_correction(subset_ranks))
+        else:
+            grouped = pd.DataFrame(columns[valid]).groupby(codes[valid]).sum().to_numpy()
+            if test == 'anova':
+                stat, p_values, effect = anova_from_group_stats(counts, grouped[:, :len(numeric_cols)],
+                                                                grouped[:, len(numeric_cols):])
+            else:
+                stat, p_values, effect = _kruskal_from_rank_sums(counts, grouped, len(codes), tie_correction)
+        for j, num_col in enumerate(numeric_cols):
+            if num_col != cat_col and np.isfinite(p_values[j]):
+                results.append({
+                    "categorical_feature": cat_col,
+                    "numeric_feature": num_col,
+                    "test": test,
+                    "statistic": float(stat[j]),
+                    "p_value": float(p_values[j]),
+                    "effect_size": float(effect[j]),
+                })
+
+    q_values = benjamini_hochberg([r["p_value"] for r in results])
+    for result, q in zip(results, q_values):
+        result["q_value"] = float(q)
+    return sorted(results, key=lambda r: -r["effect_size"])
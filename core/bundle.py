@@ -0,0 +1,95 @@
+import json
+import os
+import struct
+import zlib
+
+# --- Report Bundle ---
+# A report is stored as one file: a fixed header (MAGIC and the index length), the index as UTF-8
+# JSON, then one zlib-compressed JSON section per insight, then the zlib-compressed plotly JSON
+# of each figure. The index is the report without its insights' contents; for each insight it
+# keeps the title and the [offset, length] of its section and its figure, relative to the end
+# of the index. The sections directly follow the index, so reading a report without its
+# figures reads one prefix of the file, and a figure is one byte range that can be served as is.
+MAGIC = b"NRB1"
+HEADER = struct.Struct("<4sI")
+COMPRESSION_LEVEL = 6
+
+
+def write(report: dict, path):
+    """
+    Writes `report` as a bundle at `path`, where each insight's 'figure' is plotly JSON or None.
+    The file is written then renamed, so readers never see a half-written bundle.
+    """
+    entries, sections, figures = [], [], []
+    for insight in report.get("insights", []):
+        section = dict(insight)
+        figure = section.pop("figure", None)
+        entries.append({"title": section.pop("title")})
+        sections.append(zlib.compress(json.dumps(section).encode('utf-8'), COMPRESSION_LEVEL))
+        figures.append(zlib.compress(figure.encode('utf-8'), COMPRESSION_LEVEL) if figure else b'')
+    offset = 0
+    for entry, blob in zip(entries, sections):
+        entry["section"] = [offset, len(blob)]
+        offset += len(blob)
+    for entry, blob in zip(entries, figures):
+        entry["figure"] = [offset, len(blob)] if blob else None
+        offset += len(blob)
+    index = json.dumps(dict(report, insights=entries)).encode('utf-8')
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(index)))
+        f.write(index)
+        for blob in sections + figures:
+            f.write(blob)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_index(path):
+    """
+    Reads the index of a bundle. The section and figure ranges of its insights are turned into
+    absolute [offset, length] byte ranges of the file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:4] != MAGIC:
+            raise ValueError(f"{path} is not a report bundle.")
+        _, length = HEADER.unpack(header)
+        index = json.loads(f.read(length))
+    base = HEADER.size + length
+    for entry in index.get("insights", []):
+        entry["section"] = [base + entry["section"][0], entry["section"][1]]
+        if entry.get("figure"):
+            entry["figure"] = [base + entry["figure"][0], entry["figure"][1]]
+    return index
+
+
+def read_range(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def decode(blob: bytes) -> str:
+    """Decompresses a section or figure read from a bundle."""
+    return zlib.decompress(blob).decode('utf-8')
+
+
+def read_report(path, figures=False):
+    """
+    Reads a bundle back into a report: the index with each insight's section merged in, replacing
+    its byte range. The insights keep their figure's byte range under 'figure', or with
+    `figures`, the plotly JSON.
+    """
+    index = read_index(path)
+    insights = index.get("insights", [])
+    if insights:
+        # The sections are contiguous, so they are read at once.
+        start = insights[0]["section"][0]
+        data = read_range(path, start, sum(entry["section"][1] for entry in insights))
+        for entry in insights:
+            offset, length = entry.pop("section")
+            entry.update(json.loads(decode(data[offset - start:offset - start + length])))
+            if figures:
+                entry["figure"] = decode(read_range(path, *entry["figure"])) if entry.get("figure") else None
+    return index
@@ -0,0 +1,162 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+CACHE_DIR = os.environ.get("NARRATOR_CACHE_DIR", os.path.join('output', 'cache', 'stages'))
+MEMORY_ENTRIES = int(os.environ.get("NARRATOR_CACHE_ENTRIES", 8))
+DISK_ENTRIES = int(os.environ.get("NARRATOR_CACHE_DISK_ENTRIES", 256))
+
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """
+    Returns a content fingerprint of a DataFrame: its column names, dtypes, index and values.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def make_key(*parts) -> str:
+    """Combines a fingerprint and stage parameters into a cache key."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _copy(value):
+    """Copies a stage result's dicts and lists; its DataFrames are shared, not copied."""
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    if isinstance(value, pd.DataFrame):
+        return value
+    return copy.deepcopy(value)
+
+
+class MemoryCache:
+    """
+    An in-process LRU cache. Values are copied in and out, so a caller that adds to a cached
+    metadata dict or insight list does not change what the next hit returns. DataFrames are
+    shared and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return _copy(self._entries[key])
+
+    def set(self, key, value):
+        self._entries[key] = _copy(value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class DiskCache:
+    """
+    An on-disk cache with one directory per key. A (DataFrame, dict) value, the output of the
+    cleaning stage, is stored as Parquet plus JSON; any other value (insight lists) as JSON.
+    The least recently used entries are removed beyond `max_entries`.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=DISK_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, key)
+        data_path = os.path.join(path, 'data.json')
+        if not os.path.exists(data_path):
+            return None
+        try:
+            with open(data_path) as f:
+                data = json.load(f)
+            frame_path = os.path.join(path, 'frame.parquet')
+            value = (pd.read_parquet(frame_path), data) if os.path.exists(frame_path) else data
+        except Exception as e:
+            print(f"Warning: Could not read cache entry {key}. Error: {e}")
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        return value
+
+    def set(self, key, value):
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(tmp_path, exist_ok=True)
+            if isinstance(value, tuple) and isinstance(value[0], pd.DataFrame):
+                value[0].to_parquet(os.path.join(tmp_path, 'frame.parquet'))
+                value = value[1]
+            with open(os.path.join(tmp_path, 'data.json'), 'w') as f:
+                json.dump(value, f, default=_json_default)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Warning: Could not write cache entry {key}. Error: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if not name.endswith('.tmp')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_entries]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class TieredCache:
+    """
+    Looks up the in-memory LRU first and falls back to disk, promoting disk hits to memory.
+    """
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory or MemoryCache()
+        self.disk = disk or DiskCache()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+
+def from_env():
+    """
+    Builds the stage cache selected by NARRATOR_STAGE_CACHE: 'tiered' (default), 'memory', 'disk' or 'off'.
+    """
+    backend = os.environ.get("NARRATOR_STAGE_CACHE", "tiered").lower()
+    if backend == "off":
+        return None
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "disk":
+        return DiskCache()
+    return TieredCache()
@@ -1,60 +1,157 @@
+import base64
 import pandas as pd
 import numpy as np
-from sklearn.impute import SimpleImputer
+from core import ingestion, profiling
+
+# Object columns with at most this many distinct values (and at most half as many as rows)
+# are stored as pandas 'category'.
+MAX_CATEGORY_LEVELS = 1000
+# Number of columns whose outlier masks are computed at once, which bounds the temporary boolean matrix.
+OUTLIER_BLOCK_COLS = 64
+# Rows of each object column parsed before attempting a full numeric conversion.
+PROBE_ROWS = 1000
 
 def load_data(file_obj, file_name):
-    """Loads data from CSV, JSON, or SAS files."""
-    if file_name.endswith('.csv'):
-        df = pd.read_csv(file_obj)
-    elif file_name.endswith('.json'):
-        df = pd.read_json(file_obj)
-    elif file_name.endswith('.sas7bdat'):
+    """
+    Loads data from CSV, Parquet, Feather/Arrow, NDJSON, JSON or SAS files, optionally gzip or
+    zstd compressed, through core.ingestion.
+    """
+    fmt, compression = ingestion.detect_format(file_name)
+    if fmt == 'sas':
         try:
-            df = pd.read_sas(file_obj)
+            df = ingestion.read_table(file_obj, fmt=fmt)
         except Exception as e:
             raise ConnectionError(f"Failed to read SAS file. Ensure 'saspy' is installed and configured if needed. Error: {e}")
     else:
-        raise ValueError("Unsupported file type")
+        df = ingestion.read_table(file_obj, fmt=fmt, compression=compression)
     
     # Clean up column names: remove spaces and special characters
     df.columns = df.columns.str.replace('[^A-Za-z0-9_]+', '', regex=True)
     
     return df
 
-def clean_and_preprocess_data(df):
-    """Performs automated data cleaning and preprocessing in a generic way."""
-    
-    # --- NEW GENERALIZED CLEANING LOGIC ---
-    # Attempt to convert object columns that look like numbers into numeric types.
-    for col in df.select_dtypes(include=['object']).columns:
-        try:
-            df[col] = pd.to_numeric(df[col])
-        except (ValueError, TypeError):
-            # If conversion fails, it's genuinely a categorical column.
-            pass
-    # --- END OF NEW LOGIC ---
+def clean_and_preprocess_data(df, stats=None):
+    """
+    Performs automated data cleaning and preprocessing in a generic way.
+    `stats` (from core.ingestion.stream_csv) supplies medians, modes and quartiles computed over
+    the full file, which are used instead of the values of `df` when it is only a sample.
+
+    Every step works on whole blocks of columns: numeric conversion, imputation with one median
+    call, dtype downcasting (float32/int32, low-cardinality strings to 'category') and IQR outlier
+    detection with one quantile call. Outliers are reported as counts per column, with the rows
+    kept as a compact bitmap (see outlier_mask). The null counts before imputation (of the full
+    file, with `stats`) are kept in the metadata for the profiling pass.
+    """
+    stats = stats or {}
+
+    # Convert object columns that look like numbers into numeric types. A column is converted
+    # only if every non-null value parses; otherwise it is genuinely categorical.
+    # The first rows are probed first, so genuinely textual columns are never parsed in full.
+    object_cols = df.select_dtypes(include=['object']).columns
+    candidates = _numeric_like(df[object_cols].iloc[:PROBE_ROWS]) if len(object_cols) else []
+    if candidates:
+        converted = df[candidates].apply(pd.to_numeric, errors='coerce')
+        convertible_cols = _numeric_like(df[candidates], converted)
+        if convertible_cols:
+            df[convertible_cols] = converted[convertible_cols]
+        del converted
 
     # Separate numeric and categorical columns AFTER potential conversion
     numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
     categorical_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
 
-    # Impute missing values
+    # Impute missing values in place, with full-file statistics where the ingestion stage provides them
+    null_counts = df.isna().sum()
+    numeric_missing = [col for col in numeric_cols if null_counts[col]]
+    categorical_missing = [col for col in categorical_cols if null_counts[col]]
+    fill_values = {}
+    if numeric_missing:
+        medians = df[numeric_missing].median()
+        medians.update(pd.Series(stats.get('medians', {}), dtype='float64'))
+        fill_values.update(medians[numeric_missing].to_dict())
+    for col in categorical_missing:
+        mode = stats.get('modes', {}).get(col)
+        if mode is None:
+            modes = df[col].mode()
+            mode = modes.iloc[0] if len(modes) else None
+        fill_values[col] = mode
+    fill_values = {col: value for col, value in fill_values.items() if value is not None and not pd.isna(value)}
+    if fill_values:
+        df.fillna(fill_values, inplace=True)
+
+    df = _downcast(df, numeric_cols, categorical_cols)
+
+    # Outlier detection using IQR, with all quartiles from a single quantile call
+    outliers, outlier_masks = {}, {}
     if numeric_cols:
-        numeric_imputer = SimpleImputer(strategy='median')
-        df[numeric_cols] = numeric_imputer.fit_transform(df[numeric_cols])
+        quartiles = df[numeric_cols].quantile([0.25, 0.75]).T
+        quartiles.columns = ['Q1', 'Q3']
+        for col, (q1, q3) in stats.get('quartiles', {}).items():
+            if col in quartiles.index:
+                quartiles.loc[col] = [q1, q3]
+        iqr = quartiles['Q3'] - quartiles['Q1']
+        # Nullable columns that are entirely missing have NA quartiles; as NaN they flag no outliers.
+        lower = (quartiles['Q1'] - 1.5 * iqr).to_numpy(dtype=np.float64, na_value=np.nan)
+        upper = (quartiles['Q3'] + 1.5 * iqr).to_numpy(dtype=np.float64, na_value=np.nan)
+        for start in range(0, len(numeric_cols), OUTLIER_BLOCK_COLS):
+            block = slice(start, start + OUTLIER_BLOCK_COLS)
+            values = df[numeric_cols[block]].to_numpy(dtype=np.float64, na_value=np.nan)
+            mask = (values < lower[block]) | (values > upper[block])
+            counts = mask.sum(axis=0)
+            packed = np.packbits(mask, axis=0)
+            for j, col in enumerate(numeric_cols[block]):
+                if counts[j]:
+                    outliers[col] = int(counts[j])
+                    outlier_masks[col] = base64.b64encode(packed[:, j].tobytes()).decode('ascii')
 
-    if categorical_cols:
-        categorical_imputer = SimpleImputer(strategy='most_frequent')
-        df[categorical_cols] = categorical_imputer.fit_transform(df[categorical_cols])
-    
-    # Outlier detection using IQR
-    outliers = {}
+    null_counts = {col: int(count) for col, count in null_counts.items() if count}
+    null_counts.update({col: int(count) for col, count in stats.get('null_counts', {}).items() if col in df.columns})
+    return df, {"outliers": outliers, "outlier_masks": outlier_masks,
+                "numeric_cols": numeric_cols, "categorical_cols": categorical_cols,
+                "rows": int(stats.get('rows', len(df))), "null_counts": null_counts}
+
+def _numeric_like(frame, converted=None):
+    """
+    Returns the columns of `frame` whose non-null values all parse as numbers.
+    """
+    if converted is None:
+        converted = frame.apply(pd.to_numeric, errors='coerce')
+    parses = (converted.isna() == frame.isna()).all()
+    return parses[parses].index.tolist()
+
+def _downcast(df, numeric_cols, categorical_cols):
+    """
+    Shrinks the frame in place: floats to float32, integers to int32 where their range fits, and
+    low-cardinality string columns to 'category'. Levels are counted with
+    profiling.distinct_counts, which estimates them on very long frames.
+    """
+    # Columns are picked from df.dtypes and reduced one at a time: selecting df[cols] would copy them.
+    dtypes = df.dtypes
+    casts = {col: 'float32' for col in numeric_cols if pd.api.types.is_float_dtype(dtypes[col])}
+    info = np.iinfo(np.int32)
     for col in numeric_cols:
-        Q1 = df[col].quantile(0.25)
-        Q3 = df[col].quantile(0.75)
-        IQR = Q3 - Q1
-        outlier_condition = ((df[col] < (Q1 - 1.5 * IQR)) | (df[col] > (Q3 + 1.5 * IQR)))
-        if outlier_condition.any():
-            outliers[col] = df[outlier_condition].index.tolist()
-
-    return df, {"outliers": outliers, "numeric_cols": numeric_cols, "categorical_cols": categorical_cols}
\ No newline at end of file
+        # An all-missing nullable integer column has no range to check; its min() is NA.
+        if not pd.api.types.is_integer_dtype(dtypes[col]) or not df[col].notna().any():
+            continue
+        if info.min <= df[col].min() and df[col].max() <= info.max:
+            casts[col] = 'int32'
+    object_cols = [col for col in categorical_cols if df[col].dtype == object]
+    if object_cols:
+        levels, _ = profiling.distinct_counts(df[object_cols])
+        low_cardinality = levels[(levels <= MAX_CATEGORY_LEVELS) & (levels <= len(df) / 2)]
+        casts.update({col: 'category' for col in low_cardinality.index})
+    # Assigned back one column at a time: df.astype(casts) would copy the columns left as they are too.
+    for col, dtype in casts.items():
+        df[col] = df[col].astype(dtype)
+    return df
+
+def outlier_mask(metadata, col, n_rows):
+    """
+    Returns the boolean outlier mask of `col` (aligned with the cleaned frame's rows), or None if
+    the column has no outliers.
+    """
+    encoded = metadata.get("outlier_masks", {}).get(col)
+    if encoded is None:
+        return None
+    packed = np.frombuffer(base64.b64decode(encoded), dtype=np.uint8)
+    return np.unpackbits(packed, count=n_rows).astype(bool)
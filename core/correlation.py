@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Columns per block when the correlation matrix is computed blockwise.
+BLOCK_SIZE = 512
+# Kendall's tau is only computed for this many times `k` candidate pairs, pre-selected by Spearman.
+KENDALL_CANDIDATE_FACTOR = 4
+
+
+def _standardize(df: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the columns as a float32 matrix scaled so that Z.T @ Z is the Pearson correlation matrix.
+    Missing values are replaced by the column mean, i.e. they contribute nothing to the covariance.
+    Constant columns become all zeros and therefore correlate with nothing.
+    """
+    X = df.to_numpy(dtype=np.float32, na_value=np.nan)
+    mean = np.nanmean(X, axis=0)
+    X = np.where(np.isnan(X), mean, X) - mean
+    norm = np.sqrt((X * X).sum(axis=0))
+    norm[norm == 0] = np.inf
+    return X / norm
+
+
+def _top_k(values, rows, cols, k):
+    """Keeps the k entries with the largest absolute value, strongest first."""
+    if len(values) > k:
+        keep = np.argpartition(-np.abs(values), k - 1)[:k]
+        values, rows, cols = values[keep], rows[keep], cols[keep]
+    order = np.argsort(-np.abs(values), kind='stable')
+    return values[order], rows[order], cols[order]
+
+
+def top_pairs_from_matrix(corr, k):
+    """
+    Returns (values, i, j) of the k strongest pairs in the upper triangle of a square correlation matrix.
+    """
+    i, j = np.triu_indices(corr.shape[0], k=1)
+    return _top_k(corr[i, j], i, j, k)
+
+
+def _top_pairs_blocked(Z, k, block_size):
+    """
+    Finds the k strongest pairs of Z.T @ Z one block of columns at a time, so that only a
+    block_size x block_size slice of the correlation matrix ever exists.
+    """
+    n_cols = Z.shape[1]
+    best = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    for start_i in range(0, n_cols, block_size):
+        Zi = Z[:, start_i:start_i + block_size]
+        for start_j in range(start_i, n_cols, block_size):
+            block = Zi.T @ Z[:, start_j:start_j + block_size]
+            i, j = np.indices(block.shape).reshape(2, -1)
+            i, j = i + start_i, j + start_j
+            upper = i < j
+            candidates = (block.ravel()[upper], i[upper], j[upper])
+            best = _top_k(*(np.concatenate(parts) for parts in zip(best, candidates)), k)
+    return best
+
+
+def top_correlations(df: pd.DataFrame, k=5, method='pearson', block_size=BLOCK_SIZE):
+    """
+    Returns the k most strongly correlated column pairs of `df` as a list of
+    (feature1, feature2, correlation), strongest first.
+
+    Pearson and Spearman are computed as Z.T @ Z on a float32 matrix of standardized columns
+    (Spearman on ranks). With more than `block_size` columns the product is computed in blocks,
+    keeping a running top-k, so the full k x k matrix is never materialized. Kendall's tau is
+    O(n^2) per pair, so it is computed only for the strongest Spearman candidates.
+    """
+    columns = df.columns
+    if len(columns) < 2 or k <= 0:
+        return []
+
+    if method == 'kendall':
+        from scipy.stats import kendalltau
+        candidates = top_correlations(df, k * KENDALL_CANDIDATE_FACTOR, 'spearman', block_size)
+        taus = []
+        for feature1, feature2, _ in candidates:
+            tau = kendalltau(df[feature1], df[feature2], nan_policy='omit').statistic
+            if not np.isnan(tau):
+                taus.append((feature1, feature2, float(tau)))
+        return sorted(taus, key=lambda pair: -abs(pair[2]))[:k]
+
+    if method == 'spearman':
+        df = df.rank()
+    elif method != 'pearson':
+        raise ValueError(f"Unsupported correlation method: {method}")
+
+    Z = _standardize(df)
+    if Z.shape[1] <= block_size:
+        values, i, j = top_pairs_from_matrix(Z.T @ Z, k)
+    else:
+        values, i, j = _top_pairs_blocked(Z, k, block_size)
+    return [(columns[a], columns[b], float(v)) for v, a, b in zip(values, i, j)]
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+# 'native' keeps categorical columns as pandas categories for XGBoost's own categorical splits;
+# 'sparse' one-hot encodes them into a scipy CSR matrix.
+ENCODING = os.environ.get("NARRATOR_ENCODING", "native")
+# Categorical columns keep their most frequent levels up to this count; the rest become OTHER.
+MAX_CATEGORIES = int(os.environ.get("NARRATOR_MAX_CATEGORIES", 64))
+# A categorical column with more distinct values than this fraction of its rows is an
+# identifier (IDs, free text) and carries no signal a tree could generalize from.
+IDENTIFIER_RATIO = 0.9
+OTHER = "__other__"
+
+
+def _cap_levels(values: pd.Series, max_categories=MAX_CATEGORIES) -> pd.Series:
+    """Returns the column as a category with its most frequent levels; rarer levels become OTHER."""
+    counts = values.value_counts()
+    if len(counts) <= max_categories:
+        return values.astype('category')
+    keep = pd.Index(counts.index[:max_categories])
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Recode through the categories rather than the rows.
+        mapping = np.append(keep.get_indexer(values.cat.categories), -1)
+        codes = mapping[values.cat.codes.to_numpy()]
+    else:
+        codes = keep.get_indexer(values)
+    capped = pd.Categorical.from_codes(np.where((codes < 0) & values.notna().to_numpy(), len(keep), codes),
+                                       categories=[*map(str, keep), OTHER])
+    return pd.Series(capped, index=values.index, name=values.name)
+
+
+def split_columns(X: pd.DataFrame, profile=None):
+    """
+    Sorts feature columns into numeric, categorical and identifier columns. Booleans count as
+    numeric; identifiers are categorical columns with a distinct value on (almost) every row.
+    Columns described by `profile` (see core.profiling) take its type instead of being counted
+    again, which also keeps the decision of the full frame when X is a sample of it.
+    """
+    columns = (profile or {}).get("columns", {})
+    numeric, categorical, identifiers = [], [], []
+    for col in X.columns:
+        values = X[col]
+        if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+            numeric.append(col)
+            continue
+        if col in columns:
+            (identifiers if columns[col]["type"] == "identifier" else categorical).append(col)
+            continue
+        non_null = values.count()
+        n_levels = len(values.cat.categories) if isinstance(values.dtype, pd.CategoricalDtype) else values.nunique()
+        if n_levels > MAX_CATEGORIES and n_levels > IDENTIFIER_RATIO * non_null:
+            identifiers.append(col)
+        else:
+            categorical.append(col)
+    return numeric, categorical, identifiers
+
+
+def encode_native(X: pd.DataFrame, numeric, categorical) -> pd.DataFrame:
+    """A float32 frame with capped 'category' columns, for XGBoost's enable_categorical."""
+    columns = {col: X[col].astype(np.float32) for col in numeric}
+    columns.update({col: _cap_levels(X[col]) for col in categorical})
+    return pd.DataFrame(columns, index=X.index)[numeric + categorical]
+
+
+def apply_native(X: pd.DataFrame, reference: pd.DataFrame) -> pd.DataFrame:
+    """
+    Encodes X like `reference`, an earlier encode_native result: the same columns, with the
+    categorical columns on the same levels, so that a model trained on `reference` can score or
+    continue training on X. Unseen levels become OTHER where the reference had capped the
+    column, and missing otherwise.
+    """
+    columns = {}
+    for col in reference.columns:
+        values = X[col]
+        if not isinstance(reference[col].dtype, pd.CategoricalDtype):
+            columns[col] = values.astype(np.float32)
+            continue
+        categories = reference[col].cat.categories
+        capped = OTHER in categories
+        codes = categories.get_indexer(values.astype(str) if capped else values.astype(object))
+        if capped:
+            codes = np.where((codes < 0) & values.notna().to_numpy(), categories.get_loc(OTHER), codes)
+        columns[col] = pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=X.index)
+    return pd.DataFrame(columns, index=X.index)
+
+
+def encode_sparse(X: pd.DataFrame, numeric, categorical):
+    """
+    A CSR matrix with the numeric columns followed by a one-hot block per categorical column.
+    The numeric columns are stored densely within the matrix, so this pays off when the one-hot
+    block dominates. Returns (matrix, feature_names, groups) where groups[i] is the original column of feature i.
+    """
+    from scipy import sparse
+    n = len(X)
+    blocks, names, groups = [], [], []
+    if numeric:
+        values = X[numeric].to_numpy(dtype=np.float32)
+        # Zeros are stored explicitly: XGBoost reads entries missing from a sparse matrix as NaN.
+        # The CSR arrays are built directly, as COO coordinates would take two int64s per value.
+        present = ~np.isnan(values)
+        indptr = np.concatenate(([0], np.cumsum(present.sum(axis=1))))
+        indices = np.tile(np.arange(len(numeric), dtype=np.int32), n)[present.ravel()]
+        blocks.append(sparse.csr_matrix((values[present], indices, indptr), shape=values.shape))
+        names += list(numeric)
+        groups += list(numeric)
+    for col in categorical:
+        capped = _cap_levels(X[col])
+        codes = capped.cat.codes.to_numpy()
+        valid = codes >= 0
+        blocks.append(sparse.csr_matrix((np.ones(valid.sum(), dtype=np.float32), (np.flatnonzero(valid), codes[valid])),
+                                        shape=(n, len(capped.cat.categories))))
+        names += [f"{col}_{level}" for level in capped.cat.categories]
+        groups += [col] * len(capped.cat.categories)
+    matrix = sparse.hstack(blocks, format='csr') if blocks else sparse.csr_matrix((n, 0), dtype=np.float32)
+    return matrix, names, groups
+
+
+def encode(X: pd.DataFrame, method=None, profile=None):
+    """
+    Encodes the feature columns for XGBoost without materializing a dense one-hot frame, with
+    `method` 'native' or 'sparse' (default: ENCODING) and identifiers found by split_columns.
+    Returns (matrix, feature_names, groups, dropped) where groups maps each encoded feature to
+    its original column and dropped lists the identifier columns that were left out.
+    """
+    method = method or ENCODING
+    if method not in ('native', 'sparse'):
+        raise ValueError(f"Unsupported encoding: {method}")
+    numeric, categorical, identifiers = split_columns(X, profile)
+    if method == 'native':
+        matrix = encode_native(X, numeric, categorical)
+        names = list(matrix.columns)
+        return matrix, names, names, identifiers
+    matrix, names, groups = encode_sparse(X, numeric, categorical)
+    return matrix, names, groups, identifiers
+
+
+def aggregate_importances(importances, groups) -> pd.Series:
+    """Sums encoded feature importances per original column, normalized to sum to 1, largest first."""
+    totals = pd.Series(np.asarray(importances, dtype=np.float64), index=groups).groupby(level=0, sort=False).sum()
+    if totals.sum() > 0:
+        totals = totals / totals.sum()
+    return totals.sort_values(ascending=False)
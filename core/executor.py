@@ -0,0 +1,136 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+MAX_WORKERS = int(os.environ.get("NARRATOR_MAX_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+JOB_TIMEOUT = float(os.environ.get("NARRATOR_JOB_TIMEOUT", 1800))
+
+
+class JobCancelledError(Exception):
+    """Raised when a job is cancelled before or while it runs."""
+
+
+class JobTimeoutError(Exception):
+    """Raised when a job runs longer than the executor's per-job timeout."""
+
+
+def _worker_main(conn, fn, args):
+    """
+    Entry point of a job process. Runs the job and sends back ("ok", result) or ("error", message).
+    """
+    try:
+        result = fn(*args)
+        conn.send(("ok", result))
+    except BaseException as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class JobExecutor:
+    """
+    A bounded pool of job processes driven from the asyncio event loop.
+
+    Every job runs in its own child process so that a running job can be terminated on
+    timeout or cancellation, while at most `max_workers` of them run at once; further jobs wait
+    for a free slot. The API admits jobs into the shared job store and bounds its queue there.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, job_timeout=JOB_TIMEOUT):
+        self.max_workers = max_workers
+        self.job_timeout = job_timeout
+        # forkserver forks each job from a clean, single-threaded server process; it is not
+        # available on Windows, where spawn is the only option.
+        method = "forkserver" if sys.platform != "win32" else "spawn"
+        self._ctx = multiprocessing.get_context(method)
+        self._waiters = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-waiter")
+        self._slots = None
+        self._jobs = {}
+        self._processes = {}
+        self._cancelled = set()
+
+    @property
+    def active(self):
+        """Number of jobs that are queued or running."""
+        return len(self._jobs)
+
+    def submit(self, job_id, fn, *args):
+        """
+        Schedules `fn(*args)` to run in a job process and returns the asyncio.Task awaiting it.
+        `fn` and its arguments must be picklable.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        task = asyncio.get_running_loop().create_task(self._run(job_id, fn, args))
+        self._jobs[job_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(job_id, None))
+        return task
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. Returns False if the job is unknown or already finished.
+        """
+        if job_id not in self._jobs:
+            return False
+        self._cancelled.add(job_id)
+        process = self._processes.get(job_id)
+        if process is not None and process.is_alive():
+            process.terminate()
+        return True
+
+    async def _run(self, job_id, fn, args):
+        try:
+            async with self._slots:
+                if job_id in self._cancelled:
+                    raise JobCancelledError("Job was cancelled before it started.")
+                return await self._run_in_process(job_id, fn, args)
+        finally:
+            self._cancelled.discard(job_id)
+
+    async def _run_in_process(self, job_id, fn, args):
+        loop = asyncio.get_running_loop()
+        parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(target=_worker_main, args=(child_conn, fn, args))
+        process.start()
+        child_conn.close()
+        self._processes[job_id] = process
+        try:
+            # poll() returns True on a result and also on EOF, i.e. when the process dies.
+            ready = await loop.run_in_executor(self._waiters, parent_conn.poll, self.job_timeout)
+            if job_id in self._cancelled:
+                raise JobCancelledError("Job was cancelled while running.")
+            if not ready:
+                process.terminate()
+                raise JobTimeoutError(f"Job exceeded the {self.job_timeout:g}s timeout.")
+            try:
+                status, payload = parent_conn.recv()
+            except EOFError:
+                await loop.run_in_executor(self._waiters, process.join)
+                raise RuntimeError(f"Job process exited unexpectedly with code {process.exitcode}.")
+            if status == "error":
+                raise RuntimeError(payload)
+            return payload
+        finally:
+            self._processes.pop(job_id, None)
+            parent_conn.close()
+            await loop.run_in_executor(self._waiters, process.join)
+
+    def warm_up(self, modules):
+        """
+        Starts the fork server with `modules` already imported, so every job process is forked
+        with them loaded instead of importing them itself. Only effective before the first job.
+        """
+        if self._ctx.get_start_method() != "forkserver":
+            return
+        from multiprocessing import forkserver
+        self._ctx.set_forkserver_preload(list(modules))
+        forkserver.ensure_running()
+
+    def shutdown(self):
+        """Terminates every running job process and stops the waiter threads."""
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        self._waiters.shutdown(wait=False, cancel_futures=True)
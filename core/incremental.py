@@ -0,0 +1,320 @@
+import os
+import pickle
+import re
+import time
+import numpy as np
+import pandas as pd
+from core import analysis, anova, cache, correlation, encoding, ingestion, modeling
+
+# --- Configuration ---
+STATE_DIR = os.environ.get("NARRATOR_INCREMENTAL_DIR", os.path.join('output', 'incremental'))
+# Rows kept in the uniform sample that plots and model retraining use.
+SAMPLE_ROWS = ingestion.SAMPLE_ROWS
+# A model is retrained from scratch when its accuracy or R² on a new batch falls this far below
+# the value it was trained with; otherwise it is warm-started on the batch.
+DRIFT_THRESHOLD = float(os.environ.get("NARRATOR_DRIFT_THRESHOLD", 0.05))
+WARM_START_ROUNDS = int(os.environ.get("NARRATOR_WARM_START_ROUNDS", 50))
+MIN_WARM_START_ROWS = 100
+# Categorical columns with this many levels or more are not tested, as in core.analysis.
+MAX_ANOVA_LEVELS = 15
+STATE_VERSION = 1
+
+
+class Moments:
+    """
+    Running means and co-moments of the numeric columns, merged batch by batch with Chan et al.'s
+    parallel update, so the Pearson correlation matrix of everything seen so far is always
+    available in O(columns²) memory.
+    """
+
+    def __init__(self, n_cols):
+        self.n = 0
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros((n_cols, n_cols))
+
+    def update(self, X):
+        n_batch = len(X)
+        if not n_batch:
+            return
+        mean_batch = X.mean(axis=0)
+        centered = X - mean_batch
+        delta = mean_batch - self.mean
+        total = self.n + n_batch
+        self.m2 += centered.T @ centered + np.outer(delta, delta) * (self.n * n_batch / total)
+        self.mean += delta * (n_batch / total)
+        self.n = total
+
+    def variances(self):
+        return np.diag(self.m2) / max(self.n - 1, 1)
+
+    def correlation(self):
+        scale = np.sqrt(np.diag(self.m2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = self.m2 / np.outer(scale, scale)
+        return np.nan_to_num(corr)
+
+
+class GroupSums:
+    """Per-level row counts, sums and sums of squares of the numeric columns, for ANOVA."""
+
+    def __init__(self, n_cols):
+        self.levels = {}
+        self.counts = np.zeros(0)
+        self.sums = np.zeros((0, n_cols))
+        self.sumsq = np.zeros((0, n_cols))
+
+    def update(self, values: pd.Series, X):
+        codes, uniques = pd.factorize(values)
+        for level in uniques:
+            if level not in self.levels:
+                self.levels[level] = len(self.levels)
+        if len(self.levels) > len(self.counts):
+            grow = len(self.levels) - len(self.counts)
+            self.counts = np.concatenate([self.counts, np.zeros(grow)])
+            self.sums = np.vstack([self.sums, np.zeros((grow, self.sums.shape[1]))])
+            self.sumsq = np.vstack([self.sumsq, np.zeros((grow, self.sumsq.shape[1]))])
+        valid = codes >= 0
+        rows = np.array([self.levels[level] for level in uniques], dtype=np.int64)[codes[valid]]
+        # One groupby for the sums and sums of squares of every column, as in anova.scan.
+        grouped = pd.DataFrame(np.hstack([X[valid], X[valid] ** 2])).groupby(rows).sum()
+        index, totals = grouped.index.to_numpy(), grouped.to_numpy()
+        n_cols = self.sums.shape[1]
+        self.counts += np.bincount(rows, minlength=len(self.counts))
+        self.sums[index] += totals[:, :n_cols]
+        self.sumsq[index] += totals[:, n_cols:]
+
+
+class DatasetState:
+    """
+    Everything incremental mode keeps about a dataset between batches: per-column statistics for
+    cleaning (ingestion.ColumnStats), Moments for correlations, GroupSums for ANOVA, outlier
+    counts, a reservoir sample of cleaned rows, the models of each target and the fingerprints
+    of the batches folded in so far. Numeric and categorical columns are fixed by the first batch.
+    """
+
+    def __init__(self):
+        self.version = STATE_VERSION
+        self.columns = ingestion.ColumnStats()
+        self.numeric_cols = None
+        self.categorical_cols = None
+        self.moments = None
+        # Sums for ANOVA are taken around the first batch's means, for numerical stability.
+        self.shift = None
+        self.groups = {}
+        self.outliers = {}
+        self.reservoir = ingestion.Reservoir(SAMPLE_ROWS)
+        self.models = {}
+        self.batches = []
+
+    @property
+    def rows(self):
+        return self.columns.rows
+
+    def observe(self, batch: pd.DataFrame, fingerprint=None):
+        """
+        Adds a raw batch to the per-column statistics and returns the statistics of all rows so
+        far, for cleaning the batch. A batch that was already folded in raises ValueError.
+        """
+        if fingerprint is not None and fingerprint in self.batches:
+            raise ValueError("This batch was already added to the dataset.")
+        self.columns.update(batch)
+        self.batches.append(fingerprint)
+        return self.columns.stats()
+
+    def fold(self, df_clean: pd.DataFrame, metadata):
+        """Folds a cleaned batch into the moments, group sums, outlier counts and sample."""
+        if self.numeric_cols is None:
+            self.numeric_cols = list(metadata["numeric_cols"])
+            self.categorical_cols = list(metadata["categorical_cols"])
+            self.moments = Moments(len(self.numeric_cols))
+        missing = [col for col in self.numeric_cols + self.categorical_cols if col not in df_clean.columns]
+        if missing:
+            raise ValueError(f"The batch lacks columns of the dataset: {', '.join(missing)}")
+
+        X = df_clean[self.numeric_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        # Values cleaning could not impute count as the batch mean, i.e. add no co-moment.
+        X = np.where(np.isnan(X), np.nanmean(X, axis=0) if len(X) else 0.0, X)
+        X = np.nan_to_num(X)
+        self.moments.update(X)
+        if self.shift is None:
+            self.shift = self.moments.mean.copy()
+        shifted = X - self.shift
+        for col in self.categorical_cols:
+            if col not in self.groups:
+                self.groups[col] = GroupSums(len(self.numeric_cols))
+            sums = self.groups[col]
+            if sums is None:
+                continue
+            sums.update(df_clean[col], shifted)
+            # Levels only accumulate, so a column that has too many stays ineligible.
+            if len(sums.levels) >= MAX_ANOVA_LEVELS:
+                self.groups[col] = None
+
+        for col, count in metadata.get("outliers", {}).items():
+            self.outliers[col] = self.outliers.get(col, 0) + count
+        self.reservoir.add(df_clean)
+
+    def insights(self):
+        """Correlation and ANOVA insights over all rows so far, from the merged statistics."""
+        insights = []
+        variances = self.moments.variances()
+        keep = np.flatnonzero(variances > 0)
+        if len(keep) > 1:
+            corr = self.moments.correlation()[np.ix_(keep, keep)]
+            values, i, j = correlation.top_pairs_from_matrix(corr, 5)
+            names = [self.numeric_cols[k] for k in keep]
+            insights += analysis.correlation_insights([(names[a], names[b], float(v)) for v, a, b in zip(values, i, j)],
+                                                      "pearson")
+
+        results = []
+        for cat_col, sums in self.groups.items():
+            if sums is None or len(sums.levels) <= 2 or not len(keep):
+                continue
+            stat, p_values, effect = anova.anova_from_group_stats(sums.counts, sums.sums, sums.sumsq)
+            for j in keep:
+                num_col = self.numeric_cols[j]
+                if num_col != cat_col and np.isfinite(p_values[j]):
+                    results.append({
+                        "categorical_feature": cat_col,
+                        "numeric_feature": num_col,
+                        "test": "anova",
+                        "statistic": float(stat[j]),
+                        "p_value": float(p_values[j]),
+                        "effect_size": float(effect[j]),
+                    })
+        for result, q in zip(results, anova.benjamini_hochberg([r["p_value"] for r in results])):
+            result["q_value"] = float(q)
+        insights += analysis.anova_insights(sorted(results, key=lambda r: -r["effect_size"]))
+        return insights
+
+    def sample(self):
+        """The reservoir sample of cleaned rows, with the dataset's dtypes."""
+        sample = self.reservoir.result()
+        # Batches with different category levels concatenate to object columns.
+        categorical = [col for col in self.categorical_cols if col in sample.columns]
+        return sample.astype({col: 'category' for col in categorical}) if categorical else sample
+
+    def metadata(self):
+        """Cleaning metadata describing the sample, with outlier and null counts over all rows."""
+        return {"outliers": dict(self.outliers), "outlier_masks": {}, "numeric_cols": list(self.numeric_cols),
+                "categorical_cols": list(self.categorical_cols), "rows": self.rows, "batches": len(self.batches),
+                "null_counts": dict(self.columns.null_counts)}
+
+    def update_models(self, batch: pd.DataFrame, sample: pd.DataFrame, target_cols, n_jobs=None):
+        """
+        Brings each target's model up to date with a cleaned batch and returns their insights.
+        A target's first model is trained on the sample. Later, the model is scored on the
+        batch: if its accuracy or R² dropped by more than DRIFT_THRESHOLD (or the batch has an
+        unseen class) it is retrained on the sample, otherwise it is warm-started on the batch.
+        No target is a feature of another target's model.
+        """
+        insights = [{"type": "error", "title": "Invalid Target", "details": f"Target column '{col}' not found in data."}
+                    for col in target_cols if not col or col not in batch.columns]
+        target_cols = [col for col in target_cols if col and col in batch.columns]
+        for target_col in target_cols:
+            insights += self._update_model(batch, sample, target_col, target_cols, n_jobs)
+        return insights
+
+    def _update_model(self, batch, sample, target_col, target_cols, n_jobs):
+        model = self.models.get(target_col)
+        drift = None
+        if model is not None:
+            booster = _load_booster(model["booster"])
+            X_batch = encoding.apply_native(batch, model["reference"])
+            y_batch = _encode_labels(batch[target_col], model)
+            if y_batch is None:
+                drift = float('inf')
+            else:
+                metric = "accuracy" if model["model_type"] == "Classification" else "r2"
+                drift = model["metrics"][metric] - modeling.evaluate(booster, X_batch, y_batch, model["model_type"])[metric]
+            if drift <= DRIFT_THRESHOLD and len(batch) >= MIN_WARM_START_ROWS:
+                return [self._warm_start(model, booster, X_batch, y_batch, target_col, drift)]
+
+        features = sample.drop(columns=target_cols)
+        X, _, groups, dropped = encoding.encode(features, 'native')
+        target_insights, trained = modeling.train_target(X, groups, sample[target_col], target_col, n_jobs,
+                                                         encoding_name='native')
+        for insight in target_insights:
+            if insight["type"] == "feature_importance":
+                insight["details"]["dropped_columns"] = dropped
+                insight["details"]["training"].update(mode="initial" if model is None else "retrained", drift=drift)
+        if trained is not None:
+            self.models[target_col] = {
+                "booster": bytes(trained["booster"].save_raw("ubj")), "params": trained["params"],
+                "model_type": trained["model_type"], "classes": trained["classes"], "metrics": trained["metrics"],
+                # An empty frame keeps the encoded columns and category levels for apply_native.
+                "reference": X.iloc[:0], "groups": groups, "dropped": dropped,
+            }
+        return target_insights
+
+    def _warm_start(self, model, booster, X_batch, y_batch, target_col, drift):
+        import xgboost as xgb
+        started = time.perf_counter()
+        # The batch is split 64/16/20 like modeling.train_target: early stopping watches the
+        # validation rows, and the metrics and importances come from test rows it never saw.
+        n_test = max(1, len(y_batch) // 5)
+        n_valid = max(1, (len(y_batch) - n_test) // 5)
+        order = np.random.default_rng(len(self.batches)).permutation(len(y_batch))
+        test, valid, train = order[:n_test], order[n_test:n_test + n_valid], order[n_test + n_valid:]
+        dtrain = xgb.DMatrix(X_batch.iloc[train], label=y_batch[train], enable_categorical=True)
+        dvalid = xgb.DMatrix(X_batch.iloc[valid], label=y_batch[valid], enable_categorical=True)
+        booster = xgb.train(model["params"], dtrain, num_boost_round=WARM_START_ROUNDS, xgb_model=booster,
+                            evals=[(dvalid, "valid")], early_stopping_rounds=modeling.EARLY_STOPPING_ROUNDS,
+                            verbose_eval=False)
+        metrics = modeling.evaluate(booster, X_batch.iloc[test], y_batch[test], model["model_type"])
+        metrics["test_rows"] = int(n_test)
+        # The next batch's drift is measured against this held-out score of the updated model.
+        model["booster"], model["metrics"] = bytes(booster.save_raw("ubj")), metrics
+        importances = modeling.shap_importances(booster, X_batch.iloc[test], model["groups"])
+        training = {"rows": int(len(train)), "trees": int(booster.best_iteration + 1), "mode": "warm_start",
+                    "drift": drift, "seconds": time.perf_counter() - started}
+        insight = modeling.importance_insight(target_col, model["model_type"], importances, metrics, training, 'native')
+        insight["details"]["dropped_columns"] = model["dropped"]
+        return insight
+
+
+def _load_booster(raw):
+    import xgboost as xgb
+    booster = xgb.Booster()
+    booster.load_model(bytearray(raw))
+    return booster
+
+
+def _encode_labels(y: pd.Series, model):
+    """Encodes a batch's target like the model's training labels; None if it has an unseen class."""
+    if model["classes"] is None:
+        return y.to_numpy(dtype=np.float64)
+    target_is_categorical = y.dtype == 'object' or str(y.dtype).startswith('category')
+    codes = pd.Index(model["classes"]).get_indexer(y.astype(str) if target_is_categorical else y)
+    return None if (codes < 0).any() else codes
+
+
+def _state_path(dataset_id, state_dir=STATE_DIR):
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", dataset_id) or dataset_id.startswith('.'):
+        raise ValueError(f"Invalid dataset id: {dataset_id!r}")
+    return os.path.join(state_dir, f"{dataset_id}.pkl")
+
+
+def load(dataset_id, state_dir=STATE_DIR):
+    """Returns the saved state of a dataset, or a new one."""
+    path = _state_path(dataset_id, state_dir)
+    if not os.path.exists(path):
+        return DatasetState()
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if getattr(state, "version", None) != STATE_VERSION:
+        raise ValueError(f"The state of dataset '{dataset_id}' was saved by another version; analyze it in full.")
+    return state
+
+
+def save(dataset_id, state, state_dir=STATE_DIR):
+    """Saves a dataset's state, atomically."""
+    path = _state_path(dataset_id, state_dir)
+    os.makedirs(state_dir, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def batch_fingerprint(batch):
+    return cache.make_key(cache.fingerprint(batch))
@@ -0,0 +1,380 @@
+import os
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+CHUNK_SIZE = int(os.environ.get("NARRATOR_CHUNK_SIZE", 100_000))
+SAMPLE_ROWS = int(os.environ.get("NARRATOR_SAMPLE_ROWS", 500_000))
+# Files larger than this are streamed in chunks instead of being read whole.
+STREAMING_THRESHOLD = int(os.environ.get("NARRATOR_STREAMING_THRESHOLD", 512 * 1024 ** 2))
+# Upper bound on the distinct values counted per categorical column while streaming.
+MAX_TRACKED_VALUES = 10_000
+
+
+# File formats by extension, after any compression suffix is removed.
+FORMATS = {
+    '.csv': 'csv', '.txt': 'csv',
+    '.parquet': 'parquet', '.pq': 'parquet',
+    '.feather': 'feather', '.arrow': 'feather', '.ipc': 'feather',
+    '.ndjson': 'ndjson', '.jsonl': 'ndjson',
+    '.json': 'json',
+    '.sas7bdat': 'sas',
+}
+COMPRESSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+# Leading bytes of compressed and binary files, so that uploads saved without their name are recognized.
+MAGIC = [(b'\x1f\x8b', 'gzip'), (b'\x28\xb5\x2f\xfd', 'zstd'), (b'PAR1', 'parquet'),
+         (b'ARROW1', 'feather'), (b'FEA1', 'feather')]
+
+
+def detect_format(file_name=None, path=None):
+    """
+    Returns (format, compression) of a file from its name or, failing that, from its first bytes.
+    compression is 'gzip', 'zstd' or None. Files that match nothing are read as CSV, as before.
+    """
+    fmt = compression = None
+    if file_name:
+        name = file_name.lower()
+        stem, ext = os.path.splitext(name)
+        if ext in COMPRESSIONS:
+            compression = COMPRESSIONS[ext]
+            stem, ext = os.path.splitext(stem)
+        fmt = FORMATS.get(ext)
+    if path is not None and (fmt is None or compression is None):
+        with open(path, 'rb') as f:
+            head = f.read(8)
+        for magic, kind in MAGIC:
+            if head.startswith(magic):
+                if kind in ('gzip', 'zstd'):
+                    compression = kind
+                elif fmt is None:
+                    fmt = kind
+                break
+    return fmt or 'csv', compression
+
+
+def _open(source, compression, seekable=False):
+    """
+    Opens a path or file object for reading, decompressing it on the fly. Formats with a footer
+    (Parquet, Arrow IPC) need a `seekable` source, so compressed ones are decompressed into memory.
+    """
+    import pyarrow as pa
+    if not compression:
+        return source
+    stream = pa.CompressedInputStream(pa.OSFile(source) if isinstance(source, str) else source, compression)
+    return pa.BufferReader(stream.read()) if seekable else stream
+
+
+def _arrow_to_pandas(table):
+    """
+    Converts an Arrow table like pandas' own CSV parser would see it: dates and times stay
+    strings (the cleaning stage decides what to do with them) and columns are not consolidated,
+    so numeric columns of a memory-mapped table are not copied.
+    """
+    import pyarrow as pa
+    for i, field in enumerate(table.schema):
+        if pa.types.is_temporal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+    return table.to_pandas(split_blocks=True)
+
+
+def _read_csv_arrow(source, compression):
+    import pyarrow.csv as pv
+    convert = pv.ConvertOptions(strings_can_be_null=True, quoted_strings_can_be_null=True)
+    return _arrow_to_pandas(pv.read_csv(_open(source, compression), convert_options=convert))
+
+
+def read_table(source, file_name=None, fmt=None, compression=None) -> pd.DataFrame:
+    """
+    Reads a whole table from a path or file object. CSV and NDJSON are parsed with pyarrow's
+    multithreaded readers, Parquet natively and Feather/Arrow IPC files memory-mapped, so their
+    numeric columns are not copied. gzip and zstd compressed files are decompressed on the fly.
+    """
+    if fmt is None:
+        fmt, compression = detect_format(file_name, source if isinstance(source, str) else None)
+    if fmt == 'csv':
+        import pyarrow as pa
+        try:
+            return _read_csv_arrow(source, compression)
+        except pa.ArrowInvalid as e:
+            # e.g. rows with a different number of fields, which pandas reads as missing values.
+            print(f"pyarrow could not parse the CSV file, falling back to pandas. Error: {e}")
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return pd.read_csv(source, compression=compression)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return _arrow_to_pandas(pq.read_table(_open(source, compression, seekable=True), memory_map=True))
+    if fmt == 'feather':
+        import pyarrow.feather as feather
+        return _arrow_to_pandas(feather.read_table(_open(source, compression, seekable=True), memory_map=True))
+    if fmt == 'ndjson':
+        import pyarrow.json as pj
+        return _arrow_to_pandas(pj.read_json(_open(source, compression)))
+    if fmt == 'json':
+        return pd.read_json(source, compression=compression)
+    if fmt == 'sas':
+        return pd.read_sas(source, format='sas7bdat')
+    raise ValueError(f"Unsupported file type: {fmt}")
+
+
+def read_columns(file_obj, file_name, nrows=100):
+    """
+    Reads only the header and the first `nrows` rows of a file, e.g. to list its columns in the UI.
+    The file position is restored afterwards so the same object can still be uploaded.
+    """
+    position = file_obj.tell() if hasattr(file_obj, 'tell') else None
+    try:
+        fmt, compression = detect_format(file_name)
+        if fmt == 'csv':
+            return pd.read_csv(file_obj, nrows=nrows, compression=compression)
+        if fmt == 'ndjson':
+            return pd.read_json(file_obj, lines=True, nrows=nrows, compression=compression)
+        if fmt == 'parquet' and not compression:
+            import pyarrow.parquet as pq
+            batch = next(pq.ParquetFile(file_obj).iter_batches(batch_size=nrows), None)
+            return batch.to_pandas() if batch is not None else pd.DataFrame()
+        return read_table(file_obj, fmt=fmt, compression=compression).head(nrows)
+    finally:
+        if position is not None:
+            file_obj.seek(position)
+
+
+class QuantileSketch:
+    """
+    A mergeable, fixed-size summary of a numeric stream for approximate quantiles.
+
+    Values are kept as at most `size` weighted centroids of roughly equal weight; adding a batch
+    merges it into the centroids and re-compresses them, so memory stays O(size) however many
+    values are seen. Quantiles are interpolated between centroid midpoints.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = np.sort(values[~np.isnan(values)])
+        if not values.size:
+            return
+        self.min = min(self.min, values[0])
+        self.max = max(self.max, values[-1])
+        self._merge(*self._compress(values, np.ones(values.size)))
+
+    def merge(self, other):
+        """Folds another sketch into this one."""
+        if other.weights.size:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._merge(other.means, other.weights)
+
+    def quantile(self, q):
+        if not self.weights.size:
+            return np.nan
+        midpoints = np.cumsum(self.weights) - self.weights / 2
+        value = np.interp(q * self.count, midpoints, self.means)
+        return float(np.clip(value, self.min, self.max))
+
+    def _merge(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='mergesort')
+        self.means, self.weights = self._compress(means[order], weights[order])
+
+    def _compress(self, means, weights):
+        if means.size <= self.size:
+            return means, weights
+        cumulative = np.cumsum(weights)
+        bins = ((cumulative - weights / 2) / cumulative[-1] * self.size).astype(np.int64)
+        bins = np.minimum(bins, self.size - 1)
+        bin_weights = np.bincount(bins, weights=weights, minlength=self.size)
+        bin_sums = np.bincount(bins, weights=means * weights, minlength=self.size)
+        keep = bin_weights > 0
+        return bin_sums[keep] / bin_weights[keep], bin_weights[keep]
+
+
+class ColumnStats:
+    """
+    Mergeable per-column statistics of a stream of chunks: dtypes, null counts, quantile
+    sketches of the numeric columns and (capped) value counts of the others. stats() returns
+    them in the form the cleaning stage takes.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.sketches, self.value_counts, self.null_counts, self.dtypes = {}, {}, {}, {}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            series = chunk[col]
+            self.null_counts[col] = self.null_counts.get(col, 0) + int(series.isna().sum())
+            numeric = pd.to_numeric(series, errors='coerce')
+            # Like the cleaning stage, a column only counts as numeric if every value parses.
+            if self.dtypes.get(col, 'numeric') == 'numeric' and numeric.isna().sum() == series.isna().sum():
+                self.dtypes[col] = 'numeric'
+                self.sketches.setdefault(col, QuantileSketch()).update(numeric.to_numpy())
+            else:
+                self.dtypes[col] = 'categorical'
+                self.sketches.pop(col, None)
+                counts = series.value_counts()
+                if col in self.value_counts:
+                    counts = self.value_counts[col].add(counts, fill_value=0)
+                if len(counts) > MAX_TRACKED_VALUES:
+                    counts = counts.nlargest(MAX_TRACKED_VALUES)
+                self.value_counts[col] = counts
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "dtypes": self.dtypes,
+            "null_counts": self.null_counts,
+            "medians": {col: sketch.quantile(0.5) for col, sketch in self.sketches.items()},
+            "quartiles": {col: [sketch.quantile(0.25), sketch.quantile(0.75)] for col, sketch in self.sketches.items()},
+            "modes": {col: counts.idxmax() for col, counts in self.value_counts.items() if len(counts)},
+        }
+
+
+class Reservoir:
+    """
+    Uniform sample of at most `size` rows from a stream of chunks (Algorithm R, vectorized per chunk).
+    """
+
+    def __init__(self, size, seed=42):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.rows = None
+
+    def add(self, chunk):
+        n = len(chunk)
+        positions = np.arange(self.seen, self.seen + n)
+        # Row i of the stream replaces a random slot with probability size / (i + 1).
+        slots = np.where(positions < self.size, positions, self.rng.integers(0, positions + 1))
+        keep = slots < self.size
+        self.seen += n
+        if not keep.any():
+            return
+        taken = chunk.iloc[np.flatnonzero(keep)].assign(_slot=slots[keep], _row=positions[keep])
+        # Within a chunk, a later row replacing the same slot wins.
+        taken = taken.drop_duplicates(subset='_slot', keep='last')
+        if self.rows is None:
+            self.rows = taken
+        else:
+            self.rows = pd.concat([self.rows[~self.rows['_slot'].isin(taken['_slot'])], taken])
+
+    def result(self):
+        if self.rows is None:
+            return pd.DataFrame()
+        return self.rows.sort_values('_row').drop(columns=['_slot', '_row']).reset_index(drop=True)
+
+
+class _Spill:
+    """
+    Writes every chunk to an Arrow IPC file with a fixed schema and reads it back memory-mapped.
+    Columns that are numeric in the first chunk are stored as float64, all others as strings.
+    """
+
+    def __init__(self, path):
+        import pyarrow as pa
+        self.pa = pa
+        self.path = path
+        self.writer = None
+        self.schema = None
+        self.numeric_cols = None
+
+    def _normalize(self, chunk):
+        chunk = chunk.copy()
+        for col in chunk.columns:
+            if col in self.numeric_cols:
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+            else:
+                chunk[col] = chunk[col].where(chunk[col].isna(), chunk[col].astype(str))
+        return chunk
+
+    def add(self, chunk):
+        if self.writer is None:
+            self.numeric_cols = set(chunk.select_dtypes(include=np.number).columns)
+            first = self.pa.Table.from_pandas(self._normalize(chunk), preserve_index=False)
+            self.schema = first.schema
+            self.writer = self.pa.ipc.new_file(self.path, self.schema)
+            self.writer.write_table(first)
+            return
+        table = self.pa.Table.from_pandas(self._normalize(chunk), schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def result(self):
+        if self.writer is None:
+            return pd.DataFrame()
+        self.writer.close()
+        source = self.pa.memory_map(self.path, 'r')
+        return self.pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+
+
+def iter_chunks(file_path, fmt='csv', compression=None, chunksize=CHUNK_SIZE):
+    """Yields a CSV, NDJSON or Parquet file as DataFrames of at most `chunksize` rows."""
+    if fmt == 'parquet' and not compression:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path, memory_map=True).iter_batches(batch_size=chunksize):
+            yield _arrow_to_pandas(pa.Table.from_batches([batch]))
+        return
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError(f"Cannot stream {fmt} files")
+    source = _open(file_path, compression)
+    try:
+        if fmt == 'csv':
+            reader = pd.read_csv(source, chunksize=chunksize)
+        else:
+            reader = pd.read_json(source, lines=True, chunksize=chunksize)
+        with reader:
+            yield from reader
+    finally:
+        if compression:
+            source.close()
+
+
+def stream_table(file_path, chunksize=CHUNK_SIZE, sample_rows=SAMPLE_ROWS, spill_path=None, seed=42,
+                 fmt='csv', compression=None):
+    """
+    Reads a CSV, NDJSON or Parquet file once, in chunks, so that peak memory depends on the chunk
+    size rather than the file size. Returns (df, stats):
+
+    - df is a uniform reservoir sample of at most `sample_rows` rows or, when `spill_path` is
+      given, the full table read back memory-mapped from an Arrow IPC spill file.
+    - stats holds per-column dtypes and null counts over the whole file, medians and modes for
+      imputation, and approximate IQR quartiles from streaming quantile sketches. It is meant
+      to be passed to the cleaning stage so that sampled data is cleaned with full-file statistics.
+    """
+    sink = _Spill(spill_path) if spill_path else Reservoir(sample_rows, seed)
+    columns = ColumnStats()
+    for chunk in iter_chunks(file_path, fmt, compression, chunksize):
+        columns.update(chunk)
+        sink.add(chunk)
+        print(f"--> Streamed {columns.rows} rows...")
+    return sink.result(), columns.stats()
+
+
+def load_table(file_path, file_name=None, stream=None, chunksize=CHUNK_SIZE, sample_rows=SAMPLE_ROWS,
+               spill_path=None):
+    """
+    Loads a file for the pipeline and returns (df, stats). The format comes from `file_name`
+    (default: the path) or the file's first bytes. CSV, NDJSON and Parquet files above
+    STREAMING_THRESHOLD, or any of them when `stream` is True, go through stream_table; others
+    are read whole with read_table and stats is None. Feather/Arrow IPC files are never streamed,
+    as they are memory-mapped.
+    """
+    fmt, compression = detect_format(file_name or file_path, file_path)
+    streamable = fmt in ('csv', 'ndjson') or (fmt == 'parquet' and not compression)
+    if stream is None:
+        stream = os.path.getsize(file_path) > STREAMING_THRESHOLD
+    if not (stream and streamable):
+        return read_table(file_path, fmt=fmt, compression=compression), None
+    return stream_table(file_path, chunksize, sample_rows, spill_path, fmt=fmt, compression=compression)
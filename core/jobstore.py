@@ -0,0 +1,366 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# --- Configuration ---
+# 'sqlite' keeps jobs in a SQLite file that every API worker process on the host shares; a
+# redis:// URL keeps them in Redis (needs the redis package), so API processes on several hosts
+# can share one queue as long as they also share UPLOAD_DIR and the report store.
+JOB_STORE = os.environ.get("NARRATOR_JOB_STORE", "sqlite")
+JOB_STORE_PATH = os.environ.get("NARRATOR_JOB_STORE_PATH", os.path.join('output', 'cache', 'jobs.sqlite'))
+# Finished jobs are forgotten this many seconds after they finished.
+JOB_TTL = float(os.environ.get("NARRATOR_JOB_TTL", 24 * 3600))
+
+ACTIVE = ("pending", "in_progress")
+FINISHED = ("completed", "failed", "cancelled")
+FIELDS = ("id", "key", "status", "params", "progress", "timings", "result", "owner", "cancel_requested",
+          "created_at", "updated_at")
+
+
+def _job(job_id, key, status, params, result, now):
+    return {"id": job_id, "key": key, "status": status, "params": params, "progress": None,
+            "timings": {"created_at": now}, "result": result, "owner": None, "cancel_requested": False,
+            "created_at": now, "updated_at": now}
+
+
+class JobStore(ABC):
+    """
+    Shared state of the API's analysis jobs: status, progress, timings and the result reference
+    (the report path, or the error message of a failed job).
+
+    Jobs are created 'pending' with the parameters needed to run them, and any API worker process
+    claims them from the shared queue with claim(). A job's `owner` is the worker running it.
+    Cancelling a running job only sets `cancel_requested`, which its owner polls for, because the
+    request may arrive at another worker. Finished jobs are removed after `ttl` seconds.
+    """
+
+    @abstractmethod
+    def create(self, job_id, key, params=None, status="pending", result=None):
+        """Adds a job; a 'pending' job is queued for claim()."""
+
+    @abstractmethod
+    def get(self, job_id):
+        """Returns the job as a dict, or None if it is unknown or expired."""
+
+    @abstractmethod
+    def update(self, job_id, **fields):
+        """Sets fields of a job, e.g. its progress."""
+
+    @abstractmethod
+    def claim(self, owner):
+        """Takes the oldest pending job off the queue for `owner` and marks it 'in_progress', or returns None."""
+
+    def finish(self, job_id, status, result=None):
+        """Records the outcome of a job."""
+        job = self.get(job_id)
+        if job is None:
+            return
+        now = time.time()
+        timings = dict(job["timings"] or {}, finished_at=now)
+        if "started_at" in timings:
+            timings["seconds"] = now - timings["started_at"]
+        self.update(job_id, status=status, result=result, timings=timings)
+
+    @abstractmethod
+    def request_cancel(self, job_id):
+        """
+        Cancels a pending job right away and flags a running one for its owner. Returns the job's
+        status afterwards, or None if it is unknown.
+        """
+
+    @abstractmethod
+    def cancel_requests(self, owner):
+        """Returns the ids of `owner`'s running jobs that were asked to cancel."""
+
+    @abstractmethod
+    def count(self, statuses=ACTIVE):
+        """Number of jobs in any of `statuses`."""
+
+    @abstractmethod
+    def active_keys(self):
+        """Report keys of the jobs that are pending or running."""
+
+    @abstractmethod
+    def remove_expired(self, stale=None):
+        """
+        Forgets jobs that finished more than `ttl` seconds ago. Running jobs not updated for
+        `stale` seconds, whose worker must have died, are marked failed first.
+        """
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Keeps jobs in a SQLite file in WAL mode. claim() runs in an immediate transaction, so two
+    worker processes never claim the same job.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH, ttl=JOB_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Transactions are managed explicitly, so that claim() can take the write lock up front.
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                         "id TEXT PRIMARY KEY, key TEXT, status TEXT NOT NULL, params TEXT, progress TEXT, "
+                         "timings TEXT, result TEXT, owner TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, "
+                         "created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row(row):
+        job = dict(zip(FIELDS, row))
+        for field in ("params", "progress", "timings", "result"):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def _write(self, conn, job_id, fields):
+        fields = dict(fields, updated_at=time.time())
+        values = [json.dumps(value) if name in ("params", "progress", "timings", "result") and value is not None
+                  else value for name, value in fields.items()]
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*values, job_id])
+
+    def create(self, job_id, key, params=None, status="pending", result=None):
+        job = _job(job_id, key, status, params, result, time.time())
+        with self._lock:
+            conn = self._connect()
+            values = [json.dumps(job[name]) if name in ("params", "progress", "timings", "result")
+                      and job[name] is not None else job[name] for name in FIELDS]
+            conn.execute(f"INSERT INTO jobs ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})", values)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._write(self._connect(), job_id, fields)
+
+    def claim(self, owner):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE status = 'pending' "
+                                   f"ORDER BY created_at LIMIT 1").fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job = self._row(row)
+                job.update(status="in_progress", owner=owner,
+                           timings=dict(job["timings"] or {}, started_at=time.time()))
+                self._write(conn, job["id"], {name: job[name] for name in ("status", "owner", "timings")})
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return job
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'pending'",
+                         (now, job_id))
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'in_progress'",
+                         (now, job_id))
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def cancel_requests(self, owner):
+        with self._lock:
+            rows = self._connect().execute("SELECT id FROM jobs WHERE owner = ? AND status = 'in_progress' "
+                                           "AND cancel_requested = 1", (owner,)).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, statuses=ACTIVE):
+        with self._lock:
+            return self._connect().execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({','.join('?' * len(statuses))})",
+                                           list(statuses)).fetchone()[0]
+
+    def active_keys(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT DISTINCT key FROM jobs WHERE status IN (?, ?)", ACTIVE).fetchall()
+        return {row[0] for row in rows}
+
+    def remove_expired(self, stale=None):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            if stale:
+                conn.execute("UPDATE jobs SET status = 'failed', result = ?, updated_at = ? "
+                             "WHERE status = 'in_progress' AND updated_at < ?",
+                             (json.dumps("The worker running this job stopped."), now, now - stale))
+            conn.execute(f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED))}) AND updated_at < ?",
+                         [*FINISHED, now - self.ttl])
+
+
+class RedisJobStore(JobStore):
+    """
+    Keeps jobs in Redis: each job is a hash of JSON-encoded fields, pending ids wait in a list
+    and the ids of unfinished jobs are kept in a set. Finished jobs are given a Redis expiry.
+    claim() and request_cancel() read and write a job in one WATCH/MULTI transaction, retried
+    when the job changes in between, so a cancel can never be lost to a concurrent claim.
+    `client` is a redis.Redis, or any client with the same commands that raises `watch_error`
+    when a watched key changed (redis.exceptions.WatchError by default).
+    """
+
+    def __init__(self, client, prefix="narrator", ttl=JOB_TTL, watch_error=None):
+        if watch_error is None:
+            from redis.exceptions import WatchError as watch_error
+        self.client = client
+        self._watch_error = watch_error
+        self.prefix = prefix
+        self.ttl = ttl
+        self._queue = f"{prefix}:queue"
+        self._active = f"{prefix}:active"
+
+    def _name(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    @staticmethod
+    def _mapping(fields):
+        return {name: json.dumps(value) for name, value in fields.items()}
+
+    def _read(self, client, job_id):
+        fields = client.hgetall(self._name(job_id))
+        if not fields:
+            return None
+        return {self._text(name): json.loads(self._text(value)) for name, value in fields.items()}
+
+    def _write(self, client, job_id, fields):
+        client.hset(self._name(job_id), mapping=self._mapping(dict(fields, updated_at=time.time())))
+        if fields.get("status") in FINISHED:
+            client.srem(self._active, job_id)
+            client.expire(self._name(job_id), int(self.ttl))
+
+    def create(self, job_id, key, params=None, status="pending", result=None):
+        job = _job(job_id, key, status, params, result, time.time())
+        with self.client.pipeline() as pipe:
+            pipe.hset(self._name(job_id), mapping=self._mapping(job))
+            if status in ACTIVE:
+                pipe.sadd(self._active, job_id)
+                pipe.rpush(self._queue, job_id)
+            else:
+                pipe.expire(self._name(job_id), int(self.ttl))
+            pipe.execute()
+        return job
+
+    def get(self, job_id):
+        return self._read(self.client, job_id)
+
+    def update(self, job_id, **fields):
+        if self.client.exists(self._name(job_id)):
+            with self.client.pipeline() as pipe:
+                self._write(pipe, job_id, fields)
+                pipe.execute()
+
+    def claim(self, owner):
+        while True:
+            with self.client.pipeline() as pipe:
+                try:
+                    # Watching the head of the queue and its job makes the pop and the status
+                    # change one transaction, which fails if either changed since they were read.
+                    pipe.watch(self._queue)
+                    job_id = pipe.lindex(self._queue, 0)
+                    if job_id is None:
+                        return None
+                    job_id = self._text(job_id)
+                    pipe.watch(self._name(job_id))
+                    job = self._read(pipe, job_id)
+                    pipe.multi()
+                    pipe.lpop(self._queue)
+                    # Jobs cancelled or expired while queued are only taken off the queue.
+                    if job is not None and job["status"] == "pending":
+                        job.update(status="in_progress", owner=owner,
+                                   timings=dict(job["timings"] or {}, started_at=time.time()))
+                        self._write(pipe, job_id, {name: job[name] for name in ("status", "owner", "timings")})
+                    pipe.execute()
+                except self._watch_error:
+                    continue
+            if job is not None and job["status"] == "in_progress":
+                return job
+
+    def request_cancel(self, job_id):
+        while True:
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(self._name(job_id))
+                    job = self._read(pipe, job_id)
+                    if job is None:
+                        return None
+                    pipe.multi()
+                    if job["status"] == "pending":
+                        job["status"] = "cancelled"
+                        self._write(pipe, job_id, {"status": "cancelled"})
+                    elif job["status"] == "in_progress":
+                        self._write(pipe, job_id, {"cancel_requested": True})
+                    pipe.execute()
+                except self._watch_error:
+                    continue
+            return job["status"]
+
+    def _active_jobs(self):
+        jobs = []
+        for job_id in self.client.smembers(self._active):
+            job = self.get(self._text(job_id))
+            if job is None:
+                self.client.srem(self._active, job_id)
+            else:
+                jobs.append(job)
+        return jobs
+
+    def cancel_requests(self, owner):
+        return [job["id"] for job in self._active_jobs()
+                if job["owner"] == owner and job["status"] == "in_progress" and job["cancel_requested"]]
+
+    def count(self, statuses=ACTIVE):
+        # Finished jobs are not tracked by status; Redis expires them.
+        return sum(job["status"] in statuses for job in self._active_jobs())
+
+    def active_keys(self):
+        return {job["key"] for job in self._active_jobs() if job["status"] in ACTIVE}
+
+    def remove_expired(self, stale=None):
+        now = time.time()
+        for job in self._active_jobs():
+            if job["status"] in FINISHED:
+                self.client.srem(self._active, job["id"])
+            elif stale and job["status"] == "in_progress" and job["updated_at"] < now - stale:
+                self.finish(job["id"], "failed", "The worker running this job stopped.")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Returns the process-wide job store configured by NARRATOR_JOB_STORE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if JOB_STORE.startswith(("redis://", "rediss://", "unix://")):
+                import redis
+                _store = RedisJobStore(redis.Redis.from_url(JOB_STORE))
+            else:
+                _store = SQLiteJobStore()
+        return _store
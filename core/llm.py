@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+LOCAL_LLM_URL = os.environ.get("NARRATOR_LLM_URL", "http://127.0.0.1:1234/v1")
+LOCAL_LLM_MODEL = os.environ.get("NARRATOR_LLM_MODEL", "local-model")
+TEMPERATURE = 0.7
+SYSTEM_PROMPT = ("You are a helpful data analyst who explains insights in a clear, concise, "
+                 "and easy-to-understand business context.")
+# How long a health check result is trusted.
+HEALTH_TTL = float(os.environ.get("NARRATOR_LLM_HEALTH_TTL", 30))
+PROBE_TIMEOUT = 2.0
+REQUEST_TIMEOUT = float(os.environ.get("NARRATOR_LLM_TIMEOUT", 60))
+MAX_CONCURRENCY = int(os.environ.get("NARRATOR_LLM_CONCURRENCY", 4))
+# After this many consecutive failures the endpoint is skipped for COOLDOWN seconds.
+FAILURE_THRESHOLD = 3
+COOLDOWN = float(os.environ.get("NARRATOR_LLM_COOLDOWN", 60))
+
+
+class LLMBackend:
+    """
+    Manages the connection to an OpenAI-compatible local LLM server.
+
+    One client (and so one pooled HTTP connection pool) is shared by all requests. Endpoint
+    health is cached for `health_ttl` seconds, and a circuit breaker stops sending requests for
+    `cooldown` seconds after `failure_threshold` consecutive failures, so a missing server costs
+    one probe rather than a timeout per insight. At most `max_concurrency` requests are in flight
+    at once, however many threads call generate().
+    """
+
+    def __init__(self, base_url=LOCAL_LLM_URL, model=LOCAL_LLM_MODEL, temperature=TEMPERATURE,
+                 health_ttl=HEALTH_TTL, request_timeout=REQUEST_TIMEOUT, max_concurrency=MAX_CONCURRENCY,
+                 failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.base_url = base_url
+        self.model = model
+        self.temperature = temperature
+        self.health_ttl = health_ttl
+        self.request_timeout = request_timeout
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._client = None
+        self._health = None  # (checked_at, available)
+        self._failures = 0
+        self._open_until = 0.0
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                # Retries are handled by falling back to the next backend, not by the client.
+                self._client = OpenAI(base_url=self.base_url, api_key="not-needed",
+                                      timeout=self.request_timeout, max_retries=0)
+            return self._client
+
+    def is_available(self) -> bool:
+        """Returns whether the server answers, probing at most once per `health_ttl` seconds."""
+        # Concurrent callers wait for one probe instead of each sending their own.
+        with self._probe_lock:
+            now = time.monotonic()
+            with self._lock:
+                if now < self._open_until:
+                    return False
+                if self._health and now - self._health[0] < self.health_ttl:
+                    return self._health[1]
+            print(f"Checking for local LLM server at {self.base_url}...")
+            try:
+                self.client.models.list(timeout=PROBE_TIMEOUT)
+                available = True
+                print("...Local LLM server found.")
+            except Exception:
+                available = False
+                print("...Local LLM server not found.")
+            with self._lock:
+                self._health = (time.monotonic(), available)
+            return available
+
+    def _record(self, success):
+        with self._lock:
+            if success:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                print(f"Local LLM failed {self._failures} times in a row; skipping it for {self.cooldown:g}s.")
+                self._open_until = time.monotonic() + self.cooldown
+                self._health = (time.monotonic(), False)
+                self._failures = 0
+
+    def generate(self, prompt: str, deadline=None) -> str | None:
+        """
+        Generates a narrative for one prompt, or returns None on failure. `deadline` is an
+        absolute time.monotonic() value after which the request is not sent or is cut short.
+        """
+        if time.monotonic() < self._open_until:
+            return None
+        timeout = self.request_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                return None
+        try:
+            with self._slots:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=self.temperature,
+                    timeout=timeout,
+                )
+            self._record(True)
+            return response.choices[0].message.content
+        except Exception as e:
+            print(f"Local LLM request failed: {e}")
+            self._record(False)
+            return None
+
+    def generate_many(self, prompts, deadline=None):
+        """
+        Sends several prompts concurrently, at most `max_concurrency` at a time, and returns the
+        narratives in prompt order (None where a request failed or missed the deadline).
+        """
+        if not prompts:
+            return []
+        workers = max(1, min(self.max_concurrency, len(prompts)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm") as pool:
+            return list(pool.map(lambda prompt: self.generate(prompt, deadline), prompts))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> LLMBackend:
+    """Returns the process-wide LLM backend."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LLMBackend()
+        return _backend
@@ -1,70 +1,275 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-from xgboost import XGBClassifier, XGBRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-from sklearn.metrics import accuracy_score, r2_score
+from core import encoding, profiling
 
-def run_predictive_model(df, metadata, target_col):
+# --- Configuration ---
+# Targets fitted at the same time, and the XGBoost threads they share.
+MODEL_WORKERS = int(os.environ.get("NARRATOR_MODEL_WORKERS", 4))
+MODEL_THREADS = int(os.environ.get("NARRATOR_MODEL_THREADS", os.cpu_count() or 1))
+# Wall-clock seconds each target may spend training; 0 removes the limit.
+TIME_BUDGET = float(os.environ.get("NARRATOR_MODEL_TIME_BUDGET", 60))
+# Rows of the first training subsample, doubled every round.
+INITIAL_ROWS = int(os.environ.get("NARRATOR_MODEL_INITIAL_ROWS", 20000))
+MAX_BOOST_ROUNDS = 500
+EARLY_STOPPING_ROUNDS = 20
+# Rows TreeSHAP values are computed on.
+SHAP_ROWS = int(os.environ.get("NARRATOR_SHAP_ROWS", 2000))
+
+
+def _without(matrix, groups, columns):
+    """Returns the design matrix and feature groups without the features of the given original columns."""
+    keep = [i for i, group in enumerate(groups) if group not in columns]
+    if len(keep) == len(groups):
+        return matrix, groups
+    if isinstance(matrix, pd.DataFrame):
+        return matrix.iloc[:, keep], [groups[i] for i in keep]
+    return matrix[:, keep], [groups[i] for i in keep]
+
+
+def _deadline_callback(deadline):
+    """An XGBoost training callback that stops boosting at an absolute time.perf_counter() deadline."""
+    from xgboost.callback import TrainingCallback
+
+    class Deadline(TrainingCallback):
+        def after_iteration(self, model, epoch, evals_log):
+            return time.perf_counter() >= deadline
+
+    return Deadline()
+
+
+def shap_importances(booster, X, groups, rows=SHAP_ROWS, seed=42):
     """
-    Trains an XGBoost model to find key drivers for a user-selected target column.
-    It automatically chooses between Classification and Regression.
-    Handles categorical targets and provides narrative, charts, and insights.
+    Mean absolute TreeSHAP contribution of each original column over at most `rows` rows of X,
+    normalized to sum to 1.
     """
-    if not target_col or target_col not in df.columns:
-        return [{"type": "error", "title": "Invalid Target", "details": "Target column not found in data."}]
+    import xgboost as xgb
+    if X.shape[0] > rows:
+        X = _take(X, np.random.default_rng(seed).choice(X.shape[0], rows, replace=False))
+    contribs = booster.predict(xgb.DMatrix(X, enable_categorical=True), pred_contribs=True,
+                               iteration_range=(0, booster.best_iteration + 1))
+    # The last column is the bias term; multi-class contributions have a class axis in the middle.
+    contribs = np.abs(contribs[..., :-1])
+    if contribs.ndim == 3:
+        contribs = contribs.sum(axis=1)
+    return encoding.aggregate_importances(contribs.mean(axis=0), groups)
 
-    insights = []
-    y = df[target_col]
-    X = df.drop(columns=[target_col])
 
-    # One-hot encode categorical features for better model performance
-    X = pd.get_dummies(X, drop_first=True)
+def _take(X, rows):
+    return X.iloc[rows] if isinstance(X, pd.DataFrame) else X[rows]
 
-    # Handle categorical target columns
-    if y.dtype == 'object' or str(y.dtype).startswith('category'):
-        le = LabelEncoder()
-        y_encoded = le.fit_transform(y)
-        target_is_categorical = True
-    else:
-        y_encoded = y
-        target_is_categorical = False
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42)
+def _leaders(importances, k=5, share=0.9):
+    """The columns that make up `share` of the total importance, at most k, largest first."""
+    cumulative = importances.cumsum()
+    return list(importances.index[:min(k, int((cumulative < share).sum()) + 1)])
+
+
+def _stable(previous, current):
+    """
+    Whether two importance rankings agree on their leading columns and their order. Columns
+    with negligible importance are left out, as their order is noise.
+    """
+    return previous is not None and _leaders(previous) == _leaders(current)
+
+
+def model_type_of(y):
+    """
+    Chooses classification for categorical targets and numeric targets with at most 10 distinct
+    values, regression otherwise. Returns (model_type, n_unique).
+    """
+    target_is_categorical = y.dtype == 'object' or str(y.dtype).startswith('category')
+    n_unique = y.nunique()
+    return ("Classification" if target_is_categorical or n_unique <= 10 else "Regression"), n_unique
+
+
+def evaluate(booster, X, y_encoded, model_type):
+    """Returns the accuracy or R² of a booster on encoded rows."""
+    import xgboost as xgb
+    from sklearn.metrics import accuracy_score, r2_score
+    predictions = booster.predict(xgb.DMatrix(X, enable_categorical=True),
+                                  iteration_range=(0, booster.best_iteration + 1))
+    if model_type == "Classification":
+        labels = predictions.argmax(axis=1) if predictions.ndim == 2 else (predictions > 0.5).astype(int)
+        return {"accuracy": float(accuracy_score(y_encoded, labels))}
+    return {"r2": float(r2_score(y_encoded, predictions))}
+
+
+def importance_insight(target_col, model_type, importances, metrics, training, encoding_name=None):
+    """Builds the feature importance insight of a target from its per-column SHAP importances."""
+    totals = importances.head(5)
+    importances = pd.DataFrame({'feature': totals.index, 'importance': totals.to_numpy()})
+    return {
+        "type": "feature_importance",
+        "title": f"Top 5 Predictors of '{target_col}' ({model_type})",
+        "details": {
+            "target": target_col,
+            "features": importances.to_dict('records'),
+            "importance_method": "shap",
+            "encoding": encoding_name or encoding.ENCODING,
+            "metrics": metrics,
+            "training": training,
+        }
+    }
+
+
+def fit_target(X, groups, y, target_col, n_jobs=None, time_budget=TIME_BUDGET):
+    """
+    Trains an XGBoost model for one target on an encoded design matrix that does not contain it,
+    and returns its insights. `groups` maps each column of X to its original column.
+    See train_target.
+    """
+    return train_target(X, groups, y, target_col, n_jobs, time_budget)[0]
+
+
+def train_target(X, groups, y, target_col, n_jobs=None, time_budget=TIME_BUDGET, encoding_name=None):
+    """
+    Trains an XGBoost model for one target and returns (insights, model), where model holds the
+    booster, its parameters, the model type, the class labels of a classifier and the test
+    metrics, or is None if training failed.
+
+    The rows are split into train, validation and test sets. Models are trained on growing
+    subsamples of the training set (doubling from INITIAL_ROWS), each with early stopping on the
+    validation set, until the top features stop changing, the training set is used up or the
+    next round would not fit in `time_budget` seconds. Importances are TreeSHAP values on a
+    sample of the test set, which also gives the reported accuracy or R².
+    """
+    # xgboost and scikit-learn are slow to import, so they are loaded on first use.
+    import xgboost as xgb
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import LabelEncoder
+
+    started = time.perf_counter()
+    deadline = started + time_budget if time_budget and time_budget > 0 else float('inf')
+    insights = []
+    # Handle categorical target columns
+    target_is_categorical = y.dtype == 'object' or str(y.dtype).startswith('category')
+    y_encoded = y.to_numpy()
+    classes = None
 
     # --- NEW: Automatically choose model type ---
     # If target is binary or categorical with few unique values, classify. Otherwise, regress.
-    n_unique = len(set(y_encoded))
-    if target_is_categorical or n_unique <= 10:
-        model_type = "Classification"
-        model = XGBClassifier(use_label_encoder=False, eval_metric='logloss', random_state=42)
+    model_type, n_unique = model_type_of(y)
+    params = {"tree_method": "hist", "seed": 42, "nthread": n_jobs or 0}
+    if model_type == "Classification":
+        # XGBoost expects the classes as 0..n-1, which a numeric target need not be either.
+        encoder = LabelEncoder()
+        y_encoded = encoder.fit_transform(y.astype(str) if target_is_categorical else y)
+        classes = encoder.classes_.tolist()
+        if n_unique > 2:
+            params.update(objective="multi:softprob", num_class=n_unique, eval_metric="mlogloss")
+        else:
+            params.update(objective="binary:logistic", eval_metric="logloss")
     else:
-        model_type = "Regression"
-        model = XGBRegressor(objective='reg:squarederror', random_state=42)
+        params.update(objective="reg:squarederror", eval_metric="rmse")
     # --- END OF NEW LOGIC ---
 
+    if n_unique < 2:
+        return [{"type": "error", "title": "Model Training Error",
+                 "details": f"Target column '{target_col}' has a single value."}], None
+
+    positions = np.arange(X.shape[0])
     try:
-        model.fit(X_train, y_train)
+        train_idx, test_idx = train_test_split(positions, test_size=0.2, random_state=42)
+        train_idx, valid_idx = train_test_split(train_idx, test_size=0.2, random_state=42)
     except ValueError as e:
-        insights.append({
-            "type": "error",
-            "title": "Model Training Error",
-            "details": str(e)
-        })
+        # Too few rows for a train, validation and test set.
+        return [{"type": "error", "title": "Model Training Error", "details": str(e)}], None
+    dvalid = xgb.DMatrix(_take(X, valid_idx), label=y_encoded[valid_idx], enable_categorical=True)
+
+    booster, importances, stable, rows, rounds = None, None, False, 0, 0
+    size = min(INITIAL_ROWS, len(train_idx))
+    while True:
+        round_started = time.perf_counter()
+        subset = train_idx[:size]
+        try:
+            dtrain = xgb.DMatrix(_take(X, subset), label=y_encoded[subset], enable_categorical=True)
+            candidate = xgb.train(params, dtrain, num_boost_round=MAX_BOOST_ROUNDS, evals=[(dvalid, "valid")],
+                                  early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=False,
+                                  callbacks=[_deadline_callback(deadline)])
+        except (xgb.core.XGBoostError, ValueError) as e:
+            if booster is None:
+                insights.append({
+                    "type": "error",
+                    "title": "Model Training Error",
+                    "details": str(e)
+                })
+                return insights, None
+            print(f"Training on {size} rows failed, keeping the model trained on {rows} rows. Error: {e}")
+            break
+        booster, rows, rounds = candidate, size, rounds + 1
+        previous, importances = importances, shap_importances(candidate, _take(X, valid_idx), groups)
+        stable = _stable(previous, importances)
+        # Doubling the rows roughly doubles the time of the next round.
+        next_round = 2 * (time.perf_counter() - round_started)
+        if stable or size >= len(train_idx) or time.perf_counter() + next_round > deadline:
+            break
+        size = min(2 * size, len(train_idx))
+
+    # Get SHAP importances, summed over each original column's encoded features
+    importances = shap_importances(booster, _take(X, test_idx), groups)
+    metrics = evaluate(booster, _take(X, test_idx), y_encoded[test_idx], model_type)
+    metrics["test_rows"] = int(len(test_idx))
+    training = {
+        "rows": int(rows),
+        "trees": int(booster.best_iteration + 1),
+        "subsample_rounds": rounds,
+        "stable_ranking": stable,
+        "seconds": time.perf_counter() - started,
+    }
+    insights.append(importance_insight(target_col, model_type, importances, metrics, training, encoding_name))
+    model = {"booster": booster, "params": params, "model_type": model_type, "classes": classes, "metrics": metrics}
+    return insights, model
+
+
+def run_predictive_models(df, metadata, target_cols, workers=MODEL_WORKERS, threads=MODEL_THREADS):
+    """
+    Finds the key drivers of several target columns. The features are encoded once; every
+    target is fitted on that design matrix without any of the target columns, so that no target
+    predicts another, up to `workers` targets at a time with `threads` XGBoost threads split between them. Returns the insights of all targets, in order.
+    When the metadata's sampling plan samples this stage, the models are fitted on rows
+    stratified on the first target (see core.profiling).
+    """
+    insights = [{"type": "error", "title": "Invalid Target", "details": f"Target column '{col}' not found in data."}
+                for col in target_cols if not col or col not in df.columns]
+    target_cols = [col for col in target_cols if col and col in df.columns]
+    if not target_cols:
         return insights
 
-    # Get feature importances
-    importances = pd.DataFrame({
-        'feature': X.columns,
-        'importance': model.feature_importances_
-    }).sort_values('importance', ascending=False).head(5)
+    # Categorical features are either split on natively by XGBoost or one-hot encoded into a
+    # sparse matrix, with rare levels capped and identifier columns left out (see core.encoding).
+    sample = profiling.stage_sample(df, metadata, "modeling", target_cols[0])
+    sampling = profiling.sampling_details(sample, df)
+    X, _, groups, dropped = encoding.encode(sample, profile=metadata.get("profile"))
+    X, groups = _without(X, groups, set(target_cols))
+    dropped = [col for col in dropped if col not in target_cols]
 
-    insights.append({
-        "type": "feature_importance",
-        "title": f"Top 5 Predictors of '{target_col}' ({model_type})",
-        "details": {
-            "target": target_col,
-            "features": importances.to_dict('records')
-        }
-    })
-    
-    return insights
\ No newline at end of file
+    def fit(target_col, n_jobs):
+        target_insights = fit_target(X, groups, sample[target_col], target_col, n_jobs)
+        for insight in target_insights:
+            if insight["type"] == "feature_importance":
+                insight["details"]["dropped_columns"] = list(dropped)
+                if sampling:
+                    insight["details"]["sampling"] = sampling
+        return target_insights
+
+    workers = max(1, min(workers, len(target_cols)))
+    n_jobs = max(1, threads // workers)
+    if workers == 1:
+        results = [fit(target_col, n_jobs) for target_col in target_cols]
+    else:
+        # XGBoost releases the GIL while training, so threads fit the targets in parallel.
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model") as pool:
+            results = list(pool.map(lambda target_col: fit(target_col, n_jobs), target_cols))
+    return insights + [insight for target_insights in results for insight in target_insights]
+
+
+def run_predictive_model(df, metadata, target_col):
+    """
+    Trains an XGBoost model to find key drivers for a user-selected target column.
+    It automatically chooses between Classification and Regression.
+    Handles categorical targets and provides narrative, charts, and insights.
+    """
+    return run_predictive_models(df, metadata, [target_col])
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# --- Configuration ---
+CACHE_PATH = os.environ.get("NARRATOR_NARRATIVE_CACHE_PATH", os.path.join('output', 'cache', 'narratives.sqlite'))
+# 'off' disables the cache: every narrative is generated again and nothing is stored.
+ENABLED = os.environ.get("NARRATOR_NARRATIVE_CACHE", "on").lower() != "off"
+MAX_ENTRIES = int(os.environ.get("NARRATOR_NARRATIVE_CACHE_ENTRIES", 10000))
+MAX_AGE = float(os.environ.get("NARRATOR_NARRATIVE_CACHE_MAX_AGE", 30 * 24 * 3600))
+# Eviction runs after this many writes rather than after every one.
+EVICT_EVERY = 64
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses runs of whitespace, so prompts that differ only in layout share an entry."""
+    return " ".join(prompt.split())
+
+
+def narrative_key(prompt, backend, model, temperature) -> str:
+    """Builds the cache key of a narrative from its prompt and the generator that produced it."""
+    key = hashlib.sha256()
+    for part in (normalize_prompt(prompt), backend, model, temperature):
+        key.update(str(part).encode('utf-8'))
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+class NarrativeCache:
+    """
+    A persistent cache of generated narratives in a SQLite file.
+
+    Entries older than `max_age` seconds are ignored and removed, and the least recently used
+    entries are removed beyond `max_entries`. The database is opened in WAL mode, so the API's
+    job processes can share one file.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS narratives ("
+                         "key TEXT PRIMARY KEY, narrative TEXT NOT NULL, "
+                         "created_at REAL NOT NULL, used_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS narratives_used_at ON narratives (used_at)")
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys):
+        """Returns {key: narrative} for the keys that have a fresh entry, and marks them as used."""
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        try:
+            with self._lock:
+                conn = self._connect()
+                placeholders = ",".join("?" * len(keys))
+                rows = conn.execute(f"SELECT key, narrative FROM narratives WHERE key IN ({placeholders}) "
+                                    f"AND created_at >= ?", [*keys, now - self.max_age]).fetchall()
+                found = dict(rows)
+                if found:
+                    with conn:
+                        conn.executemany("UPDATE narratives SET used_at = ? WHERE key = ?",
+                                         [(now, key) for key in found])
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read the narrative cache. Error: {e}")
+        return found
+
+    def set_many(self, items):
+        """Stores {key: narrative} pairs."""
+        if not items:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO narratives (key, narrative, created_at, used_at) "
+                                     "VALUES (?, ?, ?, ?)", [(key, text, now, now) for key, text in items.items()])
+                self._writes += len(items)
+                if self._writes >= EVICT_EVERY:
+                    self._writes = 0
+                    self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write to the narrative cache. Error: {e}")
+
+    def _evict(self, conn, now):
+        with conn:
+            conn.execute("DELETE FROM narratives WHERE created_at < ?", (now - self.max_age,))
+            conn.execute("DELETE FROM narratives WHERE key NOT IN "
+                         "(SELECT key FROM narratives ORDER BY used_at DESC LIMIT ?)", (self.max_entries,))
+
+    def record(self, hits, misses):
+        """Counts narratives served from the cache and narratives that had to be generated."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        """Returns hits, misses and hit rate since the cache was opened."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Returns the process-wide narrative cache, or None if NARRATOR_NARRATIVE_CACHE is 'off'."""
+    global _cache
+    if not ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = NarrativeCache()
+        return _cache
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# --- Configuration ---
+MODEL_NAME = os.environ.get("NARRATOR_MODEL", "distilgpt2")
+# The prompts are ~40 tokens, so this matches the former max_length=120 per prompt. A total
+# length would be measured on the left-padded batch and penalize short prompts.
+MAX_NEW_TOKENS = 80
+MAX_BATCH_SIZE = int(os.environ.get("NARRATOR_MAX_BATCH_SIZE", 8))
+# How long the first prompt of a batch waits for more prompts to arrive.
+BATCH_WAIT = float(os.environ.get("NARRATOR_BATCH_WAIT", 0.05))
+# 'inprocess' loads the model in this process; 'socket' talks to a narrator server
+# started with `python -m core.narrator --serve`, which batches prompts across jobs.
+BACKEND = os.environ.get("NARRATOR_BACKEND", "inprocess")
+SOCKET_HOST = os.environ.get("NARRATOR_SOCKET_HOST", "127.0.0.1")
+SOCKET_PORT = int(os.environ.get("NARRATOR_SOCKET_PORT", 6010))
+# Shared secret clients must prove they know before the server reads their messages; unset, any
+# client that reaches the port may use the model. Messages are JSON, never pickles.
+SOCKET_AUTHKEY = os.environ.get("NARRATOR_SOCKET_AUTHKEY", "").encode('utf-8') or None
+# Largest message either side accepts.
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+class BatchingNarrator:
+    """
+    A long-lived text generator that batches prompts.
+
+    Callers submit prompts from any thread; a background thread collects them into padded
+    batches of up to `max_batch_size`, waiting at most `batch_wait` seconds after the first
+    prompt for more to arrive, and runs one generation call per batch. The model is loaded
+    on first use, or ahead of time with warm_up().
+    """
+
+    def __init__(self, model_name=MODEL_NAME, max_batch_size=MAX_BATCH_SIZE, batch_wait=BATCH_WAIT):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._worker = None
+        self._pipe = None
+        self._load_error = None
+        self._stats = {"requests": 0, "batches": 0, "tokens": 0, "generation_s": 0.0,
+                       "queue_s": 0.0, "max_queue_s": 0.0}
+
+    def warm_up(self):
+        """Loads the model now instead of on the first request. Returns True if it is usable."""
+        with self._load_lock:
+            self._load()
+        return self._pipe is not None
+
+    def _load(self):
+        if self._pipe is not None or self._load_error is not None:
+            return
+        try:
+            import torch
+            from transformers.pipelines import pipeline
+            # --- Check for GPU and set the device ---
+            if torch.cuda.is_available():
+                device = 0  # 0 is the ID of the first GPU
+                print("GPU found! Setting device to 'cuda:0'.")
+            else:
+                device = -1 # -1 tells the pipeline to use the CPU
+                print("No GPU found. Setting device to 'cpu'.")
+
+            print(f"Initializing the fallback NLG model ({self.model_name})...")
+            pipe = pipeline("text-generation", model=self.model_name, device=device)
+            # Decoder-only models must be padded on the left to generate a batch of prompts.
+            pipe.tokenizer.pad_token_id = pipe.model.config.eos_token_id
+            pipe.tokenizer.padding_side = 'left'
+            self._pipe = pipe
+            print("Fallback NLG model initialized successfully.")
+        except Exception as e:
+            print(f"CRITICAL WARNING: Could not load the fallback Hugging Face model. Error: {e}")
+            self._load_error = e
+
+    def submit(self, prompt: str) -> Future:
+        """Queues one prompt and returns a Future resolving to the generated continuation or None."""
+        future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="narrator-batcher", daemon=True)
+                self._worker.start()
+        self._queue.put((prompt, time.perf_counter(), future))
+        return future
+
+    def generate(self, prompts):
+        """Generates continuations for several prompts; None where generation failed."""
+        futures = [self.submit(prompt) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def metrics(self):
+        """Returns throughput and queueing statistics since the narrator started."""
+        with self._lock:
+            stats = dict(self._stats)
+        requests, batches = stats.pop("requests"), stats.pop("batches")
+        return {
+            "backend": "inprocess",
+            "model": self.model_name,
+            "requests": requests,
+            "batches": batches,
+            "avg_batch_size": requests / batches if batches else 0.0,
+            "tokens_per_sec": stats["tokens"] / stats["generation_s"] if stats["generation_s"] else 0.0,
+            "avg_queue_ms": 1000 * stats["queue_s"] / requests if requests else 0.0,
+            "max_queue_ms": 1000 * stats["max_queue_s"],
+        }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    # Past the deadline, only prompts that are already queued join the batch.
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._generate_batch(batch)
+
+    def _generate_batch(self, batch):
+        with self._load_lock:
+            self._load()
+        started = time.perf_counter()
+        prompts = [prompt for prompt, _, _ in batch]
+        results, tokens = [None] * len(batch), 0
+        if self._pipe is not None:
+            try:
+                outputs = self._pipe(prompts, max_new_tokens=MAX_NEW_TOKENS, num_return_sequences=1,
+                                     batch_size=len(prompts), pad_token_id=self._pipe.model.config.eos_token_id)
+                for i, (prompt, output) in enumerate(zip(prompts, outputs)):
+                    # With a list of prompts the pipeline returns one list of sequences per prompt.
+                    sequence = output[0] if isinstance(output, list) else output
+                    text = sequence.get('generated_text', '').replace(prompt, "").strip()
+                    results[i] = text
+                    tokens += len(self._pipe.tokenizer.encode(text)) if text else 0
+            except Exception as e:
+                print(f"Fallback model failed: {e}")
+        finished = time.perf_counter()
+
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["tokens"] += tokens
+            self._stats["generation_s"] += finished - started
+            for _, queued_at, _ in batch:
+                self._stats["queue_s"] += started - queued_at
+                self._stats["max_queue_s"] = max(self._stats["max_queue_s"], started - queued_at)
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class SocketNarrator:
+    """
+    Client for a narrator server on a local socket. The server batches prompts from all its
+    clients, so concurrent jobs share batches and one loaded model.
+    """
+
+    def __init__(self, address=(SOCKET_HOST, SOCKET_PORT), authkey=SOCKET_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+
+    def _call(self, message):
+        with Client(self.address, authkey=self.authkey) as conn:
+            _send(conn, message)
+            reply = _receive(conn)
+        if "error" in reply:
+            raise RuntimeError(f"Narrator server error: {reply['error']}")
+        return reply["result"]
+
+    def warm_up(self):
+        return self._call({"op": "warm_up"})
+
+    def generate(self, prompts):
+        return self._call({"op": "generate", "prompts": list(prompts)})
+
+    def metrics(self):
+        return dict(self._call({"op": "metrics"}), backend="socket")
+
+
+def _send(conn, message):
+    conn.send_bytes(json.dumps(message).encode('utf-8'))
+
+
+def _receive(conn):
+    # Raw bytes parsed as JSON: Connection.recv() would unpickle, and so run, whatever it is sent.
+    return json.loads(conn.recv_bytes(MAX_MESSAGE_BYTES).decode('utf-8'))
+
+
+def serve(address=(SOCKET_HOST, SOCKET_PORT), authkey=SOCKET_AUTHKEY, narrator=None):
+    """
+    Runs a narrator server: every connection is handled in its own thread, and all of them feed
+    the same BatchingNarrator. Each connection carries one JSON request and its JSON reply.
+    """
+    narrator = narrator or BatchingNarrator()
+    narrator.warm_up()
+
+    def handle(conn):
+        with conn:
+            try:
+                message = _receive(conn)
+                op = message.get("op") if isinstance(message, dict) else None
+                if op == "generate":
+                    prompts = message.get("prompts")
+                    if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+                        raise ValueError("'prompts' must be a list of strings.")
+                    _send(conn, {"result": narrator.generate(prompts)})
+                elif op == "warm_up":
+                    _send(conn, {"result": narrator.warm_up()})
+                elif op == "metrics":
+                    _send(conn, {"result": narrator.metrics()})
+                else:
+                    raise ValueError(f"Unknown request: {op!r}")
+            except (EOFError, OSError) as e:
+                print(f"Narrator server: connection error: {e}")
+            except ValueError as e:
+                # Also raised by malformed JSON and undecodable bytes.
+                _send(conn, {"error": str(e)})
+
+    with Listener(address, authkey=authkey) as listener:
+        print(f"Narrator server listening on {address[0]}:{address[1]}")
+        if authkey is None:
+            print("Warning: NARRATOR_SOCKET_AUTHKEY is not set; any client that reaches the port can use the model.")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Narrator server: rejected a connection: {e}")
+                continue
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+_narrator = None
+_narrator_lock = threading.Lock()
+
+def get_narrator():
+    """
+    Returns the process-wide narrator for the configured backend. If the socket backend is
+    selected but no server answers, the model is loaded in this process instead.
+    """
+    global _narrator
+    with _narrator_lock:
+        if _narrator is None:
+            if BACKEND == "socket":
+                client = SocketNarrator()
+                try:
+                    client.metrics()
+                    _narrator = client
+                except (ConnectionError, OSError, AuthenticationError) as e:
+                    print(f"Narrator server not reachable ({e}). Loading the model in this process.")
+            if _narrator is None:
+                _narrator = BatchingNarrator()
+        return _narrator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NarratorAI narrator model server")
+    parser.add_argument("--serve", action="store_true", help="Run the narrator server.")
+    parser.add_argument("--host", default=SOCKET_HOST)
+    parser.add_argument("--port", type=int, default=SOCKET_PORT)
+    args = parser.parse_args()
+    if args.serve:
+        serve((args.host, args.port))
+    else:
+        parser.print_help()
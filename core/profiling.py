@@ -0,0 +1,207 @@
+import os
+import numpy as np
+import pandas as pd
+from core import encoding, visualization
+
+# --- Configuration ---
+# Seconds a pipeline run should take. On inputs above EXACT_ROWS rows, the analysis, modeling
+# and plotting stages work on stratified samples sized to fit in what ingestion, cleaning and
+# profiling left of it; 0 removes the limit.
+TIME_BUDGET = float(os.environ.get("NARRATOR_TIME_BUDGET", 300))
+# Inputs with at most this many rows are analyzed exactly, and their distinct counts are exact;
+# above it, distinct counts are HyperLogLog estimates.
+EXACT_ROWS = int(os.environ.get("NARRATOR_EXACT_ROWS", 1_000_000))
+# Samples never shrink below this many rows, whatever the budget.
+MIN_SAMPLE_ROWS = int(os.environ.get("NARRATOR_MIN_SAMPLE_ROWS", 200_000))
+# Each sampled stage's share of the remaining budget and its rough throughput in cells
+# (rows x columns) per second, as measured with benchmarks/bench_pipeline.py.
+STAGE_COSTS = {"analysis": (0.3, 1e7), "modeling": (0.4, 6e6), "plotting": (0.3, 4e6)}
+# 2**12 registers: a standard error of about 1.6%, in 4 KB per column.
+HLL_PRECISION = 12
+# Quantile bins a numeric column is stratified on, and most levels a column is stratified on directly.
+STRATA = 10
+# Values of an object column tried as ISO 8601 dates.
+DATE_PROBE_VALUES = 100
+SAMPLE_SEED = 42
+
+
+class HyperLogLog:
+    """
+    Mergeable estimate of the number of distinct values of a stream (Flajolet et al., 2007),
+    with linear counting for small counts. Values are hashed with pandas' 64-bit hash, so equal
+    values of a category and an object column hash the same.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: pd.Series):
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()[values.notna().to_numpy()]
+        if not len(hashes):
+            return self
+        p = np.uint64(self.precision)
+        buckets = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        rest = hashes << p
+        # The rank is the position of the first set bit of the remaining 64 - p bits.
+        _, exponent = np.frexp(rest.astype(np.float64))
+        width = 66 - self.precision
+        ranks = np.where(rest == 0, width - 1, 65 - exponent)
+        # Highest rank per bucket from a bincount of (bucket, rank) pairs, much faster than np.maximum.at.
+        seen = np.bincount(buckets * width + ranks, minlength=len(self.registers) * width).reshape(-1, width) > 0
+        highest = np.where(seen.any(axis=1), width - 1 - np.argmax(seen[:, ::-1], axis=1), 0)
+        np.maximum(self.registers, highest.astype(np.uint8), out=self.registers)
+        return self
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * np.log(m / zeros)
+        return raw
+
+
+def distinct_counts(frame: pd.DataFrame, exact_rows=EXACT_ROWS):
+    """
+    Number of distinct non-null values of each column: exact for category columns (the levels
+    that occur) and for frames of at most `exact_rows` rows, HyperLogLog estimates otherwise.
+    Returns (counts, exact) with counts a Series of ints and exact a Series of bools.
+    """
+    counts, exact = {}, {}
+    for col in frame.columns:
+        values = frame[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            counts[col] = int(np.count_nonzero(np.bincount(codes[codes >= 0], minlength=1)))
+            exact[col] = True
+        elif len(values) <= exact_rows:
+            counts[col], exact[col] = int(values.nunique()), True
+        else:
+            counts[col], exact[col] = int(round(HyperLogLog().update(values).estimate())), False
+    return pd.Series(counts, dtype='int64'), pd.Series(exact, dtype=bool)
+
+
+def _looks_like_dates(values: pd.Series):
+    probe = values.dropna().unique()[:DATE_PROBE_VALUES]
+    if not len(probe) or not all(isinstance(value, str) for value in probe):
+        return False
+    return bool(pd.to_datetime(pd.Series(probe), format='ISO8601', errors='coerce').notna().all())
+
+
+def _infer_type(values: pd.Series, distinct, non_null, numeric):
+    if distinct <= 1:
+        return "constant"
+    if numeric:
+        if distinct == 2:
+            return "binary"
+        return "integer" if pd.api.types.is_integer_dtype(values) else "continuous"
+    # The same rule as encoding.split_columns, so that a profiled identifier is left out of the models.
+    if distinct > encoding.MAX_CATEGORIES and distinct > encoding.IDENTIFIER_RATIO * non_null:
+        return "identifier"
+    return "datetime" if _looks_like_dates(values) else "categorical"
+
+
+def profile(df: pd.DataFrame, metadata: dict):
+    """
+    Profiles the cleaned frame once for all later stages: per column, the number of distinct
+    values (see distinct_counts), the fraction of values that were missing before imputation
+    (from the cleaning metadata), the min and max of numeric columns and an inferred type:
+    constant, binary, integer, continuous, categorical, identifier (a distinct value on almost
+    every row) or datetime (ISO 8601 strings).
+    Returns {"rows": n, "columns": {col: {...}}}.
+    """
+    numeric_cols = [col for col in metadata["numeric_cols"] if col in df.columns]
+    distinct, exact = distinct_counts(df)
+    non_null = df.count()
+    rows = metadata.get("rows") or len(df)
+    null_counts = metadata.get("null_counts", {})
+    minimum, maximum = (df[numeric_cols].min(), df[numeric_cols].max()) if numeric_cols else ({}, {})
+    columns = {}
+    for col in df.columns:
+        numeric = col in numeric_cols
+        info = {
+            "type": _infer_type(df[col], distinct[col], non_null[col], numeric),
+            "distinct": int(distinct[col]),
+            "distinct_exact": bool(exact[col]),
+            "null_fraction": null_counts.get(col, 0) / rows if rows else 0.0,
+        }
+        if numeric:
+            info["min"], info["max"] = float(minimum[col]), float(maximum[col])
+        columns[col] = info
+    return {"rows": len(df), "columns": columns}
+
+
+def distinct_count(df: pd.DataFrame, metadata: dict, col):
+    """The profiled number of distinct values of a column, or its exact count if it was not profiled."""
+    info = metadata.get("profile", {}).get("columns", {}).get(col)
+    return info["distinct"] if info else df[col].nunique()
+
+
+def sampling_plan(rows, cols, budget=TIME_BUDGET, spent=0.0):
+    """
+    Chooses the rows each of the analysis, modeling and plotting stages works on, given that
+    `spent` seconds of `budget` are gone. Inputs of at most EXACT_ROWS rows, or without a budget,
+    are used whole; larger ones are stratified-sampled down to the rows a stage can process in
+    its share of the remaining seconds (see STAGE_COSTS), but never below MIN_SAMPLE_ROWS.
+    Returns {stage: {"method": "exact" or "stratified", "rows": n}}.
+    """
+    plan = {}
+    remaining = max(0.0, budget - spent) if budget else 0.0
+    for stage, (share, cells_per_second) in STAGE_COSTS.items():
+        limit = max(MIN_SAMPLE_ROWS, int(share * remaining * cells_per_second / max(cols, 1)))
+        if rows <= EXACT_ROWS or not budget or budget <= 0 or rows <= limit:
+            plan[stage] = {"method": "exact", "rows": int(rows)}
+        else:
+            plan[stage] = {"method": "stratified", "rows": limit}
+    return plan
+
+
+def _strata(values: pd.Series, distinct):
+    """Integer stratum codes: the levels of a column with few of them, quantile bins of a numeric one."""
+    if distinct <= STRATA or not pd.api.types.is_numeric_dtype(values):
+        return pd.factorize(values)[0]
+    edges = np.unique(np.nanquantile(values.to_numpy(dtype=np.float64), np.linspace(0, 1, STRATA + 1)[1:-1]))
+    return np.searchsorted(edges, values.to_numpy(dtype=np.float64), side='right')
+
+
+def stage_sample(df: pd.DataFrame, metadata: dict, stage, strata_col=None):
+    """
+    Returns the rows of `df` that `stage` works on under the metadata's sampling plan: all of
+    them, or a sample stratified on `strata_col` so that each of its levels (or quantile bins)
+    keeps its share of rows and rare levels are not lost.
+    """
+    plan = metadata.get("sampling", {}).get(stage)
+    if not plan or plan["method"] == "exact" or len(df) <= plan["rows"]:
+        return df
+    if strata_col is not None and strata_col in df.columns:
+        strata = _strata(df[strata_col], distinct_count(df, metadata, strata_col))
+    else:
+        strata = np.zeros(len(df), dtype=np.int64)
+    return df.iloc[visualization.stratified_sample(strata, plan["rows"], seed=SAMPLE_SEED)]
+
+
+def sampling_details(sample: pd.DataFrame, df: pd.DataFrame):
+    """The sampling record of an insight computed on `sample` rather than all of `df`, or None."""
+    if len(sample) == len(df):
+        return None
+    return {"method": "stratified", "rows": len(sample), "population_rows": len(df)}
+
+
+def correlation_interval(corr, n, method="pearson", level=0.95):
+    """
+    Confidence interval of a correlation coefficient estimated from `n` rows, via the Fisher
+    z-transform with the standard errors of Fieller et al. (1957) for Spearman and Kendall.
+    """
+    from scipy.stats import norm
+    if n <= 4 or not np.isfinite(corr):
+        return None
+    se = {"spearman": np.sqrt(1.06 / (n - 3)), "kendall": np.sqrt(0.437 / (n - 4))}.get(method, 1 / np.sqrt(n - 3))
+    z = np.arctanh(np.clip(corr, -0.999999, 0.999999))
+    half = norm.ppf(0.5 + level / 2) * se
+    return [float(np.tanh(z - half)), float(np.tanh(z + half))]
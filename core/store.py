@@ -0,0 +1,100 @@
+import hashlib
+import os
+import shutil
+import time
+
+# --- Configuration ---
+STORE_DIR = os.environ.get("NARRATOR_STORE_DIR", os.path.join('output', 'reports'))
+MAX_STORE_BYTES = int(os.environ.get("NARRATOR_STORE_MAX_BYTES", 2 * 1024 ** 3))
+MAX_REPORT_AGE = float(os.environ.get("NARRATOR_STORE_MAX_AGE", 7 * 24 * 3600))
+
+# A report and its figures in one file, see core.bundle.
+REPORT_FILENAME = 'report.bundle'
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path):
+    """Returns the SHA-256 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def report_key(content_digest, target_cols, pipeline_version):
+    """
+    Builds the content address of a report from the input file's digest, the target column(s) and
+    the pipeline version, so that changing any of them yields a different report directory.
+    Several targets are keyed regardless of their order.
+    """
+    if not isinstance(target_cols, str):
+        target_cols = "\x1f".join(sorted(target_cols))
+    key = hashlib.sha256()
+    for part in (content_digest, target_cols, pipeline_version):
+        key.update(str(part).encode('utf-8'))
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+def report_dir(key, store_dir=STORE_DIR):
+    """Returns the output directory of the report with the given key."""
+    return os.path.join(store_dir, key)
+
+
+def lookup(key, store_dir=STORE_DIR):
+    """
+    Returns the path of a finished report for `key`, or None. A hit refreshes the entry's
+    modification time so that eviction treats it as recently used.
+    """
+    report_path = os.path.join(report_dir(key, store_dir), REPORT_FILENAME)
+    if not os.path.exists(report_path):
+        return None
+    now = time.time()
+    os.utime(report_dir(key, store_dir), (now, now))
+    return report_path
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict(store_dir=STORE_DIR, max_bytes=MAX_STORE_BYTES, max_age=MAX_REPORT_AGE, protect=()):
+    """
+    Keeps the report store bounded. Entries older than `max_age` seconds are removed first, then
+    the least recently used finished reports until the store fits in `max_bytes`. Directories
+    listed in `protect` (e.g. jobs still writing) and unfinished entries younger than `max_age`
+    are never removed. Returns the list of evicted keys.
+    """
+    if not os.path.isdir(store_dir):
+        return []
+
+    now = time.time()
+    entries = []
+    for key in os.listdir(store_dir):
+        path = os.path.join(store_dir, key)
+        if not os.path.isdir(path) or key in protect:
+            continue
+        finished = os.path.exists(os.path.join(path, REPORT_FILENAME))
+        entries.append((os.path.getmtime(path), key, path, _dir_size(path), finished))
+
+    evicted = []
+    total = sum(entry[3] for entry in entries)
+    for mtime, key, path, size, finished in sorted(entries):
+        expired = now - mtime > max_age
+        if not expired and (total <= max_bytes or not finished):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        evicted.append(key)
+
+    if evicted:
+        print(f"Report store: evicted {len(evicted)} report(s), {total / 1024 ** 2:.1f} MB in use.")
+    return evicted
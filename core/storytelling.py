@@ -1,71 +1,27 @@
 # <<< --- STEP 1: THE "CANARY" --- >>>
 print("\n\n--- LOADING LATEST storytelling.py with OpenAI v1.x client ---\n\n")
 
-import os
 import pandas as pd
-import plotly.express as px
-from transformers.pipelines import pipeline
-import requests
-from openai import OpenAI, APIConnectionError
-import torch
+from core import llm, narrative_cache, narrator, visualization
 
 # --- Configuration ---
-LOCAL_LLM_URL = "http://127.0.0.1:1234/v1"
-
-# --- Global Model Initialization ---
-try:
-    # --- NEW: Check for GPU and set the device ---
-    if torch.cuda.is_available():
-        device = 0  # 0 is the ID of the first GPU
-        print("GPU found! Setting device to 'cuda:0'.")
-    else:
-        device = -1 # -1 tells the pipeline to use the CPU
-        print("No GPU found. Setting device to 'cpu'.")
-
-    print("Initializing the fallback NLG model (distilgpt2)...")
-    # --- NEW: Pass the device to the pipeline ---
-    narrator = pipeline("text-generation", model="distilgpt2", device=device)
-    print("Fallback NLG model initialized successfully.")
-except Exception as e:
-    print(f"CRITICAL WARNING: Could not load the fallback Hugging Face model. Error: {e}")
-    narrator = None
+LOCAL_LLM_URL = llm.LOCAL_LLM_URL
+
+# The local LLM server is reached through core.llm, which pools the client and caches the
+# server's health. The fallback Hugging Face model (distilgpt2) is served by core.narrator,
+# which loads it on first use and batches prompts. Figures are rendered by core.visualization,
+# which imports plotly on first use.
 
 
 def is_local_llm_available():
-    print(f"Checking for local LLM server at {LOCAL_LLM_URL}...")
-    try:
-        response = requests.get(f"{LOCAL_LLM_URL}/models", timeout=2)
-        if response.status_code == 200:
-            print("...Local LLM server found.")
-            return True
-        return False
-    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-        print("...Local LLM server not found.")
-        return False
+    return llm.get_backend().is_available()
 
 def generate_narrative_local_llm(prompt: str) -> str | None:
-    try:
-        client = OpenAI(base_url=LOCAL_LLM_URL, api_key="not-needed")
-        response = client.chat.completions.create(
-            model="local-model",
-            messages=[
-                {"role": "system", "content": "You are a helpful data analyst who explains insights in a clear, concise, and easy-to-understand business context."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content
-    except APIConnectionError as e:
-        print(f"Local LLM connection error: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred with the local LLM: {e}")
-        return None
-
-def generate_narrative_from_insight(insight: dict) -> str:
+    return llm.get_backend().generate(prompt)
+
+def build_prompt(insight: dict) -> str:
     details = insight['details']
     prompt = ""
-    # (The prompt creation logic is unchanged)
     if insight['type'] == 'correlation':
         corr_type = "positive" if details['correlation'] > 0 else "negative"
         prompt = (f"In a business report, briefly explain the implication of a strong {corr_type} "
@@ -80,58 +36,87 @@ def generate_narrative_from_insight(insight: dict) -> str:
         prompt = (f"A predictive model shows that '{top_feature}' is the most important factor "
                   f"in predicting '{details['target']}'. Briefly describe a possible business "
                   f"reason for this.")
-    if not prompt:
-        return "Could not generate a valid prompt for this insight."
-
-    if is_local_llm_available():
-        local_response = generate_narrative_local_llm(prompt)
-        if local_response:
-            print("Success! Using response from local LLM.")
-            return local_response
-        else:
-            print("Local LLM was found but failed to generate a response. Falling back...")
-
-    if narrator:
-        print("Using fallback Hugging Face model (distilgpt2).")
+    return prompt
+
+def fallback_narrative(insight: dict) -> str:
+    return (f"A key insight of type '{insight['type']}' was found. This indicates a "
+            f"significant pattern in your data that warrants further investigation.")
+
+def generate_narratives(insights: list, use_cache: bool = True, deadline=None, sources=None) -> list:
+    """
+    Generates the narratives for several insights. Prompts go to the local LLM server, several at
+    a time, when it is available; the rest are sent together to the fallback model, which
+    generates them in batches. Narratives are looked up in the narrative cache before each
+    backend is asked, unless `use_cache` is False or the cache is disabled. LLM requests are not
+    sent, or are cut short, after `deadline` (a time.monotonic() value).
+    With a `sources` dict, the number of narratives that came from the cache, the local LLM,
+    the fallback model or the default text is added to it under 'cache', 'llm', 'narrator' and
+    'default', and the caller logs the backends used instead of this function.
+    """
+    log = sources is None
+    prompts = [build_prompt(insight) for insight in insights]
+    narratives = [None if prompt else "Could not generate a valid prompt for this insight." for prompt in prompts]
+    origins = [None if prompt else "default" for prompt in prompts]
+    cache = narrative_cache.get_cache() if use_cache else None
+    backend = llm.get_backend()
+    generated = 0
+
+    def from_cache(name, model, temperature):
+        # Fills pending narratives from the cache and returns the pending indices with their keys.
+        pending = [i for i, narrative in enumerate(narratives) if narrative is None]
+        keys = {i: narrative_cache.narrative_key(prompts[i], name, model, temperature) for i in pending}
+        if cache is not None and keys:
+            found = cache.get_many(list(keys.values()))
+            for i, key in keys.items():
+                narratives[i] = found.get(key)
+                origins[i] = "cache" if narratives[i] else None
+        return {i: key for i, key in keys.items() if narratives[i] is None}
+
+    def store(keys):
+        if cache is not None:
+            cache.set_many({key: narratives[i] for i, key in keys.items() if narratives[i]})
+
+    pending = from_cache("llm", backend.model, backend.temperature)
+    if pending and is_local_llm_available():
+        texts = backend.generate_many([prompts[i] for i in pending], deadline)
+        for i, text in zip(pending, texts):
+            narratives[i] = text
+            origins[i] = "llm" if text else None
+        generated += sum(map(bool, texts))
+        store(pending)
+        if log and any(narratives[i] is None for i in pending):
+            print("Local LLM was found but failed to generate some responses. Falling back...")
+        elif log:
+            print("Success! Using responses from local LLM.")
+
+    pending = from_cache("narrator", narrator.MODEL_NAME, None)
+    if pending:
+        if log:
+            print(f"Using fallback Hugging Face model for {len(pending)} insight(s).")
         try:
-            raw_output = narrator(prompt, max_length=120, num_return_sequences=1, pad_token_id=narrator.model.config.eos_token_id)
-            if isinstance(raw_output, list) and raw_output:
-                if isinstance(raw_output[0], dict):
-                    text = raw_output[0].get('generated_text', '').replace(prompt, "").strip()
-                    if text and len(text.split()) > 5:
-                        return text
+            texts = narrator.get_narrator().generate([prompts[i] for i in pending])
         except Exception as e:
             print(f"Fallback model failed: {e}")
-    
-    return (f"A key insight of type '{insight['type']}' was found. This indicates a "
-            f"significant pattern in your data that warrants further investigation.")
+            texts = [None] * len(pending)
+        for i, text in zip(pending, texts):
+            if text and len(text.split()) > 5:
+                narratives[i], origins[i] = text, "narrator"
+                generated += 1
+        store(pending)
+
+    if cache is not None:
+        # A prompt counts as a hit if it was answered without generating anything.
+        failed = sum(narrative is None for narrative in narratives)
+        cache.record(sum(map(bool, prompts)) - generated - failed, generated + failed)
+    if sources is not None:
+        for origin in origins:
+            origin = origin or "default"
+            sources[origin] = sources.get(origin, 0) + 1
+    return [narrative or fallback_narrative(insight) for insight, narrative in zip(insights, narratives)]
+
+def generate_narrative_from_insight(insight: dict, deadline=None, sources=None) -> str:
+    return generate_narratives([insight], deadline=deadline, sources=sources)[0]
 
-# Visualization function is unchanged
-def create_visualization(insight: dict, df: pd.DataFrame, output_dir: str) -> str | None:
-    fig = None
-    details = insight.get('details', {})
-    # Only proceed if details is a dict
-    if not isinstance(details, dict):
-        print(f"Skipping visualization for insight '{insight.get('title', '')}' because details is not a dict.")
-        return None
-
-    feature_name = details.get('feature1', details.get('numeric_feature', 'feature_importance'))
-    filename = f"{insight['type']}_{feature_name}.html"
-    filepath = os.path.join(output_dir, filename)
-    try:
-        if insight['type'] == 'correlation':
-            if details['feature1'] in df.columns and details['feature2'] in df.columns:
-                fig = px.scatter(df, x=details['feature1'], y=details['feature2'], trendline="ols", title=insight['title'])
-        elif insight['type'] == 'significant_difference':
-            if details['numeric_feature'] in df.columns and details['categorical_feature'] in df.columns:
-                fig = px.box(df, x=details['categorical_feature'], y=details['numeric_feature'], title=insight['title'], color=details['categorical_feature'])
-        elif insight['type'] == 'feature_importance':
-            features_df = pd.DataFrame(details['features'])
-            fig = px.bar(features_df, x='importance', y='feature', orientation='h', title=insight['title'])
-            fig.update_yaxes(categoryorder="total ascending")
-        if fig:
-            fig.write_html(filepath, full_html=False, include_plotlyjs='cdn')
-            return filepath
-    except Exception as e:
-        print(f"Warning: Could not generate visualization for insight '{insight['title']}'. Error: {e}")
-    return None
\ No newline at end of file
+def create_figure(insight: dict, df: pd.DataFrame, fingerprint: str | None = None) -> str | None:
+    """Returns an insight's figure as plotly JSON, see core.visualization."""
+    return visualization.create_figure(insight, df, fingerprint)
@@ -1,47 +1,216 @@
 
+import importlib
 import os
 import json
-from core import cleaning, analysis, modeling, storytelling
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core import cache, cleaning, analysis, modeling, narrative_cache, narrator, profiling, storytelling, visualization
 
-def run_cleaning_task(data):
+# Libraries the stages import on first use. warm_up() imports them ahead of time.
+HEAVY_MODULES = ["scipy.stats", "xgboost", "sklearn.metrics", "sklearn.model_selection", "sklearn.preprocessing",
+                 "plotly.graph_objects", "openai"]
+
+# Insights narrated at the same time. The narrator batches concurrent prompts and the LLM backend
+# bounds its own concurrency, so this only needs to be large enough to fill a batch.
+NARRATION_WORKERS = int(os.environ.get("NARRATOR_NARRATION_WORKERS", 16))
+
+# Part of every stage cache key: bump it whenever a change alters what a cached stage returns.
+STAGE_VERSION = 9
+
+# --- Stage Cache ---
+# Cleaning and statistical analysis do not depend on the target column, so re-analyzing a dataset
+# with a different target only pays for modeling and storytelling. Any object with get(key) and
+# set(key, value) can be plugged in with set_stage_cache().
+stage_cache = cache.from_env()
+cache_stats = {}
+
+def set_stage_cache(backend):
+    """
+    Replaces the stage cache backend. Pass None to disable caching.
+    """
+    global stage_cache
+    stage_cache = backend
+
+def get_cache_stats():
+    """
+    Returns hits, misses and hit rate per stage since the process started, plus those of the
+    narrative cache under 'narratives'.
+    """
+    stats = {}
+    for stage, counts in cache_stats.items():
+        total = counts["hits"] + counts["misses"]
+        stats[stage] = dict(counts, hit_rate=counts["hits"] / total if total else 0.0)
+    narratives = narrative_cache.get_cache()
+    if narratives is not None:
+        stats["narratives"] = narratives.stats()
+    return stats
+
+def _cached(stage, key, compute):
+    """
+    Returns the cached result of a stage, or computes and stores it.
+    """
+    counts = cache_stats.setdefault(stage, {"hits": 0, "misses": 0})
+    if stage_cache is None:
+        counts["misses"] += 1
+        return compute()
+    value = stage_cache.get(key)
+    if value is not None:
+        counts["hits"] += 1
+        print(f"--> Reusing cached {stage} results.")
+        return value
+    counts["misses"] += 1
+    value = compute()
+    stage_cache.set(key, value)
+    return value
+
+def _stage_key(df, metadata, *params):
+    """
+    Keys a stage by the fingerprint of the pipeline's input and the stage's parameters.
+    """
+    if stage_cache is None:
+        return None
+    return cache.make_key(metadata.get("fingerprint") or cache.fingerprint(df), *params, STAGE_VERSION)
+
+def run_cleaning_task(data, stats=None):
     """
     Runs the data cleaning and preprocessing task.
+    The input's fingerprint is kept in the metadata to key the later stages.
     """
     print("Pipeline Task 1: Loading and Cleaning Data...")
-    df_clean, metadata = cleaning.clean_and_preprocess_data(data)
+    # Fingerprint before cleaning, which modifies `data` in place. Streaming statistics are part
+    # of the fingerprint because they change how a sampled frame is cleaned.
+    fingerprint = cache.make_key(cache.fingerprint(data), stats) if stage_cache is not None else None
+    key = cache.make_key(fingerprint, "cleaning", STAGE_VERSION)
+    df_clean, metadata = _cached("cleaning", key, lambda: cleaning.clean_and_preprocess_data(data, stats))
+    metadata["fingerprint"] = fingerprint
     return df_clean, metadata
 
+def run_profiling_task(df_clean, metadata, spent=0.0):
+    """
+    Profiles the cleaned data once for the later stages and chooses their sampling plan for
+    what is left of profiling.TIME_BUDGET after the `spent` seconds of the earlier stages and
+    the profiling itself. Both are added to the metadata as 'profile' and 'sampling'.
+    """
+    print("Pipeline Task 1b: Profiling Data...")
+    started = time.perf_counter()
+    key = _stage_key(df_clean, metadata, "profiling")
+    metadata["profile"] = _cached("profiling", key, lambda: profiling.profile(df_clean, metadata))
+    spent += time.perf_counter() - started
+    metadata["sampling"] = profiling.sampling_plan(len(df_clean), len(df_clean.columns), spent=spent)
+    for stage, plan in metadata["sampling"].items():
+        if plan["method"] != "exact":
+            print(f"--> {stage.capitalize()} works on a stratified sample of {plan['rows']:,} rows.")
+    return metadata
+
 def run_statistical_analysis_task(df_clean, metadata):
     """
     Runs the statistical analysis task.
     """
     print("Pipeline Task 2: Running Statistical Analysis...")
-    stat_insights = analysis.get_statistical_insights(df_clean, metadata)
+    key = _stage_key(df_clean, metadata, "analysis", metadata.get("sampling", {}).get("analysis"))
+    stat_insights = _cached("analysis", key, lambda: analysis.get_statistical_insights(df_clean, metadata))
     print(f"--> Found {len(stat_insights)} statistical insights.")
     return stat_insights
 
-def run_modeling_task(df_clean, metadata, target_col):
+def run_modeling_task(df_clean, metadata, target_cols):
     """
-    Runs the predictive modeling task.
+    Runs the predictive modeling task for one target column or a list of them.
     """
     print("Pipeline Task 3: Running Predictive Models...")
-    ml_insights = modeling.run_predictive_model(df_clean, metadata, target_col)
+    target_cols = [target_cols] if isinstance(target_cols, str) else list(target_cols)
+    key = _stage_key(df_clean, metadata, "modeling", target_cols, metadata.get("sampling", {}).get("modeling"))
+    ml_insights = _cached("modeling", key, lambda: modeling.run_predictive_models(df_clean, metadata, target_cols))
     print(f"--> Found {len(ml_insights)} ML insights.")
     return ml_insights
 
-def run_storytelling_task(all_insights, df_clean, output_dir):
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def run_storytelling_task(all_insights, df_clean, fingerprint=None, on_progress=None, deadline=None):
     """
-    Runs the narrative and visualization generation task.
+    Runs the narrative and visualization generation task. Every insight's narrative and figure
+    are scheduled at once, on separate thread pools, so narration (waiting on the LLM or the
+    model) overlaps with plotting. A failure only affects its own insight. Figures are plotly
+    JSON, which the report bundle stores (see core.bundle); with the input's `fingerprint`,
+    they are cached across runs. `on_progress(done, total)` is called
+    as each narrative finishes. LLM requests end by `deadline` (a time.monotonic() value).
     """
     print("\nPipeline Task 4: Generating Story and Visuals...")
-    report_insights = []
-    for insight in all_insights:
-        narrative = storytelling.generate_narrative_from_insight(insight)
-        plot_path = storytelling.create_visualization(insight, df_clean, output_dir)
-        
-        report_insights.append({
-            "title": insight['title'],
-            "narrative": narrative,
-            "plot_path": plot_path
-        })
+    if not all_insights:
+        return []
+    # Concurrent prompts still reach the narrator together, which batches them.
+    narrate_workers = max(1, min(NARRATION_WORKERS, len(all_insights)))
+    plot_workers = max(1, min(visualization.RENDER_WORKERS, len(all_insights)))
+    with ThreadPoolExecutor(max_workers=narrate_workers, thread_name_prefix="narrate") as narrate_pool, \
+            ThreadPoolExecutor(max_workers=plot_workers, thread_name_prefix="plot") as plot_pool:
+        # Each narration counts the backends it used in its own dict; the stage logs their total once.
+        sources = [{} for _ in all_insights]
+        narrations = [narrate_pool.submit(_timed, storytelling.generate_narrative_from_insight,
+                                          insight, deadline, counts)
+                      for insight, counts in zip(all_insights, sources)]
+        plots = [plot_pool.submit(_timed, visualization.create_figure, insight, df_clean, fingerprint)
+                 for insight in all_insights]
+        if on_progress:
+            finished = []
+            lock = threading.Lock()
+
+            def narrated(_):
+                with lock:
+                    finished.append(None)
+                    done = len(finished)
+                on_progress(done, len(narrations))
+
+            for narration in narrations:
+                narration.add_done_callback(narrated)
+
+        report_insights = []
+        for insight, narration, plot in zip(all_insights, narrations, plots):
+            entry = {"title": insight['title'], "narrative": None, "figure": None, "timings": {}}
+            try:
+                entry["narrative"], entry["timings"]["narrative_s"] = narration.result()
+            except Exception as e:
+                print(f"Warning: Could not generate a narrative for insight '{insight['title']}'. Error: {e}")
+                entry["narrative"] = storytelling.fallback_narrative(insight)
+                entry["error"] = str(e)
+            try:
+                entry["figure"], entry["timings"]["plot_s"] = plot.result()
+            except Exception as e:
+                print(f"Warning: Could not generate visualization for insight '{insight['title']}'. Error: {e}")
+                entry["error"] = str(e)
+            report_insights.append(entry)
+    totals = {}
+    for counts in sources:
+        for source, n in counts.items():
+            totals[source] = totals.get(source, 0) + n
+    labels = {"cache": "from the narrative cache", "llm": "from the local LLM",
+              "narrator": "from the fallback Hugging Face model", "default": "with the default text"}
+    if totals:
+        print("--> Narratives: " + ", ".join(f"{totals[source]} {label}" for source, label in labels.items()
+                                             if totals.get(source)) + ".")
     return report_insights
+
+def get_narrator_metrics():
+    """
+    Returns the narrator's batching, throughput and queue-time metrics, or None if unavailable.
+    """
+    try:
+        return narrator.get_narrator().metrics()
+    except Exception as e:
+        print(f"Could not read narrator metrics. Error: {e}")
+        return None
+
+def warm_up(load_narrator=False):
+    """
+    Imports the heavy libraries used by the pipeline stages and, optionally, loads the narrator
+    model, so the first job does not pay for them.
+    """
+    for module in HEAVY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"Warm-up: could not import {module}. Error: {e}")
+    if load_narrator:
+        narrator.get_narrator().warm_up()
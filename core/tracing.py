@@ -0,0 +1,178 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- Configuration ---
+# 'cprofile' profiles every job; a job can also ask for it with the API's profile flag.
+PROFILE = os.environ.get("NARRATOR_PROFILE", "off").lower() == "cprofile"
+PROFILE_TOP = 40
+
+# Histogram buckets of the metrics endpoint, in seconds and bytes.
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES_BUCKETS = tuple(2 ** power for power in range(20, 35, 2))
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None where it cannot be read."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Trace:
+    """
+    Per-stage measurements of one pipeline run: wall time, CPU time of the whole process (all
+    threads), growth of the peak RSS, the input's rows and columns, and the insights a stage
+    produced. stages() is written into the report.
+    """
+
+    def __init__(self):
+        self._stages = []
+
+    @contextmanager
+    def stage(self, name, data=None):
+        """
+        Measures the enclosed block as stage `name`, with `data` the frame it works on. The
+        yielded dict can be given an 'insights' count.
+        """
+        record = {"stage": name}
+        if data is not None and hasattr(data, "shape"):
+            record["rows"], record["cols"] = int(data.shape[0]), int(data.shape[1])
+        rss = peak_rss()
+        cpu = time.process_time()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - started
+            record["cpu_s"] = time.process_time() - cpu
+            record["peak_rss_delta_bytes"] = peak_rss() - rss if rss is not None else None
+            self._stages.append(record)
+            print(f"--> Stage '{name}' took {record['wall_s']:.2f}s (CPU {record['cpu_s']:.2f}s)")
+
+    def stages(self):
+        return list(self._stages)
+
+
+@contextmanager
+def profile(output_dir, enabled=None):
+    """
+    Runs the enclosed block under cProfile when `enabled` (default: NARRATOR_PROFILE) and writes
+    the statistics to `output_dir` as profile.pstats, for snakeviz or pstats, and as a
+    cumulative-time summary in profile.txt. Yields the path of the .pstats file, or None.
+    cProfile only sees the calling thread, so work done on thread pools shows up as waits.
+    """
+    if not (PROFILE if enabled is None else enabled):
+        yield None
+        return
+    path = os.path.join(output_dir, "profile.pstats")
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        os.makedirs(output_dir, exist_ok=True)
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(os.path.join(output_dir, "profile.txt"), "w") as f:
+            f.write(summary.getvalue())
+
+
+# --- Metrics ---
+
+class Histogram:
+    """A Prometheus-style histogram with one series per label value."""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label_value, value):
+        counts, total = self._series.get(label_value, ([0] * len(self.buckets), [0, 0.0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        total[0] += 1
+        total[1] += value
+        self._series[label_value] = (counts, total)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, (count, total)) in sorted(self._series.items()):
+            label = f'{self.label}="{label_value}"'
+            lines += [f'{self.name}_bucket{{{label},le="{bound:g}"}} {n}' for bound, n in zip(self.buckets, counts)]
+            lines += [f'{self.name}_bucket{{{label},le="+Inf"}} {count}',
+                      f"{self.name}_sum{{{label}}} {total:g}", f"{self.name}_count{{{label}}} {count}"]
+        return lines
+
+
+class Counter:
+    """A Prometheus-style counter with one series per label value."""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._series = {}
+
+    def inc(self, label_value, amount=1):
+        self._series[label_value] = self._series.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f'{self.name}{{{self.label}="{value}"}} {n:g}' for value, n in sorted(self._series.items())]
+        return lines
+
+
+STAGE_SECONDS = Histogram("narrator_stage_seconds", "Wall time of a pipeline stage.", "stage", SECONDS_BUCKETS)
+STAGE_CPU_SECONDS = Histogram("narrator_stage_cpu_seconds", "CPU time of a pipeline stage, all threads.", "stage",
+                              SECONDS_BUCKETS)
+STAGE_RSS_DELTA = Histogram("narrator_stage_peak_rss_delta_bytes", "Growth of the job process's peak RSS in a stage.",
+                            "stage", BYTES_BUCKETS)
+STAGE_INSIGHTS = Counter("narrator_stage_insights_total", "Insights produced per stage.", "stage")
+JOB_SECONDS = Histogram("narrator_job_seconds", "Run time of finished analysis jobs.", "status", SECONDS_BUCKETS)
+JOBS = Counter("narrator_jobs_total", "Finished analysis jobs.", "status")
+_metrics_lock = threading.Lock()
+
+
+def observe_job(status, seconds=None, stages=()):
+    """Adds a finished job and the stage records of its trace to the metrics."""
+    with _metrics_lock:
+        JOBS.inc(status)
+        if seconds is not None:
+            JOB_SECONDS.observe(status, seconds)
+        for record in stages:
+            STAGE_SECONDS.observe(record["stage"], record["wall_s"])
+            STAGE_CPU_SECONDS.observe(record["stage"], record["cpu_s"])
+            if record.get("peak_rss_delta_bytes") is not None:
+                STAGE_RSS_DELTA.observe(record["stage"], record["peak_rss_delta_bytes"])
+            if "insights" in record:
+                STAGE_INSIGHTS.inc(record["stage"], record["insights"])
+
+
+def render_metrics(gauges=None):
+    """Returns the metrics in the Prometheus text format, with `gauges` as extra {name: value} gauges."""
+    lines = []
+    for name, value in (gauges or {}).items():
+        lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+    with _metrics_lock:
+        for metric in (JOBS, JOB_SECONDS, STAGE_SECONDS, STAGE_CPU_SECONDS, STAGE_RSS_DELTA, STAGE_INSIGHTS):
+            lines += metric.render()
+    return "\n".join(lines) + "\n"
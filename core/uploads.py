@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# --- Configuration ---
+UPLOAD_DIR = os.environ.get("NARRATOR_UPLOAD_DIR", os.path.join('output', 'uploads'))
+MAX_UPLOAD_BYTES = int(os.environ.get("NARRATOR_MAX_UPLOAD_BYTES", 10 * 1024 ** 3))
+# Unfinished resumable uploads are removed after this many seconds without a new chunk.
+UPLOAD_TTL = float(os.environ.get("NARRATOR_UPLOAD_TTL", 24 * 3600))
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+class UploadNotFoundError(Exception):
+    """Raised for an unknown or expired upload id."""
+
+
+class OffsetMismatchError(Exception):
+    """Raised when a chunk does not start where the upload currently ends."""
+
+    def __init__(self, expected):
+        super().__init__(f"Expected a chunk at offset {expected}.")
+        self.expected = expected
+
+
+class UploadBusyError(Exception):
+    """Raised when a chunk arrives while another chunk of the same upload is being written."""
+
+
+class Spool:
+    """
+    Writes a stream of byte chunks to a file while computing its SHA-256 and enforcing a size
+    limit, so an upload is never held in memory. abort() removes the partial file.
+    """
+
+    def __init__(self, path, max_bytes=MAX_UPLOAD_BYTES, mode='wb', offset=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = offset
+        self.digest = hashlib.sha256()
+        self._file = open(path, mode)
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"Uploads are limited to {self.max_bytes} bytes.")
+        self.digest.update(chunk)
+        self._file.write(chunk)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _upload_paths(upload_id, upload_dir=UPLOAD_DIR):
+    # The id is generated by us, but it arrives in URLs: only accept what create_upload produces.
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise UploadNotFoundError(upload_id)
+    base = os.path.join(upload_dir, f"resumable-{upload_id}")
+    return base + '.part', base + '.json'
+
+
+def _read_meta(meta_path):
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def _write_meta(meta_path, meta):
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def create_upload(file_name, size=None, upload_dir=UPLOAD_DIR):
+    """
+    Starts a resumable upload of `file_name`, optionally announcing its total `size`.
+    Returns the upload id. Expired unfinished uploads are removed on the way.
+    """
+    if size is not None and size > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(f"Uploads are limited to {MAX_UPLOAD_BYTES} bytes.")
+    os.makedirs(upload_dir, exist_ok=True)
+    remove_expired(upload_dir)
+    upload_id = str(uuid.uuid4())
+    data_path, meta_path = _upload_paths(upload_id, upload_dir)
+    open(data_path, 'wb').close()
+    _write_meta(meta_path, {"file_name": file_name, "size": size, "complete": False, "sha256": None})
+    return upload_id
+
+
+def upload_status(upload_id, upload_dir=UPLOAD_DIR):
+    """Returns the upload's file name, announced size, bytes received so far and completion state."""
+    data_path, meta_path = _upload_paths(upload_id, upload_dir)
+    if not os.path.exists(meta_path):
+        raise UploadNotFoundError(upload_id)
+    meta = _read_meta(meta_path)
+    return dict(meta, upload_id=upload_id, offset=os.path.getsize(data_path))
+
+
+# Uploads with a chunk being written by this process, where fcntl locks are not available.
+_writing = set()
+_writing_lock = threading.Lock()
+
+
+def _lock_chunk(spool, upload_id):
+    """
+    Takes the upload's write lock for the spool: an exclusive flock on its file, which other API
+    processes see and which is released when the file is closed, even if the process dies.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(spool._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+    with _writing_lock:
+        if upload_id in _writing:
+            return False
+        _writing.add(upload_id)
+        return True
+
+
+def open_chunk(upload_id, offset, upload_dir=UPLOAD_DIR):
+    """
+    Returns a Spool that appends one chunk to an upload. `offset` must equal the bytes received
+    so far, so that a client resuming after a dropped connection neither skips nor repeats data.
+    The spool holds the upload's write lock until finish_chunk, so of two chunks sent at the same
+    offset one is written and the other is refused with UploadBusyError or OffsetMismatchError.
+    """
+    status = upload_status(upload_id, upload_dir)
+    if status["complete"] or offset != status["offset"]:
+        raise OffsetMismatchError(status["offset"])
+    limit = min(MAX_UPLOAD_BYTES, status["size"]) if status["size"] is not None else MAX_UPLOAD_BYTES
+    spool = Spool(_upload_paths(upload_id, upload_dir)[0], limit, mode='ab', offset=offset)
+    if not _lock_chunk(spool, upload_id):
+        spool.close()
+        raise UploadBusyError(upload_id)
+    # Checked again under the lock: a chunk may have been written since the status was read.
+    written = os.fstat(spool._file.fileno()).st_size
+    if written != offset:
+        finish_chunk(spool, upload_id)
+        raise OffsetMismatchError(written)
+    return spool
+
+
+def finish_chunk(spool, upload_id):
+    """
+    Closes a chunk's spool and releases the upload's write lock. A partially written chunk is
+    kept and the client resumes after it.
+    """
+    spool.close()
+    if fcntl is None:
+        with _writing_lock:
+            _writing.discard(upload_id)
+    data_path, meta_path = _upload_paths(upload_id, os.path.dirname(spool.path))
+    # Touch the metadata, which the expiry is based on.
+    os.utime(meta_path)
+    return os.path.getsize(data_path)
+
+
+def complete_upload(upload_id, sha256=None, upload_dir=UPLOAD_DIR):
+    """
+    Marks an upload as complete and returns its SHA-256. The digest is checked against `sha256`
+    when given, and the size against the announced size.
+    """
+    status = upload_status(upload_id, upload_dir)
+    data_path, meta_path = _upload_paths(upload_id, upload_dir)
+    if status["complete"]:
+        return status["sha256"]
+    if status["size"] is not None and status["offset"] != status["size"]:
+        raise OffsetMismatchError(status["offset"])
+    digest = hashlib.sha256()
+    with open(data_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    if sha256 and sha256.lower() != digest:
+        raise ValueError(f"Checksum mismatch: received data has SHA-256 {digest}.")
+    meta = _read_meta(meta_path)
+    meta.update(complete=True, sha256=digest)
+    _write_meta(meta_path, meta)
+    return digest
+
+
+def claim_upload(upload_id, path, upload_dir=UPLOAD_DIR):
+    """
+    Hands a completed upload over to a job: moves its data to `path` and forgets the upload.
+    Returns (file_name, sha256).
+    """
+    status = upload_status(upload_id, upload_dir)
+    if not status["complete"]:
+        raise OffsetMismatchError(status["offset"])
+    data_path, meta_path = _upload_paths(upload_id, upload_dir)
+    shutil.move(data_path, path)
+    os.remove(meta_path)
+    return status["file_name"], status["sha256"]
+
+
+def remove_expired(upload_dir=UPLOAD_DIR, ttl=UPLOAD_TTL):
+    """Removes resumable uploads whose last chunk arrived more than `ttl` seconds ago."""
+    if not os.path.isdir(upload_dir):
+        return
+    now = time.time()
+    for name in os.listdir(upload_dir):
+        if not (name.startswith('resumable-') and name.endswith('.json')):
+            continue
+        meta_path = os.path.join(upload_dir, name)
+        try:
+            if now - os.path.getmtime(meta_path) > ttl:
+                os.remove(meta_path)
+                data_path = meta_path[:-len('.json')] + '.part'
+                if os.path.exists(data_path):
+                    os.remove(data_path)
+        except OSError:
+            pass
@@ -0,0 +1,184 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from core import cache
+
+# --- Configuration ---
+# Most points a scatter plot embeds. Larger inputs are downsampled; the trendline and the box
+# statistics are always computed from every row.
+POINT_BUDGET = int(os.environ.get("NARRATOR_PLOT_POINTS", 5000))
+# Figures the storytelling stage renders at the same time (see core.tasks.run_storytelling_task).
+RENDER_WORKERS = int(os.environ.get("NARRATOR_PLOT_WORKERS", 4))
+PLOT_CACHE_DIR = os.environ.get("NARRATOR_PLOT_CACHE_DIR", os.path.join('output', 'cache', 'plots'))
+PLOT_CACHE_ENTRIES = int(os.environ.get("NARRATOR_PLOT_CACHE_ENTRIES", 1024))
+# 'off' renders every figure again.
+PLOT_CACHE = os.environ.get("NARRATOR_PLOT_CACHE", "on").lower() != "off"
+# Number of x-quantile strata a scatter plot's sample is drawn from.
+SCATTER_STRATA = 50
+# Part of every plot cache key: bump it whenever a change alters the rendered figures.
+PLOT_VERSION = 4
+
+
+def stratified_sample(strata: np.ndarray, budget: int, seed=0) -> np.ndarray:
+    """
+    Returns the sorted positions of about `budget` rows, sampled without replacement so that each
+    stratum keeps its share of the rows (and at least one row). `strata` holds integer codes.
+    """
+    n = len(strata)
+    if n <= budget:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    codes, strata = np.unique(strata, return_inverse=True)
+    sizes = np.bincount(strata, minlength=len(codes))
+    quotas = np.maximum(1, np.round(sizes * (budget / n))).astype(np.int64)
+    # Shuffle within each stratum by sorting on (stratum, random key), then keep each stratum's head.
+    order = np.lexsort((rng.random(n), strata))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    rank = np.arange(n) - starts[strata[order]]
+    return np.sort(order[rank < quotas[strata[order]]])
+
+
+def _scatter_payload(df, x, y, budget):
+    values = df[[x, y]].to_numpy(dtype=np.float64)
+    values = values[~np.isnan(values).any(axis=1)]
+    if not len(values):
+        return None
+    xs, ys = values[:, 0], values[:, 1]
+    # Least-squares line from sufficient statistics, the same fit as an OLS trendline.
+    x_mean, y_mean = xs.mean(), ys.mean()
+    sxx = ((xs - x_mean) ** 2).sum()
+    slope = ((xs - x_mean) * (ys - y_mean)).sum() / sxx if sxx else 0.0
+    intercept = y_mean - slope * x_mean
+    strata = np.zeros(len(xs), dtype=np.int64)
+    if len(xs) > budget:
+        edges = np.unique(np.quantile(xs, np.linspace(0, 1, SCATTER_STRATA + 1)[1:-1]))
+        strata = np.searchsorted(edges, xs, side='right')
+    keep = stratified_sample(strata, budget)
+    line_x = np.array([xs.min(), xs.max()])
+    return {"x": xs[keep], "y": ys[keep], "line_x": line_x, "line_y": intercept + slope * line_x,
+            "rows": len(xs)}
+
+
+def _box_payload(df, category, value):
+    frame = df[[category, value]].dropna()
+    if frame.empty:
+        return None
+    grouped = frame.groupby(category, observed=True, sort=True)[value]
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    q1, median, q3 = quartiles[0.25], quartiles[0.5], quartiles[0.75]
+    iqr = q3 - q1
+    # Whiskers end at the most extreme values within 1.5 IQR of the box, as plotly draws them.
+    low = frame[value] >= frame[category].map(q1 - 1.5 * iqr).astype(np.float64)
+    high = frame[value] <= frame[category].map(q3 + 1.5 * iqr).astype(np.float64)
+    lowerfence = frame[low].groupby(category, observed=True)[value].min().reindex(q1.index)
+    upperfence = frame[high].groupby(category, observed=True)[value].max().reindex(q1.index)
+    return {"groups": [str(group) for group in q1.index], "q1": q1.to_numpy(), "median": median.to_numpy(),
+            "q3": q3.to_numpy(), "lowerfence": lowerfence.fillna(q1).to_numpy(),
+            "upperfence": upperfence.fillna(q3).to_numpy(), "mean": grouped.mean().to_numpy()}
+
+
+def prepare(insight: dict, df: pd.DataFrame, budget=POINT_BUDGET):
+    """
+    Reduces the data an insight's figure needs to a small payload: a stratified sample and a
+    trendline for a correlation, per-category box statistics for a difference, the importance
+    table for feature importance. Returns None if there is nothing to plot.
+    """
+    details = insight.get('details', {})
+    if insight['type'] == 'correlation':
+        if details['feature1'] in df.columns and details['feature2'] in df.columns:
+            return _scatter_payload(df, details['feature1'], details['feature2'], budget)
+    elif insight['type'] == 'significant_difference':
+        if details['numeric_feature'] in df.columns and details['categorical_feature'] in df.columns:
+            return _box_payload(df, details['categorical_feature'], details['numeric_feature'])
+    elif insight['type'] == 'feature_importance':
+        return {"features": pd.DataFrame(details['features'])}
+    return None
+
+
+def build_figure(insight: dict, payload: dict):
+    """Builds the plotly figure of an insight from its prepared payload."""
+    import plotly.graph_objects as go
+    details = insight['details']
+    fig = go.Figure()
+    if insight['type'] == 'correlation':
+        fig.add_trace(go.Scatter(x=payload['x'], y=payload['y'], mode='markers', name='data', showlegend=False))
+        fig.add_trace(go.Scatter(x=payload['line_x'], y=payload['line_y'], mode='lines', name='OLS trendline'))
+        fig.update_xaxes(title_text=details['feature1'])
+        fig.update_yaxes(title_text=details['feature2'])
+        if len(payload['x']) < payload['rows']:
+            fig.add_annotation(text=f"{len(payload['x']):,} of {payload['rows']:,} rows shown",
+                               xref='paper', yref='paper', x=1, y=1.05, showarrow=False)
+    elif insight['type'] == 'significant_difference':
+        for i, group in enumerate(payload['groups']):
+            fig.add_trace(go.Box(x=[group], name=group, q1=[payload['q1'][i]], median=[payload['median'][i]],
+                                 q3=[payload['q3'][i]], lowerfence=[payload['lowerfence'][i]],
+                                 upperfence=[payload['upperfence'][i]], mean=[payload['mean'][i]]))
+        fig.update_xaxes(title_text=details['categorical_feature'])
+        fig.update_yaxes(title_text=details['numeric_feature'])
+        fig.update_layout(legend_title_text=details['categorical_feature'])
+    elif insight['type'] == 'feature_importance':
+        # graph_objects rather than plotly.express, which is not safe to call from several render threads.
+        features = payload['features']
+        fig.add_trace(go.Bar(x=features['importance'], y=features['feature'], orientation='h'))
+        fig.update_xaxes(title_text='importance')
+        fig.update_yaxes(title_text='feature', categoryorder="total ascending")
+    fig.update_layout(title_text=insight['title'])
+    return fig
+
+
+def _cache_key(insight, fingerprint, budget):
+    return cache.make_key(fingerprint, insight['type'], insight.get('details'), insight['title'], budget, PLOT_VERSION)
+
+
+def _evict_plots(cache_dir=PLOT_CACHE_DIR, max_entries=PLOT_CACHE_ENTRIES):
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json')]
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def create_figure(insight: dict, df: pd.DataFrame, fingerprint: str | None = None,
+                  budget: int = POINT_BUDGET) -> str | None:
+    """
+    Returns an insight's plotly figure as JSON, or None. With a data `fingerprint`, the figure
+    is cached and read back on later runs instead of being built again.
+    """
+    details = insight.get('details', {})
+    # Only proceed if details is a dict
+    if not isinstance(details, dict):
+        print(f"Skipping visualization for insight '{insight.get('title', '')}' because details is not a dict.")
+        return None
+
+    cached_path = None
+    try:
+        if PLOT_CACHE and fingerprint:
+            cached_path = os.path.join(PLOT_CACHE_DIR, _cache_key(insight, fingerprint, budget) + '.json')
+            if os.path.exists(cached_path):
+                with open(cached_path, encoding='utf-8') as f:
+                    figure = f.read()
+                os.utime(cached_path)
+                return figure
+        payload = prepare(insight, df, budget)
+        if payload is None:
+            return None
+        figure = build_figure(insight, payload).to_json()
+    except Exception as e:
+        print(f"Warning: Could not generate visualization for insight '{insight['title']}'. Error: {e}")
+        return None
+    if cached_path:
+        try:
+            os.makedirs(PLOT_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(figure)
+            os.replace(tmp_path, cached_path)
+            _evict_plots()
+        except OSError as e:
+            print(f"Warning: Could not cache visualization for insight '{insight['title']}'. Error: {e}")
+    return figure
@@ -1,20 +1,55 @@
 import argparse
-import pandas as pd
-from pipeline import run_full_pipeline
 
 def main():
     """
     Main function to run the NarratorAI pipeline from the command line.
     """
     parser = argparse.ArgumentParser(description="NarratorAI: Automated Data Storytelling Bot")
-    parser.add_argument("file_path", type=str, help="Path to the CSV file to analyze.")
-    parser.add_argument("target_col", type=str, help="Name of the target column for analysis.")
+    parser.add_argument("file_path", type=str,
+                        help="Path to the file to analyze: CSV, Parquet, Feather/Arrow, NDJSON or JSON, optionally .gz/.zst compressed.")
+    parser.add_argument("target_cols", type=str, nargs="+", metavar="target_col",
+                        help="Name of the target column for analysis. Several targets share one run and one report.")
+    parser.add_argument("--stream", action="store_true", default=None,
+                        help="Read the file in chunks (default for files above NARRATOR_STREAMING_THRESHOLD).")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Rows per chunk when streaming (default: NARRATOR_CHUNK_SIZE or 100000).")
+    parser.add_argument("--sample-rows", type=int, default=None,
+                        help="Size of the reservoir sample analyzed when streaming (default: NARRATOR_SAMPLE_ROWS or 500000).")
+    parser.add_argument("--spill", type=str, default=None,
+                        help="When streaming, analyze all rows via this memory-mapped Arrow spill file instead of a sample.")
+    parser.add_argument("--append", type=str, default=None, metavar="DATASET_ID",
+                        help="Treat the file as a batch appended to this dataset and update its saved analysis incrementally.")
+    parser.add_argument("--profile", action="store_true", default=None,
+                        help="Run under cProfile and write profile.pstats and profile.txt next to the report.")
+    parser.add_argument("--json", type=str, default=None, metavar="PATH",
+                        help="Also write the report, without its figures, to PATH as readable JSON.")
     
     args = parser.parse_args()
+
+    # Imported after argument parsing so that --help and usage errors return immediately.
+    import json
+    from core import bundle, ingestion, store, tracing
+    from pipeline import run_full_pipeline, PIPELINE_VERSION
     
     try:
-        data = pd.read_csv(args.file_path)
-        run_full_pipeline(args.file_path, data, args.target_col)
+        key = store.report_key(store.file_digest(args.file_path), args.target_cols, PIPELINE_VERSION)
+        if args.append:
+            # An incremental report depends on every batch so far, not just this file.
+            key = store.report_key(key, args.append, PIPELINE_VERSION)
+        trace = tracing.Trace()
+        with tracing.profile(store.report_dir(key), args.profile):
+            with trace.stage("ingestion") as record:
+                # An appended batch is folded in whole, never as a streamed sample.
+                data, stats = ingestion.load_table(args.file_path, None, False if args.append else args.stream,
+                                                   args.chunksize or ingestion.CHUNK_SIZE,
+                                                   args.sample_rows or ingestion.SAMPLE_ROWS, args.spill)
+                record["rows"], record["cols"] = int(data.shape[0]), int(data.shape[1])
+            report_path = run_full_pipeline(args.file_path, data, args.target_cols, store.report_dir(key), stats,
+                                            trace=trace, dataset_id=args.append)
+        if args.json and report_path:
+            with open(args.json, 'w') as f:
+                json.dump(bundle.read_report(report_path), f, indent=4)
+            print(f"Report written to {args.json}")
     except FileNotFoundError:
         print(f"Error: The file '{args.file_path}' was not found.")
     except Exception as e:
@@ -1,39 +1,159 @@
+import itertools
 import os
-import json
-from core import tasks
+import threading
+import time
+from core import bundle, executor, incremental, ingestion, jobstore, profiling, store, tasks, tracing
 
-def run_full_pipeline(fname, data, target_col):
+# Part of every report's content address: bump it whenever a change alters report contents,
+# so that stored reports from older versions are no longer served.
+PIPELINE_VERSION = "0.8.1"
+# Seconds of a job's time left for writing the report once the LLM narration deadline has passed.
+REPORT_RESERVE = 30
+
+def run_full_pipeline(fname, data, target_cols, output_dir=None, stats=None, progress=None, trace=None,
+                      dataset_id=None, deadline=None):
     """
-    Orchestrates the entire data storytelling pipeline using modular tasks.
+    Orchestrates the entire data storytelling pipeline using modular tasks. `target_cols` is one
+    target column or a list of them; cleaning, analysis and feature encoding are shared by all
+    targets, and their insights go into one report.
+    The report, with its figures, is written to `output_dir` (default 'output') as one bundle
+    file (see core.bundle), whose path is returned. `stats` are the full-file statistics
+    returned by streaming ingestion when `data` is only a sample.
+    `progress(stage, message, done=None, total=None)` is called as each stage finishes. Each
+    task is measured by `trace` (a new core.tracing.Trace by default) and the measurements are
+    written into the report under 'trace'. With a `deadline` (a time.monotonic() value), LLM
+    narration requests stop in time for the report to be written before it.
+
+    The cleaned data is profiled once (see core.profiling). On inputs above EXACT_ROWS rows the
+    analysis, modeling and plotting stages work on samples sized to fit NARRATOR_TIME_BUDGET,
+    the modeling and plotting samples stratified on the first target; the profile and the
+    sampling plan are written into the report.
+
+    With a `dataset_id`, `data` is a batch appended to that dataset (see core.incremental): it
+    is cleaned with statistics of all rows so far and folded into the dataset's saved state, the
+    statistical insights come from that state, the models are warm-started or retrained on drift,
+    and plots are drawn from a uniform sample of all rows. The work depends on the batch size,
+    not on the size of the dataset.
     """
-    output_dir = os.path.join('output')
+    progress = progress or (lambda *args, **kwargs: None)
+    trace = trace or tracing.Trace()
+    output_dir = output_dir or os.path.join('output')
     os.makedirs(output_dir, exist_ok=True)
     
-    report = {"title": f"Data Story for {fname}", "insights": []}
+    target_cols = [target_cols] if isinstance(target_cols, str) else list(dict.fromkeys(target_cols))
+    report = {"title": f"Data Story for {fname}", "targets": target_cols, "insights": []}
+
+    state = None
+    if dataset_id:
+        state = incremental.load(dataset_id)
+        stats = state.observe(data, incremental.batch_fingerprint(data))
 
     # Task 1: Ingest and Clean Data
-    df_clean, metadata = tasks.run_cleaning_task(data)
+    with trace.stage("cleaning", data):
+        df_clean, metadata = tasks.run_cleaning_task(data, stats)
+        if state is not None:
+            batch = df_clean
+            state.fold(batch, metadata)
+            df_clean, metadata = state.sample(), state.metadata()
+            report["incremental"] = {"dataset_id": dataset_id, "rows": state.rows, "batch_rows": len(batch),
+                                     "batches": len(state.batches)}
+    progress("cleaning", f"Cleaned {len(df_clean):,} rows and {len(df_clean.columns)} columns.")
+
+    # Profiling: distinct counts, null fractions and types shared by the later stages, and the
+    # rows each of them works on (see core.profiling).
+    with trace.stage("profiling", df_clean):
+        metadata = tasks.run_profiling_task(df_clean, metadata, sum(record["wall_s"] for record in trace.stages()))
     
     # Task 2: Statistical Analysis
-    stat_insights = tasks.run_statistical_analysis_task(df_clean, metadata)
+    with trace.stage("analysis", df_clean) as record:
+        if state is not None:
+            stat_insights = state.insights()
+        else:
+            stat_insights = tasks.run_statistical_analysis_task(df_clean, metadata)
+        record["insights"] = len(stat_insights)
+    progress("analysis", f"Found {len(stat_insights)} statistical insight(s).")
     
     # Task 3: Predictive Modeling
-    ml_insights = tasks.run_modeling_task(df_clean, metadata, target_col)
+    with trace.stage("modeling", df_clean) as record:
+        if state is not None:
+            ml_insights = state.update_models(batch, df_clean, target_cols)
+            incremental.save(dataset_id, state)
+        else:
+            ml_insights = tasks.run_modeling_task(df_clean, metadata, target_cols)
+        record["insights"] = len(ml_insights)
     
     all_insights = stat_insights + ml_insights
     print(f"--> Total insights to process: {len(all_insights)}")
+    progress("modeling", f"Found {len(all_insights)} insight(s) in total.", 0, len(all_insights))
 
     if not all_insights:
         print("\n\n*** No significant insights found based on current criteria. Pipeline will stop here. ***\n\n")
         return None
 
     # Task 4: Narrative and Visualization Generation
-    report["insights"] = tasks.run_storytelling_task(all_insights, df_clean, output_dir)
+    with trace.stage("storytelling", df_clean) as record:
+        # Plots are drawn from rows stratified on the first target, like the models are fitted on.
+        plot_rows = profiling.stage_sample(df_clean, metadata, "plotting", target_cols[0])
+        report["insights"] = tasks.run_storytelling_task(
+            all_insights, plot_rows, metadata.get("fingerprint"),
+            on_progress=lambda done, total: progress("narration", f"Narrated {done} of {total} insight(s).", done, total),
+            deadline=deadline - REPORT_RESERVE if deadline is not None else None)
+        record["insights"] = len(report["insights"])
         
     # Task 5: Assemble Final Report
-    report_path = os.path.join(output_dir, 'report.json')
-    with open(report_path, 'w') as f:
-        json.dump(report, f, indent=4)
-        
+    # The report cannot contain the time it takes to write itself, so this stage ends before the write.
+    with trace.stage("report"):
+        report["profile"] = metadata["profile"]
+        report["sampling"] = metadata["sampling"]
+        report["cache"] = tasks.get_cache_stats()
+        report["narrator"] = tasks.get_narrator_metrics()
+    report["trace"] = trace.stages()
+    # One bundle file holds the report and its figures (see core.bundle).
+    report_path = bundle.write(report, os.path.join(output_dir, store.REPORT_FILENAME))
+
+    progress("report", "Report saved.")
     print(f"Pipeline finished. Report saved to {report_path}")
     return report_path
+
+
+def job_progress(job_id):
+    """
+    Returns a progress callback that records each stage's event as the job's progress in the job
+    store, where the API streams it to clients from. Failing to record progress never fails the job.
+    """
+    store = jobstore.get_store()
+    seq = itertools.count(1)
+    # Narration reports from several threads; the lock keeps events in order.
+    lock = threading.Lock()
+
+    def progress(stage, message, done=None, total=None):
+        with lock:
+            event = {"seq": next(seq), "stage": stage, "message": message, "done": done, "total": total}
+            try:
+                store.update(job_id, progress=event)
+            except Exception as e:
+                print(f"Warning: Could not record job progress. Error: {e}")
+
+    return progress
+
+
+def run_pipeline_job(file_path, fname, target_cols, output_dir, job_id=None, profile=None):
+    """
+    Reads an uploaded file and runs the full pipeline on it. This is the unit of work
+    the API hands to its job processes, so it only takes picklable arguments. The format is
+    detected from the uploaded file's name `fname` or its contents, and large files are
+    streamed in chunks, see core.ingestion.load_table. With a `job_id`, stage progress is
+    recorded in the job store. With `profile` (default: NARRATOR_PROFILE), the whole job runs
+    under cProfile and profile.pstats/profile.txt are written next to the report.
+    The job's LLM requests end before the executor's NARRATOR_JOB_TIMEOUT would stop it.
+    """
+    deadline = time.monotonic() + executor.JOB_TIMEOUT
+    progress = job_progress(job_id) if job_id else None
+    trace = tracing.Trace()
+    with tracing.profile(output_dir, profile):
+        with trace.stage("ingestion") as record:
+            data, stats = ingestion.load_table(file_path, fname)
+            record["rows"], record["cols"] = int(data.shape[0]), int(data.shape[1])
+        if progress:
+            progress("ingestion", f"Read {fname}.")
+        return run_full_pipeline(fname, data, target_cols, output_dir, stats, progress, trace, deadline=deadline)